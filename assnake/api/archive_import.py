@@ -0,0 +1,142 @@
+import os
+import shutil
+import fnmatch
+import tarfile
+import zipfile
+from collections import namedtuple
+
+from assnake.api.discovery import get_import_classifier, SINGLE_END_CLASSIFIER, FASTQ_GZ_EXT
+from assnake.api.loaders import map_io
+from assnake.api.fs_helpers import merge_gz_files
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# name is a tuple of member names ordered by lane for samples sequenced in several lanes
+ArchiveMember = namedtuple('ArchiveMember', ['name', 'df_sample', 'strand', 'dst_name', 'size'])
+
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _list_archive(archive_loc):
+    '''
+    Returns list of (member name, size) of regular files in archive. Reads only the index of zip files.
+    '''
+    if zipfile.is_zipfile(archive_loc):
+        with zipfile.ZipFile(archive_loc) as archive:
+            return [(info.filename, info.file_size) for info in archive.infolist() if not info.is_dir()]
+    with tarfile.open(archive_loc, 'r:*') as archive:
+        return [(member.name, member.size) for member in archive if member.isfile()]
+
+
+def plan_archive_import(archive_loc, pattern='*' + FASTQ_GZ_EXT, modify_name=None, samples=None, report=None):
+    '''
+    Finds read files in archive and decides names they will have in the dataset: `{df_sample}_{strand}.fastq.gz`.
+    Member names are classified the same way as files in directory with reads, see fs_helpers.classify_run_dir.
+    Lanes of the same sample and strand are merged into one file in the order of lanes.
+    Several members for one sample and strand that are not different lanes are ambiguous and are not imported.
+
+    :param pattern: glob pattern for full member names, for example `*/raw_data/*.fastq.gz`
+    :param modify_name: function applied to sample names.
+    :param samples: import only these samples (names after modify_name).
+    :param report: list to which members that can't be imported are appended as dicts with file, name_in_run and problem.
+    :return: list of ArchiveMember
+    '''
+    candidates = [(name, size) for name, size in _list_archive(archive_loc) if fnmatch.fnmatch(name, pattern)]
+
+    classified = [(name, size, get_import_classifier().classify(os.path.basename(name))) for name, size in candidates]
+    if all(c is None for _, _, c in classified):
+        classified = [(name, size, SINGLE_END_CLASSIFIER.classify(os.path.basename(name))) for name, size in candidates]
+
+    # (df_sample, strand) -> [(name, size, lane)]
+    grouped = {}
+    for name, size, c in sorted(classified, key=lambda m: m[0]):
+        if c is None:
+            continue
+        df_sample = modify_name(c.df_sample) if modify_name is not None else c.df_sample
+        if samples is not None and df_sample not in samples:
+            continue
+        grouped.setdefault((df_sample, c.strand), []).append((name, size, c.lane))
+
+    members = []
+    for (df_sample, strand), files in grouped.items():
+        dst_name = '{df_sample}_{strand}{ext}'.format(df_sample=df_sample, strand=strand, ext=FASTQ_GZ_EXT)
+        if len(files) == 1:
+            members.append(ArchiveMember(files[0][0], df_sample, strand, dst_name, files[0][1]))
+            continue
+        lanes = [lane for _, _, lane in files]
+        if None in lanes or len(set(lanes)) < len(lanes):
+            if report is not None:
+                report.extend({'file': name, 'name_in_run': df_sample, 'problem': 'ambiguous'} for name, _, _ in files)
+            continue
+        files = sorted(files, key=lambda f: int(f[2]))
+        members.append(ArchiveMember(tuple(name for name, _, _ in files), df_sample, strand, dst_name, sum(size for _, size, _ in files)))
+    return members
+
+
+def member_names(member):
+    return member.name if isinstance(member.name, tuple) else (member.name,)
+
+
+def _stream_to(srcs, dst_loc):
+    # Partially written files are never visible under the final name. Lanes are concatenated, like in fs_helpers.merge_gz_files
+    tmp_loc = dst_loc + '.part'
+    with open(tmp_loc, 'wb') as dst:
+        for src in srcs:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+    os.replace(tmp_loc, dst_loc)
+
+
+def extract_reads(archive_loc, target_dir, pattern='*' + FASTQ_GZ_EXT, modify_name=None, samples=None, overwrite=False, workers=None, report=None):
+    '''
+    Streams read files from zip or tar archive straight into `target_dir`, without extracting anything else
+    and without intermediate directories. Members of zip archives are extracted in parallel by `workers` threads,
+    each with its own handle of the archive. Tar archives are read in one sequential pass,
+    lanes that come out of order are kept in `.part` files until all lanes of the sample are read.
+
+    :param report: list for members that can't be imported, see plan_archive_import.
+    :return: list of paths of extracted files.
+    '''
+    members = plan_archive_import(archive_loc, pattern, modify_name, samples, report)
+    os.makedirs(target_dir, exist_ok=True)
+    if not overwrite:
+        members = [m for m in members if not os.path.exists(os.path.join(target_dir, m.dst_name))]
+    if len(members) == 0:
+        return []
+
+    if zipfile.is_zipfile(archive_loc):
+        def extract_member(member):
+            with zipfile.ZipFile(archive_loc) as archive:
+                def srcs():
+                    for name in member_names(member):
+                        with archive.open(name) as src:
+                            yield src
+                _stream_to(srcs(), os.path.join(target_dir, member.dst_name))
+            return os.path.join(target_dir, member.dst_name)
+        return map_io(extract_member, members, workers)
+
+    by_name = {name: m for m in members for name in member_names(m)}
+    lane_parts = {} # dst_name -> {member name: location of extracted lane}
+    extracted = []
+    with tarfile.open(archive_loc, 'r|*') as archive:
+        for tar_member in archive:
+            member = by_name.get(tar_member.name)
+            if member is None or not tar_member.isfile():
+                continue
+            dst_loc = os.path.join(target_dir, member.dst_name)
+            names = member_names(member)
+            if len(names) == 1:
+                _stream_to([archive.extractfile(tar_member)], dst_loc)
+                extracted.append(dst_loc)
+                continue
+            parts = lane_parts.setdefault(member.dst_name, {})
+            parts[tar_member.name] = '{loc}.L{lane}.part'.format(loc=dst_loc, lane=names.index(tar_member.name))
+            _stream_to([archive.extractfile(tar_member)], parts[tar_member.name])
+            if len(parts) == len(names):
+                merge_gz_files([parts[name] for name in names], dst_loc)
+                for part_loc in parts.values():
+                    os.remove(part_loc)
+                extracted.append(dst_loc)
+    return extracted
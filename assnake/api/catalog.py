@@ -0,0 +1,151 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+
+from assnake.utils.general import read_yaml
+
+CATALOG_FILE = 'datasets_catalog.json'
+CATALOG_VERSION = 1
+
+
+def catalog_loc(assnake_db):
+    return os.path.join(assnake_db, CATALOG_FILE)
+
+
+@contextmanager
+def _catalog_lock(assnake_db):
+    '''
+    Exclusive lock for read-modify-write of the catalog, so concurrent create/init/rescan don't lose each other's updates.
+    '''
+    lock_file = open(catalog_loc(assnake_db) + '.lock', 'a')
+    try:
+        try:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        except (ImportError, OSError):
+            pass # No locking on this platform or filesystem
+        yield
+    finally:
+        lock_file.close()
+
+
+def _read_df_info(assnake_db, df):
+    df_info_loc = os.path.join(assnake_db, 'datasets', df, 'df_info.yaml')
+    try:
+        info = read_yaml(df_info_loc)
+    except (OSError, ValueError):
+        return None
+    if info is None or 'df' not in info:
+        return None
+    return info
+
+
+def _load(assnake_db):
+    try:
+        with open(catalog_loc(assnake_db), 'r') as catalog_file:
+            catalog = json.load(catalog_file)
+        if catalog.get('version') == CATALOG_VERSION:
+            return catalog['datasets']
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _write(assnake_db, datasets):
+    loc = catalog_loc(assnake_db)
+    tmp_loc = loc + '.tmp.{pid}'.format(pid=os.getpid())
+    with open(tmp_loc, 'w') as catalog_file:
+        json.dump({'version': CATALOG_VERSION, 'datasets': datasets}, catalog_file, default=str, indent=1, sort_keys=True)
+    os.replace(tmp_loc, loc)
+
+
+def _registered(assnake_db):
+    '''
+    Names of datasets in assnake_db/datasets that have df_info.yaml. Deleted dataset may leave its directory without it.
+    '''
+    datasets_dir = os.path.join(assnake_db, 'datasets')
+    try:
+        entries = os.listdir(datasets_dir)
+    except FileNotFoundError:
+        return set()
+    return {df for df in entries if os.path.isfile(os.path.join(datasets_dir, df, 'df_info.yaml'))}
+
+
+def _sync(assnake_db, datasets):
+    '''
+    Adds datasets registered in assnake_db/datasets but missing in catalog (registered by hand or by older assnake)
+    and drops datasets whose entries or df_info.yaml are gone. Only the local datasets directory is listed,
+    df_info.yaml is read only for new datasets. Returns True if catalog changed.
+    '''
+    registered = _registered(assnake_db)
+    changed = False
+    for df in sorted(set(datasets.keys()) - registered):
+        del datasets[df]
+        changed = True
+    for df in sorted(registered - set(datasets.keys())):
+        info = _read_df_info(assnake_db, df)
+        if info is not None:
+            datasets[df] = {'info': info, 'summary': {}}
+            changed = True
+    return changed
+
+
+def read_catalog(assnake_db):
+    '''
+    Returns dict df -> {'info': contents of df_info.yaml, 'summary': {'samples': {preproc: number of samples}, 'bytes', 'last_scan'}}
+    from one catalog file. Catalog is built from df_info.yaml files the first time.
+    '''
+    datasets = _load(assnake_db)
+    if datasets is not None and _registered(assnake_db) == set(datasets.keys()):
+        return datasets
+
+    with _catalog_lock(assnake_db):
+        datasets = _load(assnake_db)
+        if datasets is None:
+            datasets = {}
+        if _sync(assnake_db, datasets) or not os.path.isfile(catalog_loc(assnake_db)):
+            _write(assnake_db, datasets)
+    return datasets
+
+
+def update_catalog(assnake_db, df, info=None, summary=None, remove=False):
+    '''
+    Atomically updates entry of the dataset in catalog: info (df_info.yaml contents) and/or summary, or removes it.
+    If info is not provided, it is read from df_info.yaml again.
+    '''
+    with _catalog_lock(assnake_db):
+        datasets = _load(assnake_db)
+        if datasets is None:
+            datasets = {}
+            _sync(assnake_db, datasets)
+        if info is None and not remove:
+            info = _read_df_info(assnake_db, df)
+        if remove or info is None:
+            datasets.pop(df, None)
+        else:
+            entry = datasets.setdefault(df, {'info': info, 'summary': {}})
+            entry['info'] = info
+            if summary is not None:
+                entry['summary'] = summary
+        _write(assnake_db, datasets)
+
+
+def register_dataset(assnake_db, df_info):
+    update_catalog(assnake_db, df_info['df'], info=df_info)
+
+
+def unregister_dataset(assnake_db, df):
+    update_catalog(assnake_db, df, remove=True)
+
+
+def update_dataset_summary(assnake_db, df, sample_index):
+    '''
+    Stores number of samples per preprocessing and total size of read files from the sample index in catalog.
+    '''
+    samples, total_bytes = sample_index.summary()
+    update_catalog(assnake_db, df, summary={
+        'samples': samples,
+        'bytes': total_bytes,
+        'last_scan': time.strftime('%Y-%m-%dT%H:%M:%S')
+    })
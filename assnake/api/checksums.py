@@ -0,0 +1,197 @@
+import os
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from assnake.core.config import load_wc_config
+from assnake.api.discovery import scan_reads_dir
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+CHECKSUM_MANIFEST_FILE = 'checksums.tsv'
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+MANIFEST_COLUMNS = ['path', 'algorithm', 'checksum', 'inode', 'size', 'mtime_ns', 'hashed_at']
+
+XXHASH_ALGORITHMS = ['xxh64', 'xxh3_64', 'xxh128']
+
+
+def available_algorithms():
+    '''
+    md5 for compatibility with md5sum, blake2b and xxhash (if installed) are faster.
+    '''
+    algorithms = ['md5', 'sha1', 'blake2b']
+    if xxhash is not None:
+        algorithms += [a for a in XXHASH_ALGORITHMS if hasattr(xxhash, a)]
+    return algorithms
+
+
+def new_hasher(algorithm):
+    if algorithm in XXHASH_ALGORITHMS:
+        if xxhash is None:
+            raise ValueError('Install xxhash to use ' + algorithm)
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+def hash_file(loc, algorithm='md5', buffer_size=HASH_BUFFER_SIZE):
+    '''
+    Streams file through the hash in large buffers. Returns hex digest.
+    '''
+    hasher = new_hasher(algorithm)
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    with open(loc, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+def _hash_task(task):
+    loc, algorithm = task
+    try:
+        return hash_file(loc, algorithm)
+    except OSError:
+        return None
+
+
+def hash_files(locs, algorithm='md5', workers=None):
+    '''
+    Hashes files in a pool of processes. Returns list of hex digests in the order of locs, None for unreadable files.
+    '''
+    tasks = [(loc, algorithm) for loc in locs]
+    if len(tasks) == 0:
+        return []
+    if workers == 1 or len(tasks) == 1:
+        return [_hash_task(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_hash_task, tasks, chunksize=max(1, len(tasks) // 256)))
+
+
+def _file_key(loc):
+    st = os.stat(loc)
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class ChecksumManifest:
+    '''
+    Checksums of files of the dataset, stored in tsv with paths relative to the dataset folder.
+    Every checksum is cached with (inode, size, mtime_ns) of the file, so unchanged files are not hashed again.
+    '''
+
+    def __init__(self, manifest_loc, root):
+        self.manifest_loc = manifest_loc
+        self.root = root
+        self.entries = {}
+        if os.path.isfile(manifest_loc):
+            manifest = pd.read_csv(manifest_loc, sep='\t', dtype={'checksum': str})
+            for entry in manifest.to_dict(orient='records'):
+                self.entries[entry['path']] = entry
+
+    def save(self):
+        manifest = pd.DataFrame(sorted(self.entries.values(), key=lambda e: e['path']), columns=MANIFEST_COLUMNS)
+        tmp_loc = self.manifest_loc + '.tmp'
+        manifest.to_csv(tmp_loc, sep='\t', index=False)
+        os.replace(tmp_loc, self.manifest_loc)
+
+    def relpath(self, loc):
+        return os.path.relpath(loc, self.root)
+
+    def update(self, locs, algorithm='md5', workers=None):
+        '''
+        Hashes files that are new or changed since they were hashed. Entries of files not in locs are kept.
+
+        :return: list of relative paths that were hashed.
+        '''
+        to_hash = []
+        keys = {}
+        for loc in locs:
+            try:
+                keys[loc] = _file_key(loc)
+            except OSError:
+                continue
+            entry = self.entries.get(self.relpath(loc))
+            if entry is None or entry['algorithm'] != algorithm or (entry['inode'], entry['size'], entry['mtime_ns']) != keys[loc]:
+                to_hash.append(loc)
+
+        hashed_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        for loc, checksum in zip(to_hash, hash_files(to_hash, algorithm, workers)):
+            if checksum is None:
+                continue
+            inode, size, mtime_ns = keys[loc]
+            self.entries[self.relpath(loc)] = {'path': self.relpath(loc), 'algorithm': algorithm, 'checksum': checksum,
+                                               'inode': inode, 'size': size, 'mtime_ns': mtime_ns, 'hashed_at': hashed_at}
+        return [self.relpath(loc) for loc in to_hash]
+
+    def remove_missing(self):
+        missing = [path for path in self.entries if not os.path.exists(os.path.join(self.root, path))]
+        for path in missing:
+            del self.entries[path]
+        return missing
+
+    def verify(self, workers=None):
+        '''
+        Rehashes every file in the manifest and compares with stored checksums.
+
+        :return: DataFrame with path, expected, actual and status: ok, mismatch or missing.
+        '''
+        paths = sorted(self.entries.keys())
+        by_algorithm = {}
+        for path in paths:
+            by_algorithm.setdefault(self.entries[path]['algorithm'], []).append(path)
+
+        actual = {}
+        for algorithm, algorithm_paths in by_algorithm.items():
+            checksums = hash_files([os.path.join(self.root, p) for p in algorithm_paths], algorithm, workers)
+            actual.update(zip(algorithm_paths, checksums))
+
+        rows = []
+        for path in paths:
+            expected = self.entries[path]['checksum']
+            status = 'missing' if actual[path] is None else 'ok' if actual[path] == expected else 'mismatch'
+            rows.append({'path': path, 'expected': expected, 'actual': actual[path], 'status': status})
+        return pd.DataFrame(rows, columns=['path', 'expected', 'actual', 'status'])
+
+
+def dataset_read_files(fs_prefix, df, preprocs, wc_config=None):
+    '''
+    Paths of all read files of the dataset in provided preprocessings.
+    '''
+    if wc_config is None:
+        wc_config = load_wc_config()
+    locs = []
+    for preproc in preprocs:
+        preproc_dir = os.path.dirname(wc_config['fastq_gz_file_wc'].format(
+            fs_prefix=fs_prefix, df=df, preproc=preproc, df_sample='', strand='R1'))
+        locs += [f.path for f in scan_reads_dir(preproc_dir)]
+    return sorted(locs)
+
+
+def open_dataset_manifest(dataset):
+    '''
+    Checksum manifest of the dataset, stored in the dataset folder next to the sample index.
+    '''
+    import assnake
+    df = assnake.Dataset(dataset)
+    return df, ChecksumManifest(os.path.join(df.full_path, CHECKSUM_MANIFEST_FILE), df.full_path)
+
+
+def update_dataset_checksums(dataset, algorithm='md5', workers=None):
+    '''
+    Brings checksum manifest of the dataset up to date: hashes new and changed read files, forgets removed ones.
+
+    :return: (list of hashed paths, list of removed paths)
+    '''
+    df, manifest = open_dataset_manifest(dataset)
+    hashed = manifest.update(dataset_read_files(df.fs_prefix, df.df, df.preprocs), algorithm, workers)
+    removed = manifest.remove_missing()
+    if len(hashed) > 0 or len(removed) > 0 or not os.path.isfile(manifest.manifest_loc):
+        manifest.save()
+    return hashed, removed
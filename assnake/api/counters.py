@@ -0,0 +1,153 @@
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from assnake.core.config import load_wc_config
+from assnake.api.discovery import scan_reads_dir, group_by_sample
+
+# Compressed bytes read at once
+CHUNK_SIZE = 4 * 1024 * 1024
+# Limit for decompressed bytes kept in memory at once
+MAX_OUTPUT_SIZE = 16 * 1024 * 1024
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+NEWLINE = ord('\n')
+
+
+class FastqCounter:
+    '''
+    Counts reads and bases in decompressed fastq stream, fed in chunks of any size.
+    Newlines are found with NumPy, sequence is every second line of 4-line record.
+    '''
+
+    def __init__(self):
+        self.lines = 0
+        self.bps = 0
+        self.partial_line = 0 # length of the line that is not finished in the previous chunks
+
+    def update(self, data):
+        if len(data) == 0:
+            return
+        buf = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == NEWLINE)
+        if len(newlines) == 0:
+            self.partial_line += len(buf)
+            return
+
+        lengths = np.diff(newlines, prepend=-1) - 1
+        lengths[0] += self.partial_line
+        # Index of the first sequence line (line 1 of every 4) in this chunk
+        first_seq_line = (1 - self.lines) % 4
+        self.bps += int(lengths[first_seq_line::4].sum())
+
+        self.lines += len(newlines)
+        self.partial_line = len(buf) - int(newlines[-1]) - 1
+
+    def finish(self):
+        '''
+        Returns (reads, bps). Last line without trailing newline is counted.
+        '''
+        if self.partial_line > 0:
+            if self.lines % 4 == 1:
+                self.bps += self.partial_line
+            self.lines += 1
+            self.partial_line = 0
+        return (self.lines + 3) // 4, self.bps
+
+
+def count_fastq_gz(fastq_gz_loc, chunk_size=CHUNK_SIZE):
+    '''
+    Streams gzipped fastq file and returns (reads, bps).
+    Works with multi-member gzip files (concatenated .gz, bgzip) - decompressor is restarted after every member.
+    Raises EOFError if the file ends in the middle of a member (truncated or corrupted file).
+    '''
+    counter = FastqCounter()
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    in_member = False # some data of the current member was decompressed
+    with open(fastq_gz_loc, 'rb') as fastq_gz:
+        while True:
+            data = fastq_gz.read(chunk_size)
+            if not data:
+                break
+            while data:
+                in_member = True
+                counter.update(decompressor.decompress(data, MAX_OUTPUT_SIZE))
+                if decompressor.eof:
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(GZIP_WBITS)
+                    in_member = False
+                    if data.strip(b'\x00') == b'': # padding after the last member
+                        data = b''
+                else:
+                    data = decompressor.unconsumed_tail
+    if in_member:
+        raise EOFError('Compressed file ended before the end-of-stream marker was reached: ' + fastq_gz_loc)
+    counter.update(decompressor.flush())
+    return counter.finish()
+
+
+def write_count(count_loc, reads, bps):
+    '''
+    Writes `.count` file in the same format as the counting rule: `{reads} {bps}`.
+    '''
+    os.makedirs(os.path.dirname(count_loc), exist_ok=True)
+    tmp_loc = count_loc + '.tmp.{pid}'.format(pid=os.getpid())
+    with open(tmp_loc, 'w') as count_file:
+        count_file.write('{reads} {bps}\n'.format(reads=reads, bps=bps))
+    os.replace(tmp_loc, count_loc)
+
+
+def _count_and_write(task):
+    fastq_gz_loc, count_loc = task
+    reads, bps = count_fastq_gz(fastq_gz_loc)
+    write_count(count_loc, reads, bps)
+    return count_loc, reads, bps
+
+
+def _is_up_to_date(count_loc, read_file):
+    try:
+        return os.stat(count_loc).st_mtime_ns >= read_file.mtime_ns
+    except OSError:
+        return False
+
+
+def count_reads(fs_prefix, df, preprocs, samples=None, wc_config=None, overwrite=False, workers=None):
+    '''
+    Computes `.count` files at `count_wc` for every read file of the dataset in provided preprocessings.
+    Files are counted in a pool of processes. Count files newer than their read files are skipped unless overwrite is set.
+    Mtime of count directory of every counted preprocessing is bumped, so SampleIndex picks up new counts.
+
+    :param samples: list of samples to count, all samples if None.
+    :param workers: number of processes, number of CPUs if None.
+    :return: list of (count_loc, reads, bps) for counted files.
+    '''
+    if wc_config is None:
+        wc_config = load_wc_config()
+
+    tasks = []
+    count_dirs = set()
+    for preproc in preprocs:
+        preproc_dir = os.path.dirname(wc_config['fastq_gz_file_wc'].format(
+            fs_prefix=fs_prefix, df=df, preproc=preproc, df_sample='', strand='R1'))
+        for df_sample, strands in group_by_sample(scan_reads_dir(preproc_dir, with_stat=True)).items():
+            if samples is not None and df_sample not in samples:
+                continue
+            for strand, read_file in strands.items():
+                count_loc = wc_config['count_wc'].format(
+                    fs_prefix=fs_prefix, df=df, preproc=preproc, df_sample=df_sample, strand=strand)
+                if overwrite or not _is_up_to_date(count_loc, read_file):
+                    tasks.append((read_file.path, count_loc))
+                    count_dirs.add(os.path.dirname(wc_config['count_wc'].format(
+                        fs_prefix=fs_prefix, df=df, preproc=preproc, df_sample='', strand=strand)))
+
+    if len(tasks) == 0:
+        return []
+    if workers == 1 or len(tasks) == 1:
+        counted = [_count_and_write(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            counted = list(executor.map(_count_and_write, tasks))
+    for count_dir in count_dirs:
+        os.utime(count_dir)
+    return counted
@@ -0,0 +1,140 @@
+import os
+import re
+import fnmatch
+from collections import namedtuple
+
+FASTQ_GZ_EXT = '.fastq.gz'
+
+# Possible endings of read files in sequencing runs we import from.
+# `lane` is the prefix of lane number put before strand ending: S1_L001_R1_001.fastq.gz is lane 001 of S1.
+IMPORT_ENDING_VARIANTS = [
+    {'name': 'normal', 'strands': {'R1': '_R1', 'R2': '_R2'}},
+    {'name': 'ILLUMINA_WITH_LANE', 'strands': {'R1': '_R1_001', 'R2': '_R2_001'}, 'lane': '_L'},
+    {'name': 'ILLUMINA_001', 'strands': {'R1': '_R1_001', 'R2': '_R2_001'}},
+    {'name': 'SRA', 'strands': {'R1': '_1', 'R2': '_2'}}
+]
+# Used for sequencing runs without any paired files
+SINGLE_END_VARIANT = {'name': 'single_end', 'strands': {'R1': '', 'R2': '_R2'}}
+# Layout of files inside {fs_prefix}/{df}/reads/{preproc}, see fastq_gz_file_wc
+DATASET_ENDING_VARIANTS = [{'name': 'normal', 'strands': {'R1': '_R1', 'R2': '_R2'}}]
+
+ReadFile = namedtuple('ReadFile', ['df_sample', 'strand', 'ending_variant', 'path', 'size', 'mtime_ns', 'lane'])
+Classified = namedtuple('Classified', ['df_sample', 'strand', 'ending_variant', 'lane'])
+
+
+class EndingClassifier:
+    '''
+    Splits read file names into (sample, strand, ending variant, lane) with one precompiled regex
+    built from the list of ending variants.
+    '''
+
+    def __init__(self, ending_variants, ext=FASTQ_GZ_EXT, strands=('R1', 'R2')):
+        self.ending_variants = ending_variants
+        self.ext = ext
+        self.groups = {}
+
+        alternatives = []
+        for i, variant in enumerate(ending_variants):
+            for strand in strands:
+                group = 'v%d_%s' % (i, strand)
+                self.groups[group] = (variant, strand)
+                lane = ''
+                if variant.get('lane') is not None:
+                    lane = '%s(?P<%s_lane>\\d+)' % (re.escape(variant['lane']), group)
+                alternatives.append('(?P<%s>%s%s)' % (group, lane, re.escape(variant['strands'][strand])))
+        # Sample name is non-greedy, so the longest fitting ending wins: `s_R1_001` is `s` + `_R1_001`
+        self.regex = re.compile('^(?P<df_sample>.+?)(?:%s)%s$' % ('|'.join(alternatives), re.escape(ext)))
+
+    def classify(self, file_name):
+        '''
+        Returns Classified (df_sample, strand, ending_variant, lane) or None if file name doesn't match any variant.
+        Lane is None for variants without lanes.
+        '''
+        match = self.regex.match(file_name)
+        if match is None:
+            return None
+        group = match.lastgroup
+        variant, strand = self.groups[group]
+        lane = match.group(group + '_lane') if variant.get('lane') is not None else None
+        return Classified(match.group('df_sample'), strand, variant, lane)
+
+
+IMPORT_CLASSIFIER = EndingClassifier(IMPORT_ENDING_VARIANTS)
+SINGLE_END_CLASSIFIER = EndingClassifier([SINGLE_END_VARIANT], strands=('R1',))
+DATASET_CLASSIFIER = EndingClassifier(DATASET_ENDING_VARIANTS)
+
+_registered_variants = list(IMPORT_ENDING_VARIANTS)
+_import_classifier = IMPORT_CLASSIFIER
+
+
+def register_ending_variant(variant):
+    '''
+    Adds ending variant for imports, for example from plugin:
+    `{'name': 'BGI', 'strands': {'R1': '_1.clean', 'R2': '_2.clean'}}`. Variant with the same name is replaced.
+    '''
+    global _import_classifier
+    _registered_variants[:] = [v for v in _registered_variants if v['name'] != variant['name']] + [variant]
+    _import_classifier = EndingClassifier(_registered_variants)
+
+
+def get_import_classifier():
+    '''
+    Classifier compiled from all registered ending variants.
+    '''
+    return _import_classifier
+
+
+def list_dir(directory):
+    '''
+    Lists directory with a single os.scandir call. Returns list of DirEntry, empty if there is no such directory.
+    DirEntry caches the result of stat, so size and mtime cost at most one more syscall per file.
+    '''
+    try:
+        with os.scandir(directory) as it:
+            return list(it)
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def classify_entries(entries, classifier, sample_pattern='*', with_stat=False):
+    '''
+    Classifies DirEntries from list_dir into ReadFile tuples. Files that don't match are skipped.
+
+    :param sample_pattern: glob pattern sample names must match.
+    :param with_stat: fill size and mtime_ns from DirEntry.stat(). Broken symlinks are skipped.
+    '''
+    read_files = []
+    for entry in entries:
+        classified = classifier.classify(entry.name)
+        if classified is None:
+            continue
+        df_sample, strand, variant, lane = classified
+        if sample_pattern != '*' and not fnmatch.fnmatchcase(df_sample, sample_pattern):
+            continue
+
+        size, mtime_ns = None, None
+        if with_stat:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        read_files.append(ReadFile(df_sample, strand, variant, entry.path, size, mtime_ns, lane))
+    return read_files
+
+
+def scan_reads_dir(directory, classifier=DATASET_CLASSIFIER, sample_pattern='*', with_stat=False):
+    '''
+    One pass over directory with read files. Returns list of ReadFile.
+    '''
+    return classify_entries(list_dir(directory), classifier, sample_pattern, with_stat)
+
+
+def group_by_sample(read_files):
+    '''
+    Groups ReadFiles into dict df_sample -> {strand: ReadFile}. Keeps order of the first appearance.
+    '''
+    samples = {}
+    for read_file in read_files:
+        samples.setdefault(read_file.df_sample, {})[read_file.strand] = read_file
+    return samples
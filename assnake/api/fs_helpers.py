@@ -4,147 +4,357 @@ import os
 import sys
 import glob
 import fnmatch
-from shutil import copy2, rmtree
+from shutil import copy2, copystat, copyfileobj, rmtree
+from collections import namedtuple
 from assnake.core.config import read_assnake_instance_config
+from assnake.api.discovery import list_dir, classify_entries, get_import_classifier, SINGLE_END_CLASSIFIER, FASTQ_GZ_EXT
 import traceback
 import parse
 import pandas as pd
 
 
 
+SAMPLE_COLUMNS = {
+    'name_in_run': object, 'modified_name': object,
+    'ending_variant_id': 'category', 'ending_variant_R1': object, 'ending_variant_R2': object,
+    'directory': 'category', 'extension': 'category',
+    'lanes': object, 'n_lanes': 'int64', 'paired': bool, 'files_R1': object, 'files_R2': object
+}
+REPORT_COLUMNS = ['file', 'name_in_run', 'problem']
+
+
+def classify_run_dir(directory_with_reads, modify_name = None):
+    '''
+    Classifies read files in the directory with reads from sequencing run. Directory is listed only once,
+    file names are classified by one regex compiled from registered ending variants (see discovery.register_ending_variant).
+    If no paired files are found, every fastq.gz is treated as single-end sample.
+    Files of the same sample and strand from different lanes are grouped into one sample, ordered by lane.
+
+    :return: (samples, report). samples - typed DataFrame with one row per sample, files_R1 and files_R2 are tuples of paths ordered by lane.
+        report - DataFrame of files that can't be imported as is: 
+        unrecognized (fastq.gz that matches no ending variant), ambiguous (several files or ending variants for one sample and strand),
+        unpaired (R2 without R1, or R1 without R2 in a paired run), lanes_differ (R1 and R2 come from different lanes).
+    '''
+    ext = FASTQ_GZ_EXT  # extention
+    entries = [entry for entry in list_dir(directory_with_reads) if entry.name.endswith(ext)]
+
+    read_files = classify_entries(entries, get_import_classifier())
+    if len(read_files) == 0:
+        read_files = classify_entries(entries, SINGLE_END_CLASSIFIER)
+
+    report = []
+    classified = set(f.path for f in read_files)
+    report += [{'file': e.path, 'name_in_run': None, 'problem': 'unrecognized'} for e in entries if e.path not in classified]
+
+    # sample -> variant name -> strand -> lane -> [files]
+    grouped = {}
+    for f in read_files:
+        lanes = grouped.setdefault(f.df_sample, {}).setdefault(f.ending_variant['name'], {}).setdefault(f.strand, {})
+        lanes.setdefault(f.lane, []).append(f)
+    paired_run = any(f.strand == 'R2' for f in read_files)
+
+    samples_list = []
+    for name_in_run in sorted(grouped.keys()):
+        variants = grouped[name_in_run]
+        sample_files = [f for strands in variants.values() for lanes in strands.values() for files in lanes.values() for f in files]
+        def problem(kind, files = sample_files):
+            report.extend({'file': f.path, 'name_in_run': name_in_run, 'problem': kind} for f in sorted(files, key=lambda f: f.path))
+
+        if len(variants) > 1 or any(len(files) > 1 for files in [fs for strands in variants.values() for lanes in strands.values() for fs in lanes.values()]):
+            problem('ambiguous')
+            continue
+        variant_name, strands = next(iter(variants.items()))
+        if 'R1' not in strands:
+            problem('unpaired')
+            continue
+        if 'R2' in strands and sorted(strands['R1'], key=str) != sorted(strands['R2'], key=str):
+            problem('lanes_differ')
+            continue
+        if 'R2' not in strands and paired_run:
+            problem('unpaired') # still imported as single-end
+
+        lanes = sorted(strands['R1'].keys(), key=lambda lane: -1 if lane is None else int(lane))
+        variant = strands['R1'][lanes[0]][0].ending_variant
+        samples_list.append({
+            'name_in_run': name_in_run,
+            'modified_name': modify_name(name_in_run) if modify_name is not None else name_in_run,
+            
+            'ending_variant_id': variant['name'],
+            'ending_variant_R1': variant['strands']['R1'],
+            'ending_variant_R2': variant['strands']['R2'],
+            'directory': directory_with_reads,
+            'extension': ext,
+            'lanes': tuple(lane for lane in lanes if lane is not None),
+            'n_lanes': len(lanes),
+            'paired': 'R2' in strands,
+            'files_R1': tuple(strands['R1'][lane][0].path for lane in lanes),
+            'files_R2': tuple(strands['R2'][lane][0].path for lane in lanes) if 'R2' in strands else ()
+        })
+
+    samples = pd.DataFrame(samples_list, columns=list(SAMPLE_COLUMNS.keys())).astype(SAMPLE_COLUMNS)
+    return samples, pd.DataFrame(report, columns=REPORT_COLUMNS)
+
+
 def get_samples_from_dir(directory_with_reads, modify_name = None):
-    samples_list = []  # to write samples in
-    
-    ext = '.fastq.gz'  # extention
-    ending_variants = [{'name': 'normal', 'strands': {'R1': '_R1', 'R2': '_R2'}},
-                    # {'name': 'ILLUMINA_WITH_LANE', 'strands': {'R1': '_L001_R1_001', 'R2': '_L001_R2_001'}},
-                    {'name': 'ILLUMINA_001', 'strands': {'R1': '_R1_001', 'R2': '_R2_001'}},
-                    {'name': 'SRA', 'strands': {'R1': '_1', 'R2': '_2'}}]  # possible endigngs of files
-
-
-    for ending_variant in ending_variants:
-
-        variant_w_ext = ending_variant['strands']['R1'] + ext
-        globbing_path = os.path.join(directory_with_reads, '*' + variant_w_ext)
-        files_mathching_pattern = glob.glob(globbing_path)
-
-        # get sample names
-        samples = [
-            filename.split('/')[-1].replace(variant_w_ext, '') # Take last part of path (basename) and replace _R1/fastq.gz with nothing to get sample name
-            for filename in files_mathching_pattern
-        ]
-        
-        # prepare sample dicts
-        samples_list += [
-            {
-                'name_in_run': s,
-                'modified_name': modify_name(s) if modify_name is not None else s,
-                
-                'ending_variant_id': ending_variant['name'],
-                'ending_variant_R1': ending_variant['strands']['R1'],
-                'ending_variant_R2': ending_variant['strands']['R2'],
-                'directory': directory_with_reads,
-                'extension': ext
-            } 
-            for s in samples
-        ]
-        
-    if len(samples_list) == 0:
-        ending_variant = {'name': 'single_end', 'strands': {'R1': '', 'R2':'_R2'}}
-        variant_w_ext = ending_variant['strands']['R1'] + ext
-        globbing_path = os.path.join(directory_with_reads, '*' + variant_w_ext)
-        files_mathching_pattern = glob.glob(globbing_path)
-
-        # get sample names
-        samples = [
-            filename.split('/')[-1].replace(variant_w_ext, '') # Take last part of path (basename) and replace _R1/fastq.gz with nothing to get sample name
-            for filename in files_mathching_pattern
-        ]
-        
-        # prepare sample dicts
-        samples_list += [
-            {
-                'name_in_run': s,
-                'modified_name': modify_name(s) if modify_name is not None else s,
-                
-                'ending_variant_id': ending_variant['name'],
-                'ending_variant_R1': ending_variant['strands']['R1'],
-                'ending_variant_R2': ending_variant['strands']['R2'],
-                'directory': directory_with_reads,
-                'extension': ext
-            } 
-            for s in samples
-        ]
-
-    return pd.DataFrame(samples_list)
-
-
-def create_links(import_dir, samples, hard = False, create_dir_if_not_exist = False, rename = False, just_print = False):
-    """
-    This method creates links or hard copies reads files from one directory to another. 
+    '''
+    Finds samples in the directory with reads from sequencing run, see classify_run_dir.
+    '''
+    samples, _ = classify_run_dir(directory_with_reads, modify_name)
+    return samples
 
-    :param dir_with_reads: folder where to put reads
-    :param original_dir: folders that contains original reads files 
-    :param sample: dictionary from get_sample_dict_from_dir method
-    :param hard: if hard copying is needed or symbolic is sufficient  (False)
 
-    :returns:
+# src is a path, or a tuple of paths of lanes that are merged into dst
+ImportAction = namedtuple('ImportAction', ['df_sample', 'src', 'dst'])
 
-    """
+LINK_MODES = ['symlink', 'copy', 'reflink', 'hardlink', 'move']
+# ioctl request for cloning file extents, from linux/fs.h
+FICLONE = 0x40049409
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def plan_import(import_dir, samples):
+    '''
+    Plans import of read files of samples from get_samples_from_dir into import_dir. Every source directory is listed once.
+    R2 is imported only if it exists. Files of samples split into several lanes are planned to be merged into one file per strand.
+
+    :return: list of ImportAction (df_sample, src, dst)
+    '''
     orig_wc     = '{dir_w_reads}/{name_in_run}{ending_variant}{extension}'
     new_file_wc = '{import_dir}/{name_in_dataset}{strand}{extension}'
 
+    files_in_dir = {}
+    plan = []
+    for sample in samples.to_dict(orient = 'records'):
+        if 'files_R1' in sample:
+            strand_files = [('R1', sample['files_R1']), ('R2', sample['files_R2'])]
+            for strand, files in strand_files:
+                if len(files) == 0:
+                    continue
+                dst = new_file_wc.format(
+                    import_dir = import_dir,
+                    name_in_dataset = sample['df_sample'],
+                    strand = '_' + strand,
+                    extension = sample['extension']
+                )
+                plan.append(ImportAction(sample['df_sample'], files[0] if len(files) == 1 else tuple(files), dst))
+            continue
+
+        directory = sample['directory']
+        if directory not in files_in_dir:
+            files_in_dir[directory] = set(entry.name for entry in list_dir(directory))
+
+        for strand in ['R1', 'R2']:
+            src = orig_wc.format(
+                dir_w_reads = directory,
+                name_in_run = sample['name_in_run'],
+                ending_variant = sample['ending_variant_' + strand],
+                extension = sample['extension']
+            )
+            if strand == 'R2' and os.path.basename(src) not in files_in_dir[directory]:
+                continue
+            dst = new_file_wc.format(
+                import_dir = import_dir,
+                name_in_dataset = sample['df_sample'],
+                strand = '_' + strand,
+                extension = sample['extension']
+            )
+            plan.append(ImportAction(sample['df_sample'], src, dst))
+    return plan
+
+
+def reflink(src, dst):
+    '''
+    Copy-on-write clone of src (btrfs, xfs, zfs...). Raises OSError if filesystem doesn't support it.
+    '''
+    import fcntl
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+
+
+def append_file_data(src_file, dst_file, offset):
+    '''
+    Writes contents of src_file into dst_file starting at offset. Copies inside the kernel with copy_file_range or sendfile,
+    falls back to buffered copy. Returns offset after the written data.
+    '''
+    size = os.fstat(src_file.fileno()).st_size
+    for kernel_copy in [getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)]:
+        if kernel_copy is None:
+            continue
+        try:
+            copied = 0
+            while copied < size:
+                if kernel_copy is os.sendfile:
+                    os.lseek(dst_file.fileno(), offset + copied, os.SEEK_SET)
+                    n = os.sendfile(dst_file.fileno(), src_file.fileno(), copied, COPY_BUFFER_SIZE)
+                else:
+                    n = kernel_copy(src_file.fileno(), dst_file.fileno(), COPY_BUFFER_SIZE, copied, offset + copied)
+                if n == 0:
+                    break
+                copied += n
+            if copied == size:
+                return offset + size
+        except OSError:
+            pass
+        os.ftruncate(dst_file.fileno(), offset)
+    src_file.seek(0)
+    dst_file.seek(offset)
+    copyfileobj(src_file, dst_file, COPY_BUFFER_SIZE)
+    dst_file.flush()
+    return offset + size
+
+
+def copy_file_data(src, dst):
+    '''
+    Copies file contents and metadata inside the kernel with copy_file_range or sendfile, falls back to buffered copy.
+    Result appears under dst only when complete.
+    '''
+    tmp_loc = dst + '.part'
+    with open(src, 'rb') as src_file, open(tmp_loc, 'wb') as dst_file:
+        append_file_data(src_file, dst_file, 0)
+    copystat(src, tmp_loc)
+    os.replace(tmp_loc, dst)
+
+
+def reflink_file(src, dst):
+    '''
+    Reflinks file with metadata. Result appears under dst only when complete.
+    '''
+    tmp_loc = dst + '.part'
+    reflink(src, tmp_loc)
+    copystat(src, tmp_loc)
+    os.replace(tmp_loc, dst)
+
+
+def merge_gz_files(srcs, dst):
+    '''
+    Merges gzip files (lanes of one sample and strand) into dst without decompression:
+    concatenation of gzip files is a valid multi-member gzip file with reads of all of them.
+    Data never goes through python buffers when kernel copy is available. Result appears under dst only when complete.
+    '''
+    tmp_loc = dst + '.part'
+    with open(tmp_loc, 'wb') as dst_file:
+        offset = 0
+        for src in srcs:
+            with open(src, 'rb') as src_file:
+                offset = append_file_data(src_file, dst_file, offset)
+    copystat(srcs[0], tmp_loc)
+    os.replace(tmp_loc, dst)
+
+
+def copy_file(src, dst):
+    '''
+    Cheapest available copy: reflink, then hard link, then kernel copy of data. Returns the method that worked.
+    '''
+    try:
+        reflink_file(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError as e:
+        if isinstance(e, FileExistsError):
+            raise
+    copy_file_data(src, dst)
+    return 'copy'
+
+
+def import_file(action, link_mode='symlink'):
+    '''
+    Executes one ImportAction. Returns the method that was used, `merge` for merged lanes, `exists` if destination already exists.
+    '''
+    if os.path.lexists(action.dst):
+        return 'exists'
+    if isinstance(action.src, tuple):
+        # Lanes can't be linked, they are always merged into new file
+        merge_gz_files(action.src, action.dst)
+        if link_mode == 'move':
+            for src in action.src:
+                os.remove(src)
+        return 'merge'
+    if link_mode == 'symlink':
+        os.symlink(action.src, action.dst)
+    elif link_mode == 'move':
+        os.rename(action.src, action.dst)
+    elif link_mode == 'hardlink':
+        os.link(action.src, action.dst)
+    elif link_mode == 'reflink':
+        reflink_file(action.src, action.dst)
+    elif link_mode == 'copy':
+        return copy_file(action.src, action.dst)
+    else:
+        raise ValueError('Unknown link mode: ' + str(link_mode))
+    return link_mode
+
+
+def execute_import(plan, link_mode='symlink', workers=None, progress=False):
+    '''
+    Executes planned import in a thread pool of `workers` threads, see loaders.get_io_workers.
+
+    :return: list of (ImportAction, method used or `exists` or error message)
+    '''
+    from assnake.api.loaders import map_io
+    from tqdm import tqdm
+
+    pbar = tqdm(total=len(plan), unit='file', disable=not progress)
+    def run(action):
+        try:
+            result = import_file(action, link_mode)
+        except OSError as e:
+            result = 'error: ' + str(e)
+        pbar.update(1)
+        return action, result
+    results = map_io(run, plan, workers)
+    pbar.close()
+    return results
+
+
+def create_links(import_dir, samples, hard = False, create_dir_if_not_exist = False, rename = False, just_print = False,
+                 link_mode = None, workers = None, progress = False):
+    """
+    This method creates links or copies reads files from one directory to another. 
+    All actions are planned first and then executed in a thread pool.
+
+    :param import_dir: folder where to put reads
+    :param samples: DataFrame from get_samples_from_dir with df_sample column
+    :param hard: copy files (same as link_mode='copy')
+    :param rename: move files (same as link_mode='move')
+    :param just_print: only print the plan (dry run)
+    :param link_mode: one of LINK_MODES. `copy` uses reflink if filesystem supports it, else hard link, else kernel copy.
+        Lanes of multi-lane samples are always merged into new files, whatever the link mode is.
+    :param workers: number of threads
+
+    :returns: list of (ImportAction, result), see execute_import
+    """
+    if link_mode is None:
+        link_mode = 'move' if rename else 'copy' if hard else 'symlink'
+
     # make dirs
     if not os.path.isdir(import_dir):
         if create_dir_if_not_exist:
-            os.makedirs(import_dir)
+            os.makedirs(import_dir, exist_ok=True)
         else:
             print("Such dir doesn't exist and create_dir_if_not_exist is set to False")
 
-    for sample in samples.to_dict(orient = 'records'):
-        
-        src_r1 = orig_wc.format(
-            dir_w_reads = sample['directory'], 
-            name_in_run = sample['name_in_run'],
-            ending_variant = sample['ending_variant_R1'],
-            extension = sample['extension']
-        )
-        dst_r1 = new_file_wc.format(
-            import_dir = import_dir, 
-            name_in_dataset = sample['df_sample'],
-            strand = '_R1',
-            extension = sample['extension']
-        )
-
-        src_r2 = orig_wc.format(
-            dir_w_reads = sample['directory'], 
-            name_in_run = sample['name_in_run'],
-            ending_variant = sample['ending_variant_R2'],
-            extension = sample['extension']
-        )
-        dst_r2 = new_file_wc.format(
-            import_dir = import_dir, 
-            name_in_dataset = sample['df_sample'],
-            strand = '_R2',
-            extension = sample['extension']
-        )
-
-        if rename:
-            os.rename(src_r1, dst_r1)
-            if os.path.exists(src_r2):
-                os.rename(src_r2, dst_r2)
-            return
-
-        if hard:
-            copy2(src_r1, dst_r1)
-            if os.path.exists(src_r2):
-                copy2(src_r2, dst_r2)
-            return
+    plan = plan_import(import_dir, samples)
+    if just_print:
+        for action in plan:
+            if isinstance(action.src, tuple):
+                print('merge\t{src}\t{dst}'.format(src=','.join(action.src), dst=action.dst))
+            else:
+                print('{mode}\t{src}\t{dst}'.format(mode=link_mode, src=action.src, dst=action.dst))
+        return [(action, 'planned') for action in plan]
 
-        try:
-            os.symlink(src_r1, dst_r1)
-            if os.path.exists(src_r2):
-                os.symlink(src_r2, dst_r2)
-        except FileExistsError as e:
-            print(e)
-            
\ No newline at end of file
+    results = execute_import(plan, link_mode, workers, progress)
+    for action, result in results:
+        if result == 'exists':
+            print('File exists: ' + action.dst)
+        elif result.startswith('error'):
+            print(action.dst, result)
+    return results
@@ -1,5 +1,6 @@
 import os
 import glob
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import numpy as np
@@ -7,6 +8,42 @@ import yaml
 import assnake
 from assnake.core.config import read_assnake_instance_config, load_wc_config
 from assnake.utils.general import bytes2human
+from assnake.api.discovery import list_dir, scan_reads_dir, group_by_sample
+
+
+# Number of threads for filesystem metadata and .count reads. On network filesystems (NFS, Lustre)
+# these calls are latency-bound, so they scale with the number of threads.
+DEFAULT_IO_WORKERS = 8
+_io_workers = None
+
+def set_io_workers(io_workers):
+    '''
+    Overrides number of IO threads for this process (--io-workers CLI option). None resets to instance config.
+    '''
+    global _io_workers
+    _io_workers = io_workers
+
+def get_io_workers():
+    '''
+    Number of IO threads: --io-workers if set, else `io_workers` from instance config, else DEFAULT_IO_WORKERS.
+    '''
+    if _io_workers is not None:
+        return _io_workers
+    instance_config = read_assnake_instance_config()
+    if instance_config is not None and instance_config.get('io_workers') is not None:
+        return int(instance_config['io_workers'])
+    return DEFAULT_IO_WORKERS
+
+def map_io(func, items, io_workers=None):
+    '''
+    Applies func to every item in a bounded thread pool. Results are returned in the order of items.
+    '''
+    items = list(items)
+    io_workers = get_io_workers() if io_workers is None else io_workers
+    if io_workers <= 1 or len(items) < 2:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(io_workers, len(items))) as pool:
+        return list(pool.map(func, items))
 
 
 # TODO this goes to Exceptions 
@@ -21,91 +58,109 @@ class InputError(Exception):
         self.message = message
 
 # TODO this goes to assnake-core-preprocessing
+COUNT_STRANDS = ['R1', 'R2']
+
+def read_count_file(count_loc):
+    '''
+    Reads `{reads} {bps}` from .count file. Returns (reads, bps), -1 for values that are missing.
+    '''
+    try:
+        with open(count_loc, 'r') as f:
+            line = f.readline().split()
+        return int(line[0]), (int(line[1]) if len(line) > 1 else -1)
+    except (OSError, ValueError, IndexError):
+        return -1, -1
+
+def load_counts(fs_prefix, df, preproc, df_samples, count_wc, io_workers=None):
+    '''
+    Loads counts of both strands for many samples at once. Count files are read in a thread pool.
+
+    :return: DataFrame indexed by df_sample with int64 columns reads_R1, reads_R2, bps_R1, bps_R2 (-1 if there is no count file)
+        and bool column mismatch - True if both strands are counted and number of reads differs.
+    '''
+    df_samples = list(df_samples)
+    count_locs = [count_wc.format(fs_prefix=fs_prefix, df=df, preproc=preproc, df_sample=df_sample, strand=strand)
+                  for df_sample in df_samples for strand in COUNT_STRANDS]
+    # samples x strands x (reads, bps)
+    values = np.array(map_io(read_count_file, count_locs, io_workers), dtype=np.int64).reshape(len(df_samples), 2, 2)
+
+    counts = pd.DataFrame({
+        'reads_R1': values[:, 0, 0], 'reads_R2': values[:, 1, 0],
+        'bps_R1': values[:, 0, 1], 'bps_R2': values[:, 1, 1]
+    }, index=pd.Index(df_samples, name='df_sample', dtype=object))
+    counts['mismatch'] = (counts['reads_R1'] >= 0) & (counts['reads_R2'] >= 0) & (counts['reads_R1'] != counts['reads_R2'])
+    return counts
+
 def load_count(fs_prefix, df, preproc, df_sample, report_bps=False, verbose=False, count_wc=''):
     """
     Loads information about read and bp count in paired-end sample.
+    Reads and bps are reported for R1 (number of read pairs), -1 if there is no count file. See load_counts for both strands.
     """
-    strands = ['R1', 'R2']
-    
-    count_loc1 = count_wc.format(fs_prefix=fs_prefix, df=df, preproc=preproc, df_sample=df_sample, strand=strands[0])
-    count_loc2 = count_wc.format(fs_prefix=fs_prefix, df=df, preproc=preproc, df_sample=df_sample, strand=strands[1])
-    
-    count_dict = {'reads': -1}
-
-    try:
-        with open(count_loc1, 'r') as f:
-            line = f.readline().rstrip()
-            count_dict['reads'] += int(line.split(' ')[0]) + 1
-            if report_bps:
-                count_dict.update({'bps':int(line.split(' ')[1])})
-        # with open(count_loc2, 'r') as f:
-        #     line = f.readline().rstrip()
-        #     count_dict['reads'] += int(line.split(' ')[0])
-        #     if report_bps:
-        #         count_dict['bps'] += int(line.split(' ')[1])
-    except:
-        if verbose: 
-            print('error loading counts: ', sample)
-        if report_bps:
-            count_dict.update({'bps': -1})
-        return count_dict
-    
+    counts = load_counts(fs_prefix, df, preproc, [df_sample], count_wc, io_workers=1).iloc[0]
+
+    count_dict = {'reads': int(counts['reads_R1'])}
+    if report_bps:
+        count_dict.update({'bps': int(counts['bps_R1'])})
+    if verbose:
+        if counts['reads_R1'] == -1:
+            print('error loading counts: ', df_sample)
+        elif counts['mismatch']:
+            print('R1 and R2 read counts differ: ', df_sample, counts['reads_R1'], counts['reads_R2'])
     return count_dict
         
 
 def load_sample(fs_prefix, df, preproc, df_sample,
                 report_bps=False, report_size=False, verbose=False,
-                sample_dir_wc = '', fastq_gz_file_wc = '', count_wc=''):
+                sample_dir_wc = '', fastq_gz_file_wc = '', count_wc='', read_files = None):
     '''
     Loads all necessary info about given sample from file system.
+
+    :param read_files: dict preproc -> {strand: ReadFile} of this sample, if directories were already scanned.
     '''
     # Init start values
     sample_dict = {}
-    strands = ['R1', 'R2']
     
     final_preproc = ''
     size = 0
     containers = []
-    preprocs = []
-
 
     # Now select what preprocessing we want to use
-    if preproc == 'longest':
-        preprocs = [p.split('/')[-2] for p in 
-                    glob.glob(fastq_gz_file_wc.format(fs_prefix=fs_prefix, df=df, preproc='*', df_sample=df_sample, strand='R1'))]
-    else:
-        preprocs = [p.split('/')[-2] for p in 
-                    glob.glob(fastq_gz_file_wc.format(fs_prefix=fs_prefix, df=df, preproc=preproc, df_sample=df_sample, strand='R1'))]
-    for p in preprocs:
-        r1 = fastq_gz_file_wc.format(fs_prefix=fs_prefix, df=df, preproc=p, df_sample=df_sample, strand=strands[0])
-        r2 = fastq_gz_file_wc.format(fs_prefix=fs_prefix, df=df, preproc=p, df_sample=df_sample, strand=strands[1])
-
-        if os.path.isfile(r1) and os.path.isfile(r2):
+    if read_files is None:
+        if preproc == 'longest':
+            reads_dir = os.path.dirname(os.path.dirname(fastq_gz_file_wc.format(
+                fs_prefix=fs_prefix, df=df, preproc=preproc, df_sample=df_sample, strand='R1')))
+            preprocs = [entry.name for entry in list_dir(reads_dir) if entry.is_dir()]
+        else:
+            preprocs = [preproc]
+        read_files = {}
+        for p in preprocs:
+            preproc_dir = os.path.dirname(fastq_gz_file_wc.format(
+                fs_prefix=fs_prefix, df=df, preproc=p, df_sample=df_sample, strand='R1'))
+            sample_files = group_by_sample(scan_reads_dir(preproc_dir, sample_pattern=glob.escape(df_sample), with_stat=report_size))
+            if df_sample in sample_files:
+                read_files[p] = sample_files[df_sample]
+
+    for p, strands in read_files.items():
+        if 'R1' in strands:
             containers.append(p)
             if len(p) > len(final_preproc):
                 final_preproc = p
                 if report_size:
-                    size = os.path.getsize(r1) + os.path.getsize(r2)
-                    sample_dict.update({'size': bytes2human(size, symbols='iec'), 'bytes': size})
-        elif os.path.isfile(r1):
-            containers.append(p)
-            if len(p) > len(final_preproc):
-                final_preproc = p
-                if report_size:
-                    size = os.path.getsize(r1) 
+                    size = sum(f.size for f in strands.values())
                     sample_dict.update({'size': bytes2human(size, symbols='iec'), 'bytes': size})
     return {'df':df, 
             'df_sample':df_sample, 
-            'df_sample':df_sample,  
             'preproc':final_preproc, 
             'fs_prefix': fs_prefix,
             #'preprocs':containers, 
-            **load_count(fs_prefix, df, final_preproc, df_sample, verbose, count_wc=count_wc)}
+            **sample_dict,
+            **load_count(fs_prefix, df, final_preproc, df_sample, report_bps=report_bps, verbose=verbose, count_wc=count_wc)}
 
 
-def load_sample_set(wc_config, fs_prefix, df, preproc, samples_to_add = [], do_not_add = [], pattern = '*'):
+def load_sample_set(wc_config, fs_prefix, df, preproc, samples_to_add = [], do_not_add = [], pattern = '*', report_bps = False, io_workers = None):
     '''
     This function is used to add samples into the SampleSet.
+    Directory of the preprocessing is listed only once, no per-sample globbing or stat.
 
     Args:
         fs_prefix: Prefix of the dataset on filesystem
@@ -114,30 +169,32 @@ def load_sample_set(wc_config, fs_prefix, df, preproc, samples_to_add = [], do_n
         samples_to_add: List of sample names to add
         do_not_add: list of sample names NOT to add
         pattern: sample names must match this glob pattern to be included. 
+        report_bps: add bps column with number of bases in R1.
+        io_workers: number of threads reading count files, see get_io_workers.
     '''
 
     if wc_config is None:
         wc_config = load_wc_config()
 
-    samples = []
-    fastq_gz_file_loc = wc_config['fastq_gz_file_wc'].format(
-        fs_prefix=fs_prefix, df=df, preproc=preproc, 
-        strand='R1', df_sample = pattern)
-    
-    df_samples = [f.split('/')[-1].split('.')[0].replace('_R1', '') for f in glob.glob(fastq_gz_file_loc)]
     sample_dir_wc    = wc_config['sample_dir_wc']
     fastq_gz_file_wc = wc_config['fastq_gz_file_wc']
     count_wc         = wc_config['count_wc']
 
-    df_samples = list(set(df_samples) - set(do_not_add))
-
-    if len(samples_to_add) > 0: df_samples = df_samples and samples_to_add
-
-    samples = [load_sample(fs_prefix, df, preproc, df_sample,
-                    sample_dir_wc = sample_dir_wc, fastq_gz_file_wc = fastq_gz_file_wc, 
-                    count_wc=count_wc) for df_sample in df_samples]
-    
-    sample_set = pd.DataFrame(samples)
+    preproc_dir = os.path.dirname(fastq_gz_file_wc.format(
+        fs_prefix=fs_prefix, df=df, preproc=preproc, strand='R1', df_sample=''))
+    read_files = group_by_sample(scan_reads_dir(preproc_dir, sample_pattern=pattern))
+
+    do_not_add, samples_to_add = set(do_not_add), set(samples_to_add)
+    df_samples = [s for s, strands in read_files.items() if 'R1' in strands and s not in do_not_add]
+    if len(samples_to_add) > 0: 
+        df_samples = [s for s in df_samples if s in samples_to_add]
+
+    sample_set = pd.DataFrame({'df': df, 'df_sample': df_samples, 'preproc': preproc, 'fs_prefix': fs_prefix},
+                              columns=['df', 'df_sample', 'preproc', 'fs_prefix'])
+    counts = load_counts(fs_prefix, df, preproc, df_samples, count_wc, io_workers)
+    sample_set['reads'] = counts['reads_R1'].values
+    if report_bps:
+        sample_set['bps'] = counts['bps_R1'].values
     return sample_set
 
 fields = ['sample', 'sequencing_run']
@@ -145,20 +202,38 @@ fields = ['sample', 'sequencing_run']
 # TODO where to put this one?
 def update_fs_samples_csv(dataset):
     '''
-    Scans dataset folder and updates fs_samples.tsv if necessary
+    Incrementally rescans dataset folder, appends found changes to rescan_changelog.tsv 
+    and updates assnake_samples.tsv if raw samples changed. Summary of the dataset in catalog is updated.
     
     :param dataset: Name of the dataset
-    :return: Returns sample dict in loc
+    :return: Returns list of changes since the previous scan
     
     '''
-    fs_samples_tsv_loc = '{assnake_db}/datasets/{df}/assnake_samples.tsv'.format(assnake_db=read_assnake_instance_config()['assnake_db'], df=dataset)
+    from assnake.api.sample_index import SampleIndex, SAMPLE_INDEX_FILE, RESCAN_CHANGELOG_FILE, write_changelog
+    from assnake.api.catalog import update_dataset_summary
+    from assnake.api.sample_tables import write_sample_table
+
+    assnake_db = read_assnake_instance_config()['assnake_db']
+    df_dir_in_db = os.path.join(assnake_db, 'datasets', dataset)
+    fs_samples_tsv_loc = os.path.join(df_dir_in_db, 'assnake_samples.tsv')
     df = assnake.Dataset(dataset)
-    fs_samples_pd = pd.concat(list(df.sample_sets.values()))
-    fs_samples_pd = df.sample_sets['raw']
-    fs_samples_pd['final_preprocessing'] = 'never_set'
-    fs_samples_pd.to_csv(fs_samples_tsv_loc, sep='\t', index = False)
 
-    return True
+    sample_index = SampleIndex(os.path.join(df_dir_in_db, SAMPLE_INDEX_FILE), df.fs_prefix, df.df)
+    changes = sample_index.rescan(df.preprocs)
+    write_changelog(os.path.join(df_dir_in_db, RESCAN_CHANGELOG_FILE), changes)
 
+    if not os.path.isfile(fs_samples_tsv_loc) or any(c['preproc'] == 'raw' for c in changes):
+        fs_samples_pd = sample_index.load_sample_set('raw')[['preproc', 'df', 'fs_prefix', 'df_sample', 'reads']]
+        fs_samples_pd['final_preprocessing'] = 'never_set'
+        write_sample_table(fs_samples_pd, fs_samples_tsv_loc)
+    update_dataset_summary(assnake_db, dataset, sample_index)
+    sample_index.close()
 
+    return changes
 
+def load_fs_samples(dataset):
+    '''
+    Reads assnake_samples.tsv of the dataset written by update_fs_samples_csv, from its columnar copy if it is up to date.
+    '''
+    from assnake.api.sample_tables import read_sample_table
+    return read_sample_table(os.path.join(read_assnake_instance_config()['assnake_db'], 'datasets', dataset, 'assnake_samples.tsv'))
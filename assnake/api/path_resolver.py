@@ -0,0 +1,146 @@
+import os
+import re
+from collections import namedtuple
+
+import pandas as pd
+
+from assnake.core.config import load_wc_config
+from assnake.utils.general import wc_template_regex, WILDCARD_REGEXES
+
+ResolvedPath = namedtuple('ResolvedPath', ['path', 'wc_key', 'result', 'wildcards'])
+
+
+class PathResolver:
+    '''
+    Reverse of `wc.format(...)`: maps existing path back to the wildcard string that produces it and its wildcards.
+    All templates are compiled into one regex with an alternative per template, so path is matched in one call.
+
+    Templates with more literal characters are tried first, so `{preproc}__tmtic_{preset}` wins over plain `{preproc}`.
+    Templates of results are tried before other templates with the same path.
+    '''
+
+    def __init__(self, templates, fs_prefix=None):
+        '''
+        :param templates: dict wc_key -> (wildcard string, result name or None)
+        :param fs_prefix: if set, only paths under this fs_prefix are resolved. Makes matching cheaper, used when walking a tree.
+        '''
+        self.templates = templates
+        self.fs_prefix = fs_prefix
+        wildcard_regexes = WILDCARD_REGEXES
+        if fs_prefix is not None:
+            wildcard_regexes = {**WILDCARD_REGEXES, 'fs_prefix': re.escape(fs_prefix.rstrip('/'))}
+
+        def priority(wc_key):
+            wc_str, result = templates[wc_key]
+            literal_len = len(re.sub(r'\{[^}]*\}', '', wc_str))
+            return (-literal_len, result is None, wc_key)
+
+        self.alternatives = {}
+        regexes = []
+        for i, wc_key in enumerate(sorted(templates.keys(), key=priority)):
+            wc_str, result = templates[wc_key]
+            group = 't%d' % i
+            fields = {}
+            regex = wc_template_regex(wc_str, wildcard_regexes)
+            # Group names must be unique across alternatives
+            for field in set(re.findall(r'\(\?P[<=](\w+)', regex)):
+                fields[group + '__' + field] = field
+            regex = re.sub(r'\(\?P([<=])(\w+)', lambda m: '(?P%s%s__%s' % (m.group(1), group, m.group(2)), regex)
+            self.alternatives[group] = (wc_key, result, fields)
+            regexes.append('(?P<%s>%s)' % (group, regex))
+        self.regex = re.compile('^(?:%s)$' % '|'.join(regexes)) if len(regexes) > 0 else None
+
+    def resolve(self, path):
+        '''
+        :return: ResolvedPath or None if path doesn't match any template.
+        '''
+        if self.regex is None:
+            return None
+        match = self.regex.match(path)
+        if match is None:
+            return None
+        # Outer group of the alternative closes last
+        wc_key, result, fields = self.alternatives[match.lastgroup]
+        wildcards = {field: match.group(group) for group, field in fields.items()}
+        return ResolvedPath(path, wc_key, result, wildcards)
+
+    def resolve_tree(self, root, include_unmatched=False):
+        '''
+        Walks directory tree once and resolves every file in it. Yields (ResolvedPath, size in bytes).
+        Files that don't match any template are yielded with wc_key None if include_unmatched is set.
+        Symlinked directories are not followed.
+        '''
+        stack = [root]
+        while len(stack) > 0:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    size = entry.stat().st_size
+                except OSError:
+                    size = None
+                resolved = self.resolve(entry.path)
+                if resolved is not None:
+                    yield resolved, size
+                elif include_unmatched:
+                    yield ResolvedPath(entry.path, None, None, {}), size
+
+
+def registered_templates(manifest=None, wc_config=None):
+    '''
+    Collects all wildcard strings: core wc_config and wc_configs of installed plugins.
+    Keys `<result name>_wc` are attributed to the result, and `result_wc` of every result is added as `<result name>_wc`.
+
+    :return: dict wc_key -> (wildcard string, result name or None)
+    '''
+    if manifest is None:
+        from assnake.core.plugin_manifest import get_plugin_manifest
+        manifest = get_plugin_manifest()
+    if wc_config is None:
+        wc_config = load_wc_config()
+
+    all_wc = dict(wc_config)
+    for plugin in manifest['plugins'].values():
+        all_wc.update(plugin['wc_config'])
+
+    templates = {}
+    for wc_key, wc_str in all_wc.items():
+        if isinstance(wc_str, str) and '{' in wc_str:
+            result = wc_key[:-len('_wc')] if wc_key.endswith('_wc') else None
+            templates[wc_key] = (wc_str, result if result in manifest['results'] else None)
+    for name, info in manifest['results'].items():
+        if info['result_wc']:
+            templates[name + '_wc'] = (info['result_wc'], name)
+    return templates
+
+
+def build_path_resolver(fs_prefix=None, manifest=None, wc_config=None):
+    return PathResolver(registered_templates(manifest, wc_config), fs_prefix)
+
+
+def resolve_path(path):
+    '''
+    Maps single path to ResolvedPath (wc_key, result, wildcards) using all registered wildcard strings. None if nothing matches.
+    '''
+    return build_path_resolver().resolve(path)
+
+
+def classify_tree(fs_prefix, include_unmatched=False, manifest=None, wc_config=None):
+    '''
+    Classifies every file under `fs_prefix` in one walk.
+
+    :return: DataFrame with path, bytes, wc_key, result and a column for every wildcard found.
+    '''
+    resolver = build_path_resolver(fs_prefix.rstrip('/'), manifest, wc_config)
+    rows = []
+    for resolved, size in resolver.resolve_tree(fs_prefix, include_unmatched):
+        rows.append({'path': resolved.path, 'bytes': size, 'wc_key': resolved.wc_key, 'result': resolved.result, **resolved.wildcards})
+    columns = ['path', 'bytes', 'wc_key', 'result']
+    classified = pd.DataFrame(rows)
+    return classified.reindex(columns=columns + [c for c in classified.columns if c not in columns])
@@ -0,0 +1,298 @@
+import os
+import time
+import sqlite3
+
+import pandas as pd
+
+from assnake.core.config import load_wc_config
+from assnake.api.loaders import load_counts, map_io, COUNT_STRANDS
+from assnake.api.discovery import scan_reads_dir, group_by_sample
+
+SAMPLE_INDEX_FILE = 'sample_index.sqlite'
+RESCAN_CHANGELOG_FILE = 'rescan_changelog.tsv'
+
+# Bump when the layout of the tables changes. Index is just a cache, so outdated index is dropped and rebuilt.
+SCHEMA_VERSION = 5
+
+# Directories modified less than this time ago are not trusted - files may still be written into them
+# with the same mtime on filesystems with coarse timestamps (NFS, ext3). We rescan them next time.
+RACY_WINDOW_NS = 2 * 10**9
+
+
+class SampleIndex:
+    '''
+    Persistent on-disk index of samples in the dataset. For every preprocessing it stores
+    samples, sizes and mtimes of read files and read counts, so Dataset can be loaded without
+    globbing the filesystem and opening every .count file.
+
+    Preprocessing directory is rescanned only if its mtime changed since last scan.
+    Count files of all samples are checked only if the read directory or the count directory of preprocessing
+    (profile/count/{preproc}, changes when sample is counted for the first time) changed. Otherwise only count
+    directories of samples are checked, they change when count file is replaced by a new one, and `rescan` checks
+    count files of every sample. Counts are reloaded only if mtime of count files changed.
+    Count files are checked in a thread pool of `io_workers`.
+    '''
+
+    def __init__(self, index_loc, fs_prefix, df, wc_config=None, io_workers=None):
+        self.index_loc = index_loc
+        self.io_workers = io_workers
+        self.fs_prefix = fs_prefix
+        self.df = df
+        self.wc_config = load_wc_config() if wc_config is None else wc_config
+
+        try:
+            self.conn = sqlite3.connect(index_loc, timeout=60)
+            self._init_schema()
+        except sqlite3.Error:
+            # Dataset folder is not writable, or filesystem doesn't support locking. Work in memory.
+            self.conn = sqlite3.connect(':memory:')
+            self._init_schema()
+
+    def _init_schema(self):
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.executescript('''
+                DROP TABLE IF EXISTS dirs;
+                DROP TABLE IF EXISTS samples;
+            ''')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS dirs (
+                preproc TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                count_mtime_ns INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS samples (
+                preproc TEXT NOT NULL,
+                df_sample TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                reads INTEGER NOT NULL,
+                bps INTEGER NOT NULL,
+                reads_R2 INTEGER NOT NULL,
+                bps_R2 INTEGER NOT NULL,
+                count_mtime_ns INTEGER,
+                count_dir_mtime_ns INTEGER,
+                paired INTEGER NOT NULL,
+                PRIMARY KEY (preproc, df_sample)
+            );
+            PRAGMA user_version = %d;
+        ''' % SCHEMA_VERSION)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def preproc_dir(self, preproc):
+        return os.path.dirname(self.wc_config['fastq_gz_file_wc'].format(
+            fs_prefix=self.fs_prefix, df=self.df, preproc=preproc, df_sample='', strand='R1'))
+
+    def count_dir(self, preproc):
+        return os.path.dirname(self.count_loc(preproc, ''))
+
+    def count_loc(self, preproc, df_sample, strand='R1'):
+        return self.wc_config['count_wc'].format(
+            fs_prefix=self.fs_prefix, df=self.df, preproc=preproc, df_sample=df_sample, strand=strand)
+
+    def scan_preproc_dir(self, preproc):
+        '''
+        Lists preprocessing directory once and returns dict df_sample -> (bytes, mtime_ns, 1 if it has R2 file else 0).
+        Sample is present if it has R1 file, R2 is optional (single-end).
+        '''
+        samples = {}
+        for df_sample, strands in group_by_sample(scan_reads_dir(self.preproc_dir(preproc), with_stat=True)).items():
+            if 'R1' in strands:
+                samples[df_sample] = (sum(f.size for f in strands.values()), max(f.mtime_ns for f in strands.values()), int('R2' in strands))
+        return samples
+
+    def _count_mtimes(self, preproc, df_sample):
+        '''
+        Latest mtime of count files of both strands and mtime of the count directory of sample.
+        None if there are no count files and for the missing directory.
+        '''
+        count_dir_mtime_ns = self._sample_count_dir_mtime(preproc, df_sample)
+        count_mtime_ns = None
+        for strand in COUNT_STRANDS:
+            try:
+                count_mtime_ns = max(count_mtime_ns or 0, os.stat(self.count_loc(preproc, df_sample, strand)).st_mtime_ns)
+            except OSError:
+                pass
+        return count_mtime_ns, count_dir_mtime_ns
+
+    def _sample_count_dir_mtime(self, preproc, df_sample):
+        try:
+            return os.stat(os.path.dirname(self.count_loc(preproc, df_sample))).st_mtime_ns
+        except OSError:
+            return None
+
+    def _refresh_preproc(self, preproc, check_counts=False):
+        '''
+        Brings index for one preprocessing up to date. 
+        Returns rows from the index and list of changes since the previous scan.
+
+        :param check_counts: Check count files of every sample, even if none of count directories changed.
+            Catches count files rewritten in place.
+        '''
+        stored = {row[0]: row[1:] for row in self.conn.execute(
+            'SELECT df_sample, bytes, mtime_ns, reads, bps, reads_R2, bps_R2, count_mtime_ns, count_dir_mtime_ns, paired '
+            'FROM samples WHERE preproc = ?', (preproc,))}
+
+        try:
+            dir_mtime_ns = os.stat(self.preproc_dir(preproc)).st_mtime_ns
+        except OSError:
+            self._drop_preproc(preproc)
+            return [], [change_record('removed', preproc, s) for s in sorted(stored)]
+
+        try:
+            count_dir_mtime_ns = os.stat(self.count_dir(preproc)).st_mtime_ns
+        except OSError:
+            count_dir_mtime_ns = 0
+
+        stored_dir = self.conn.execute('SELECT mtime_ns, count_mtime_ns FROM dirs WHERE preproc = ?', (preproc,)).fetchone()
+        if stored_dir is not None and stored_dir[0] == dir_mtime_ns:
+            on_disk = {s: v[0:2] + v[8:9] for s, v in stored.items()}
+            counts_changed = check_counts or stored_dir[1] != count_dir_mtime_ns
+        else:
+            on_disk = self.scan_preproc_dir(preproc)
+            counts_changed = True
+
+        # Count files are checked for all samples only if one of directories changed. Otherwise only
+        # count directories of samples are checked, they change when counts are written (write to temporary file and rename),
+        # and count files are checked only in changed ones. Counts are reloaded in bulk only for samples which count files changed.
+        if counts_changed:
+            to_check = list(on_disk.keys())
+            count_mtimes = {}
+        else:
+            sample_dir_mtimes = map_io(lambda df_sample: self._sample_count_dir_mtime(preproc, df_sample), on_disk.keys(), self.io_workers)
+            to_check = [df_sample for df_sample, m in zip(on_disk.keys(), sample_dir_mtimes) if m is None or m != stored[df_sample][7]]
+            count_mtimes = {df_sample: stored[df_sample][6:8] for df_sample in on_disk.keys()}
+        count_mtimes.update(zip(to_check, map_io(lambda df_sample: self._count_mtimes(preproc, df_sample), to_check, self.io_workers)))
+
+        counts = {}
+        to_load = []
+        for df_sample in on_disk.keys():
+            count_mtime_ns = count_mtimes[df_sample][0]
+            prev = stored.get(df_sample)
+            if prev is not None and prev[6] == count_mtime_ns:
+                counts[df_sample] = prev[2:6]
+            elif count_mtime_ns is None:
+                counts[df_sample] = (-1, -1, -1, -1)
+            else:
+                to_load.append(df_sample)
+        loaded = load_counts(self.fs_prefix, self.df, preproc, to_load, self.wc_config['count_wc'], self.io_workers)
+        for df_sample, row in zip(to_load, loaded[['reads_R1', 'bps_R1', 'reads_R2', 'bps_R2']].itertuples(index=False)):
+            counts[df_sample] = tuple(int(v) for v in row)
+
+        now_ns = int(time.time() * 10**9)
+        def trusted(mtime_ns):
+            # Directories modified within racy window are checked again next time
+            return -1 if mtime_ns is not None and now_ns - mtime_ns < RACY_WINDOW_NS else mtime_ns
+
+        rows = []
+        changes = [change_record('removed', preproc, s) for s in sorted(set(stored) - set(on_disk))]
+        for df_sample, (size, mtime_ns, paired) in on_disk.items():
+            reads, bps, reads_R2, bps_R2 = counts[df_sample]
+            count_mtime_ns, sample_count_dir_mtime_ns = count_mtimes[df_sample]
+            prev = stored.get(df_sample)
+            if prev is None:
+                changes.append(change_record('added', preproc, df_sample, size, reads))
+            elif prev[0:6] != (size, mtime_ns, reads, bps, reads_R2, bps_R2):
+                changes.append(change_record('changed', preproc, df_sample, size, reads))
+            rows.append((preproc, df_sample, size, mtime_ns, reads, bps, reads_R2, bps_R2, count_mtime_ns, trusted(sample_count_dir_mtime_ns), paired))
+
+        dir_mtime_ns = trusted(dir_mtime_ns)
+        count_dir_mtime_ns = trusted(count_dir_mtime_ns)
+
+        dirty = len(changes) > 0 or any(stored[r[1]] != r[2:] for r in rows)
+        if dirty or stored_dir is None or stored_dir != (dir_mtime_ns, count_dir_mtime_ns):
+            with self.conn:
+                self.conn.execute('DELETE FROM samples WHERE preproc = ?', (preproc,))
+                self.conn.executemany('INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self.conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)', (preproc, dir_mtime_ns, count_dir_mtime_ns))
+        return rows, changes
+
+    def _drop_preproc(self, preproc):
+        with self.conn:
+            self.conn.execute('DELETE FROM samples WHERE preproc = ?', (preproc,))
+            self.conn.execute('DELETE FROM dirs WHERE preproc = ?', (preproc,))
+
+    def _drop_missing_preprocs(self, preprocs):
+        '''
+        Removes preprocessings not in `preprocs` from the index and returns changes for their samples.
+        '''
+        changes = []
+        indexed = [row[0] for row in self.conn.execute('SELECT preproc FROM dirs')]
+        for preproc in sorted(set(indexed) - set(preprocs)):
+            changes += [change_record('removed', preproc, row[0]) for row in self.conn.execute(
+                'SELECT df_sample FROM samples WHERE preproc = ? ORDER BY df_sample', (preproc,))]
+            self._drop_preproc(preproc)
+        return changes
+
+    def load_sample_set(self, preproc):
+        '''
+        Returns sample set for preprocessing as DataFrame, in the same format as loaders.load_sample_set with report_bps,
+        plus size of read files in bytes and whether sample has R2 file (paired).
+        '''
+        rows, _ = self._refresh_preproc(preproc)
+        sample_set = pd.DataFrame(
+            [{'df': self.df, 'df_sample': r[1], 'preproc': preproc, 'fs_prefix': self.fs_prefix,
+              'reads': r[4], 'bps': r[5], 'bytes': r[2], 'paired': bool(r[10])} for r in rows],
+            columns=['df', 'df_sample', 'preproc', 'fs_prefix', 'reads', 'bps', 'bytes', 'paired'])
+        return sample_set
+
+    def load_sample_sets(self, preprocs):
+        '''
+        Returns dict preproc -> sample set DataFrame for all non-empty preprocessings.
+        Preprocessings not in `preprocs` are removed from the index.
+        '''
+        self._drop_missing_preprocs(preprocs)
+
+        sample_sets = {}
+        for preproc in preprocs:
+            sample_set = self.load_sample_set(preproc)
+            if len(sample_set) > 0:
+                sample_sets.update({preproc: sample_set})
+        return sample_sets
+
+    def load_counts(self, preproc):
+        '''
+        Returns counts of both strands for preprocessing in the same format as loaders.load_counts.
+        '''
+        rows, _ = self._refresh_preproc(preproc)
+        counts = pd.DataFrame([r[4:8] for r in rows], columns=['reads_R1', 'bps_R1', 'reads_R2', 'bps_R2'], dtype='int64',
+                              index=pd.Index([r[1] for r in rows], name='df_sample', dtype=object))
+        counts = counts[['reads_R1', 'reads_R2', 'bps_R1', 'bps_R2']]
+        counts['mismatch'] = (counts['reads_R1'] >= 0) & (counts['reads_R2'] >= 0) & (counts['reads_R1'] != counts['reads_R2'])
+        return counts
+
+    def summary(self):
+        '''
+        Number of samples per preprocessing and total size of read files as of the last scan. Nothing is rescanned.
+        '''
+        rows = self.conn.execute('SELECT preproc, COUNT(*), SUM(bytes) FROM samples GROUP BY preproc ORDER BY preproc').fetchall()
+        return {preproc: n for preproc, n, _ in rows}, sum(total_bytes for _, _, total_bytes in rows)
+
+    def rescan(self, preprocs):
+        '''
+        Updates index for provided preprocessings and returns list of changes (added, removed, changed samples)
+        since the previous scan. Only directories with changed mtime are listed, but count files of every sample
+        are checked, so counts rewritten in place are not missed.
+        '''
+        changes = self._drop_missing_preprocs(preprocs)
+        for preproc in preprocs:
+            changes += self._refresh_preproc(preproc, check_counts=True)[1]
+        return changes
+
+
+def change_record(change, preproc, df_sample, size=None, reads=None):
+    return {'change': change, 'preproc': preproc, 'df_sample': df_sample, 'bytes': size, 'reads': reads}
+
+
+def write_changelog(changelog_loc, changes):
+    '''
+    Appends changes found by SampleIndex.rescan to the tsv changelog with the time of the scan.
+    '''
+    if len(changes) == 0:
+        return
+    changelog = pd.DataFrame(changes, columns=['change', 'preproc', 'df_sample', 'bytes', 'reads'])
+    changelog.insert(0, 'scan_time', time.strftime('%Y-%m-%dT%H:%M:%S'))
+    changelog.to_csv(changelog_loc, sep='\t', index=False, mode='a', header=not os.path.isfile(changelog_loc))
@@ -0,0 +1,165 @@
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Columns with few distinct values, stored as categoricals
+CATEGORICAL_COLUMNS = ['df', 'preproc', 'fs_prefix', 'final_preprocessing']
+INTEGER_COLUMNS = ['reads', 'bps', 'bytes']
+
+COLUMNAR_FORMATS = ['feather', 'npz']
+COLUMNAR_EXTENSIONS = {'feather': '.feather', 'npz': '.npz'}
+# Errors of missing, corrupted or incompatible columnar copy. Sample table is read from tsv then.
+COLUMNAR_READ_ERRORS = (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile)
+
+
+def columnar_format():
+    '''
+    Feather if pyarrow is installed, npz of numpy arrays otherwise.
+    '''
+    return 'feather' if pyarrow is not None else 'npz'
+
+
+def columnar_loc(tsv_loc, fmt=None):
+    '''
+    Location of the columnar copy of sample table, next to the tsv: sample_set.tsv -> sample_set.feather
+    '''
+    fmt = columnar_format() if fmt is None else fmt
+    return os.path.splitext(tsv_loc)[0] + COLUMNAR_EXTENSIONS[fmt]
+
+
+def to_typed(sample_table):
+    '''
+    Casts repeated string columns to categoricals and counts to int64.
+    '''
+    sample_table = sample_table.copy()
+    for column in sample_table.columns:
+        if column in CATEGORICAL_COLUMNS:
+            sample_table[column] = sample_table[column].astype('category')
+        elif column in INTEGER_COLUMNS and sample_table[column].notnull().all():
+            sample_table[column] = sample_table[column].astype('int64')
+    return sample_table
+
+
+def _str_array(values):
+    '''
+    Numpy unicode array of values, None if some of them are not strings.
+    '''
+    values = list(values)
+    if not all(isinstance(value, str) for value in values):
+        return None
+    return np.array(values, dtype=str)
+
+
+def to_arrays(typed):
+    '''
+    Sample table as dict of plain numpy arrays for np.savez: categoricals as codes and categories,
+    numbers as they are, strings as unicode arrays with mask of empty values. Nothing is pickled,
+    so the file is read with allow_pickle=False. Returns None if some column can't be stored this way.
+    '''
+    arrays = {'columns': _str_array(typed.columns)}
+    if arrays['columns'] is None:
+        return None
+    for i, column in enumerate(typed.columns):
+        key = 'c%d' % i
+        values = typed[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            arrays[key + '_codes'] = values.cat.codes.to_numpy()
+            arrays[key + '_categories'] = _str_array(values.cat.categories)
+        elif values.dtype.kind in 'iufb':
+            arrays[key] = values.to_numpy()
+        else:
+            null = values.isnull().to_numpy()
+            arrays[key] = _str_array(values.where(~null, ''))
+            arrays[key + '_null'] = null
+        if any(array is None for array in arrays.values()):
+            return None
+    return arrays
+
+
+def from_arrays(arrays):
+    '''
+    Sample table from arrays written by to_arrays.
+    '''
+    columns = list(arrays['columns'])
+    data = {}
+    for i, column in enumerate(columns):
+        key = 'c%d' % i
+        if key + '_codes' in arrays:
+            data[column] = pd.Categorical.from_codes(arrays[key + '_codes'], categories=arrays[key + '_categories'].astype(object))
+        elif key + '_null' in arrays:
+            values = arrays[key].astype(object)
+            values[arrays[key + '_null']] = np.nan
+            data[column] = values
+        else:
+            data[column] = arrays[key]
+    return pd.DataFrame(data, columns=columns)
+
+
+def _write_atomic(write, loc):
+    tmp_loc = '{loc}.tmp.{pid}'.format(loc=loc, pid=os.getpid())
+    write(tmp_loc)
+    os.replace(tmp_loc, loc)
+
+
+def _write_npz(arrays, loc):
+    with open(loc, 'wb') as npz_file:
+        np.savez(npz_file, **arrays)
+
+
+def write_sample_table(sample_table, tsv_loc, columnar=True):
+    '''
+    Writes sample table as tsv (read by snakemake rules) and, if columnar, a typed columnar copy next to it,
+    that read_sample_table prefers. The columnar copy is written last, so it is never older than the tsv it mirrors.
+    '''
+    sample_table = sample_table.reset_index(drop=True)
+    _write_atomic(lambda loc: sample_table.to_csv(loc, sep='\t', index=False), tsv_loc)
+
+    typed = to_typed(sample_table) if columnar else None
+    arrays = to_arrays(typed) if columnar and columnar_format() == 'npz' else None
+    columnar = columnar and (columnar_format() == 'feather' or arrays is not None)
+
+    for fmt in COLUMNAR_FORMATS:
+        if os.path.exists(columnar_loc(tsv_loc, fmt)) and (not columnar or fmt != columnar_format()):
+            os.remove(columnar_loc(tsv_loc, fmt))
+    if columnar:
+        if columnar_format() == 'feather':
+            _write_atomic(lambda loc: typed.to_feather(loc), columnar_loc(tsv_loc))
+        else:
+            _write_atomic(lambda loc: _write_npz(arrays, loc), columnar_loc(tsv_loc))
+
+
+def _read_columnar(loc, fmt):
+    if fmt == 'feather':
+        return pd.read_feather(loc)
+    with np.load(loc, allow_pickle=False) as npz:
+        return from_arrays({key: npz[key] for key in npz.files})
+
+
+def read_sample_table(tsv_loc):
+    '''
+    Reads sample table written by write_sample_table from the fastest available copy.
+    The columnar copy is used only if it is not older than the tsv, so edits of the tsv by hand are not lost.
+
+    :return: DataFrame with categorical df, preproc and fs_prefix columns.
+    '''
+    try:
+        tsv_mtime = os.stat(tsv_loc).st_mtime_ns
+    except FileNotFoundError:
+        tsv_mtime = None
+    for fmt in COLUMNAR_FORMATS:
+        if fmt == 'feather' and pyarrow is None:
+            continue
+        loc = columnar_loc(tsv_loc, fmt)
+        try:
+            if tsv_mtime is not None and os.stat(loc).st_mtime_ns < tsv_mtime:
+                continue
+            return _read_columnar(loc, fmt)
+        except COLUMNAR_READ_ERRORS:
+            continue # Missing, corrupted or written by incompatible version, fall back to tsv
+    return to_typed(pd.read_csv(tsv_loc, sep='\t', dtype={'df_sample': str}))
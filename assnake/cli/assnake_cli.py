@@ -8,11 +8,12 @@ from assnake.cli.commands.execute_commands import gather
 
 from assnake.utils.general import read_yaml
 
-from assnake.core.config import read_assnake_instance_config, read_internal_config, check_if_assnake_is_initialized
-from assnake.core.command_builder import sample_set_construction_options, add_options
+from assnake.core.config import read_assnake_instance_config, read_internal_config, check_if_assnake_is_initialized, load_wc_config
+from assnake.core.command_builder import sample_set_construction_options, add_options, LazyPluginGroup
 from assnake.core.sample_set import generic_command_individual_samples, generate_result_list
+from assnake.api.loaders import set_io_workers
+from assnake.core.dataset import DatasetCache
 
-from pkg_resources import iter_entry_points 
 
 
 #---------------------------------------------------------------------------------------
@@ -21,8 +22,10 @@ from pkg_resources import iter_entry_points
 
 @click.group()
 @click.version_option()
+@click.option('--io-workers', type=click.INT, default=None, 
+    help='Threads for reading sample files metadata and counts. Overrides io_workers from instance config.')
 @click.pass_context
-def cli(ctx):
+def cli(ctx, io_workers):
     """\b
    ___    ____   ____   _  __   ___    __ __   ____
   / _ |  / __/  / __/  / |/ /  / _ |  / //_/  / __/
@@ -47,18 +50,22 @@ O---o and work with 16s rRNA data.
 
     dir_of_this_file = os.path.dirname(os.path.abspath(__file__))
 
+    if io_workers is not None:
+        set_io_workers(io_workers)
+
     instance_config = read_assnake_instance_config()
 
     if instance_config is not None:
-        wc_config = read_yaml(os.path.join(dir_of_this_file, '../snake/wc_config.yaml'))
-        ctx.obj = {'config': instance_config, 'wc_config': wc_config, 'requested_dfs': [], 'requests': [], 'sample_sets': [], 'requested_results': []}
+        wc_config = load_wc_config()
+        ctx.obj = {'config': instance_config, 'wc_config': wc_config, 'requested_dfs': [], 'requests': [], 'sample_sets': [], 'requested_results': [],
+                   'destroy_if_not_run': [], 'datasets': DatasetCache()}
 
 
 #---------------------------------------------------------------------------------------
 #                                  assnake  INIT ***  group
 #---------------------------------------------------------------------------------------
 
-@cli.group(name='init')
+@cli.group(name='init', cls=LazyPluginGroup, plugin_command_group='init')
 def init_group():
     """Commands to initialize the ASSNAKE\n
     \bYou need to configure where assnake will store it's data and download databases.
@@ -83,26 +90,18 @@ dataset.add_command(dataset_commands.df_create)
 dataset.add_command(dataset_commands.df_import_reads)
 dataset.add_command(dataset_commands.df_delete)
 dataset.add_command(dataset_commands.rescan_dataset)
+dataset.add_command(dataset_commands.verify_dataset)
 
 
 #---------------------------------------------------------------------------------------
 #                                  assnake  RESULT ***  group
 #---------------------------------------------------------------------------------------
-@cli.group(chain = True, help = 'Used to request and run results')
+# Commands from plugins are resolved lazily from the plugin manifest, see LazyPluginGroup
+@cli.group(chain = True, help = 'Used to request and run results', cls=LazyPluginGroup, plugin_command_group='result')
 def result():
     """Commands to analyze your data"""
     check_if_assnake_is_initialized()
 
-
-for entry_point in iter_entry_points('assnake.plugins'):
-    module_class = entry_point.load()
-    for snakeresult in module_class.results:
-        result.add_command(snakeresult.invocation_command)
-    for cmd in module_class.invocation_commands:
-        result.add_command(cmd)
-    for cmd in module_class.initialization_commands:
-        init_group.add_command(cmd)
-
 result.add_command(gather)
 
 
@@ -138,6 +137,7 @@ def module_group():
 module_group.add_command(module_commands.show_installed_results)
 module_group.add_command(module_commands.show_installed_modules)
 module_group.add_command(module_commands.refresh_params)
+module_group.add_command(module_commands.refresh_manifest)
 
 
 def main():
@@ -3,9 +3,8 @@ import pandas as pd
 import assnake.api.loaders
 import assnake.core.sample_set
 from tabulate import tabulate
-from assnake.api import fs_helpers
+from assnake.api import fs_helpers, counters, archive_import, checksums, catalog
 from assnake.utils.general import pathizer, dict_norm_print, download_from_url
-from zipfile import ZipFile
 from assnake.api.loaders import update_fs_samples_csv
 from pathlib import Path
 # some util
@@ -39,6 +38,11 @@ def df_list():
         click.echo(click.style('' * 2 + df_name + ' ' * 2, fg='green', bold=True))
         # click.echo('  Filesystem prefix: ' + df.get('fs_prefix', ''))
         click.echo('  Full path: ' + os.path.join(df.get('fs_prefix', ''), df['df']))
+        summary = df.get('summary', {})
+        if 'last_scan' in summary:
+            samples = ', '.join('{}: {}'.format(preproc, n) for preproc, n in sorted(summary['samples'].items()))
+            click.echo('  Samples: ' + (samples if samples != '' else 'none'))
+            click.echo('  Size: {:.2f} GB, last scan: {}'.format(summary['bytes'] / 1024**3, summary['last_scan']))
         # click.echo('  Description: ')
         # dict_norm_print(df.get('description', ''))
         click.echo('')
@@ -176,21 +180,16 @@ def df_create(config, df_name, data_storage_folder, full_path_to_df,first_prepro
 
     with open(os.path.join(df_path_in_assnake, 'df_info.yaml'), 'w') as info_file:
         yaml.dump(df_info, info_file, default_flow_style=False)
+    catalog.register_dataset(assnake_db, df_info)
     click.secho('Saved dataset ' + df + ' sucessfully!', fg='green')
 
 
     if test_data:
-        download_from_url('http://kronos.pharmacology.dal.ca/public_files/tutorial_datasets/mgs_tutorial_Oct2017.zip', 
-                                os.path.join(fs_prefix, df,'mgs_tutorial_Oct2017.zip'))
-        
-        with ZipFile(os.path.join(fs_prefix, df,'mgs_tutorial_Oct2017.zip'), 'r') as zipObj:
-            
-            zipObj.extractall(os.path.join(fs_prefix, df,'./'))
-        shutil.rmtree(os.path.join(fs_prefix, df, 'reads'), ignore_errors=True)
-        os.makedirs(os.path.join(fs_prefix, df, 'reads'), exist_ok=True)
-        shutil.move (os.path.join(fs_prefix, df,'mgs_tutorial_Oct2017/raw_data'), os.path.join(fs_prefix, df, 'reads/raw'))
-        # TODO cleanup
-        shutil.rmtree(os.path.join(fs_prefix, df,'mgs_tutorial_Oct2017'), ignore_errors=True)
+        archive_loc = os.path.join(fs_prefix, df, 'mgs_tutorial_Oct2017.zip')
+        download_from_url('http://kronos.pharmacology.dal.ca/public_files/tutorial_datasets/mgs_tutorial_Oct2017.zip', archive_loc)
+        extracted = archive_import.extract_reads(archive_loc, os.path.join(fs_prefix, df, 'reads', first_preprocessing_name),
+                                                 pattern='*raw_data/*.fastq.gz')
+        click.echo('Extracted %d read files' % len(extracted))
 
 # ---------------------------------------------------------------------------------------
 #                                   INIT
@@ -237,6 +236,9 @@ def df_init(config, data_type, df_name, first_preprocessing_name):
     if not os.path.isfile(df_info_loc):
         with open(df_info_loc, 'w') as info_file:
             yaml.dump(df_info, info_file, default_flow_style=False)
+        catalog.register_dataset(assnake_db, df_info)
+    else:
+        catalog.update_catalog(assnake_db, df)
     click.secho('Saved dataset ' + df + ' sucessfully!', fg='green')
 
 # ---------------------------------------------------------------------------------------
@@ -320,7 +322,7 @@ def df_delete(config, df, hard, df_arg):
 # DONE decide if we need either d and t or proceed both arguments as one and automatically choose path or not
 @click.command(name='import-reads')
 @click.option('--reads-dir', '-r', prompt='Location of folder with read files',
-              help='Location of folder with read files', type=click.Path())
+              help='Location of folder with read files, or of zip/tar archive with them', type=click.Path())
 @click.option('--dataset', '-d', help='Assnake dataset name. If -t is not specified', required=False)
 @click.option('--rename-method', help='How to rename samples', type=click.Choice(['replace-', 'removeSending'], case_sensitive=False), required=False)
 @click.option('--target', '-t', help='Location of the target directory. If -d is not specified.', required=False,
@@ -329,8 +331,14 @@ def df_delete(config, df, hard, df_arg):
 @click.option('--sample_list', '-l', help='Location of file with line by line samples of interest', required=False,
               type=click.Path())
 @click.option('--copy', help='If is set, hard copying will be used instead of symbolic links ', is_flag=True)
+@click.option('--link-mode', help='How to import files. copy tries reflink, then hard link, then copy. Default - symlink, or copy with --copy',
+              type=click.Choice(fs_helpers.LINK_MODES), required=False)
+@click.option('--dry-run', help='Only show what will be linked or copied', is_flag=True)
+@click.option('--count-reads', help='Count reads and bases in imported files and write .count files', is_flag=True)
+@click.option('--checksum', help='Add checksums of read files to the checksum manifest of the dataset',
+              type=click.Choice(checksums.available_algorithms()), required=False)
 @click.pass_obj
-def df_import_reads(config, reads_dir, dataset, rename_method, target, sample_set, sample_list, copy):
+def df_import_reads(config, reads_dir, dataset, rename_method, target, sample_set, sample_list, copy, link_mode, dry_run, count_reads, checksum):
     """
     Import reads from directory to assnake dataset. Currently local text files are supported. The --target argument
     point to location (relative or absolute) of assnake dataset in your file system. Please, pay attention,
@@ -380,24 +388,48 @@ def df_import_reads(config, reads_dir, dataset, rename_method, target, sample_se
     else:
         modify_name=lambda arg: arg.replace('-', '_')
 
-    samples_in_run = fs_helpers.get_samples_from_dir(reads_dir, modify_name)
-    if len(samples_in_run) > 0:
-        samples_in_run['df_sample'] = samples_in_run['modified_name']
-        fs_helpers.create_links(target,  samples_in_run, hard=copy)
-
+    if archive_import.is_archive(reads_dir):
+        report = []
+        imported = [os.path.basename(loc) for loc in archive_import.extract_reads(reads_dir, target, modify_name=modify_name, report=report)]
+        if len(report) > 0:
+            click.secho('Ambiguous files ({}): {}'.format(len(report), ', '.join(os.path.basename(r['file']) for r in report)), fg='yellow')
+        imported_samples = sorted(set(name[:-len('_R1.fastq.gz')] for name in imported))
+    else:
+        samples_in_run, report = fs_helpers.classify_run_dir(reads_dir, modify_name)
+        for problem, files in report.groupby('problem', sort=True)['file']:
+            click.secho('{} files ({}): {}'.format(problem.capitalize(), len(files), ', '.join(os.path.basename(f) for f in files)), fg='yellow')
+        imported_samples = []
+        if len(samples_in_run) > 0:
+            samples_in_run['df_sample'] = samples_in_run['modified_name']
+            results = fs_helpers.create_links(target,  samples_in_run, hard=copy, link_mode=link_mode, just_print=dry_run, progress=True)
+            if dry_run:
+                return
+            imported_samples = sorted(set(action.df_sample for action, result in results if result != 'exists' and not result.startswith('error')))
+
+    if len(imported_samples) > 0:
+        if count_reads:
+            counted = counters.count_reads(df_info.fs_prefix, df_info.df, ['raw'], samples=imported_samples)
+            click.echo('Counted reads in %d files' % len(counted))
+        if checksum is not None:
+            hashed, _ = checksums.update_dataset_checksums(df_info.df, checksum)
+            click.echo('Computed %s checksums of %d files' % (checksum, len(hashed)))
         update_fs_samples_csv(df_info.df)
         click.secho("SUCCESSFULLY IMPORTED READS!", fg='green') 
     else: 
-        click.secho('No reads in directory ' + reads_dir, fg='yellow')
+        click.secho('No reads in ' + reads_dir, fg='yellow')
 
 
 @click.command(name='rescan')
 @click.option('--dataset', '-d', help='Assnake dataset name', required=False)
+@click.option('--count-reads', help='Count reads and bases in files without up to date .count files', is_flag=True)
+@click.option('--checksum', help='Update checksum manifest of the dataset, only new and changed files are hashed',
+              type=click.Choice(checksums.available_algorithms()), required=False)
 @click.argument('df_arg', required=False)
 @click.pass_obj
-def rescan_dataset(config, dataset, df_arg):
+def rescan_dataset(config, dataset, count_reads, checksum, df_arg):
     """
-    Now it just updates fs_samples.tsv in ./assnkae_db/{dataset}/
+    Rescans only changed preprocessing directories of the dataset, appends changes to 
+    rescan_changelog.tsv and updates assnake_samples.tsv in ./assnkae_db/{dataset}/
 
     Usage: assnake dataset rescan [dataset] or -d [dataset] ..
     """
@@ -406,6 +438,51 @@ def rescan_dataset(config, dataset, df_arg):
         dataset = click.prompt('Type the name in:')
     if dataset is None:
         dataset = df_arg
-    success = update_fs_samples_csv(dataset)
-    if success:
-        click.secho('SUCCESSFULLY UPDATED INFORMATION IN DATABASE!', fg='green')
+    if count_reads:
+        df_loaded = assnake.Dataset(dataset)
+        counted = counters.count_reads(df_loaded.fs_prefix, df_loaded.df, df_loaded.preprocs)
+        click.echo('Counted reads in %d files' % len(counted))
+    if checksum is not None:
+        hashed, removed = checksums.update_dataset_checksums(dataset, checksum)
+        click.echo('Computed %s checksums of %d files, forgot %d removed files' % (checksum, len(hashed), len(removed)))
+    changes = update_fs_samples_csv(dataset)
+    for change in ['added', 'removed', 'changed']:
+        click.echo('%s: %d' % (change.capitalize(), len([c for c in changes if c['change'] == change])))
+    click.secho('SUCCESSFULLY UPDATED INFORMATION IN DATABASE!', fg='green')
+
+
+@click.command(name='verify')
+@click.option('--dataset', '-d', help='Assnake dataset name', required=False)
+@click.option('--workers', '-w', help='Number of hashing processes. Default - number of CPUs', type=int, required=False)
+@click.argument('df_arg', required=False)
+@click.pass_obj
+def verify_dataset(config, dataset, workers, df_arg):
+    """
+    Rehashes read files of the dataset and compares them with the checksum manifest 
+    created by import-reads --checksum or rescan --checksum.
+
+    Usage: assnake dataset verify [dataset] or -d [dataset] ..
+    """
+    if not (bool(dataset is None) ^ bool(df_arg is None)):
+        click.echo('Please, specify dataset either as option or argument')
+        dataset = click.prompt('Type the name in:')
+    if dataset is None:
+        dataset = df_arg
+
+    df, manifest = checksums.open_dataset_manifest(dataset)
+    if len(manifest.entries) == 0:
+        click.secho('No checksums for %s yet. Run assnake dataset rescan %s --checksum md5' % (dataset, dataset), fg='yellow')
+        exit(1)
+
+    recorded = set(manifest.entries.keys())
+    not_recorded = [loc for loc in checksums.dataset_read_files(df.fs_prefix, df.df, df.preprocs) if manifest.relpath(loc) not in recorded]
+
+    verified = manifest.verify(workers)
+    failed = verified.loc[verified['status'] != 'ok']
+    if len(failed) > 0:
+        click.echo(tabulate(failed, headers='keys', tablefmt='plain', showindex=False))
+    click.echo('OK: %d, mismatch: %d, missing: %d, without checksum: %d' % (
+        (verified['status'] == 'ok').sum(), (verified['status'] == 'mismatch').sum(), (verified['status'] == 'missing').sum(), len(not_recorded)))
+    if len(failed) > 0:
+        exit(1)
+    click.secho('ALL CHECKSUMS MATCH!', fg='green')
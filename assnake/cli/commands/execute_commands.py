@@ -5,6 +5,7 @@
 import click, os
 from assnake.core.config import read_internal_config
 from assnake.api.loaders import update_fs_samples_csv
+from assnake.core.sample_set import destroy_not_run
 
 
 #---------------------------------------------------------------------------------------
@@ -50,9 +51,17 @@ def gather(config, threads, jobs, drmaa, run, touch):
         cores=jobs, nodes=jobs)
 
     print(config['requested_results']) 
+
+    if not run:
+        # Nothing was run, sample sets and aliases created for requested results are not needed
+        for destroy_if_not_run in config.get('destroy_if_not_run', []):
+            destroy_not_run(destroy_if_not_run)
     
     if run:
         click.echo('Updating Datasets:' + str(config['requested_dfs']))
+        # The run changed files of the requested datasets, so cached Dataset objects are outdated
+        if config.get('datasets') is not None:
+            config['datasets'].invalidate()
         for requested_df in set(config['requested_dfs']):
             update_fs_samples_csv(requested_df)
 
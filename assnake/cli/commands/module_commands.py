@@ -4,6 +4,7 @@ from assnake.core.config import read_internal_config, read_assnake_instance_conf
 
 from assnake.core.result import Result
 from assnake.core.snake_module import SnakeModule
+from assnake.core.plugin_manifest import get_plugin_manifest, invalidate_plugin_manifest
 import importlib
 
 from assnake.utils.general import compute_crc32_of_dumped_dict
@@ -29,6 +30,15 @@ def show_installed_results():
     results = Result.get_all_results_as_list()
     click.echo(results)
 
+@click.command(name = 'refresh-manifest')
+def refresh_manifest():
+    """
+    Rebuilds cached manifest of installed modules and results
+    """
+    invalidate_plugin_manifest()
+    manifest = get_plugin_manifest()
+    click.echo('Modules: %d, results: %d' % (len(manifest['plugins']), len(manifest['results'])))
+
 @click.command(name = 'redeploy')
 @click.option('--module','-m', help='Snake Module to redeploy')
 def redeploy_snake_module(module):
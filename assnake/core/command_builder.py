@@ -8,7 +8,13 @@ sample_set_construction_options = [
     click.option('--preproc','-p', help='Preprocessing to use' ),
 
     click.option('--meta-column', '-c', help='Select samples based on metadata column' ),
-    click.option('--column-value','-v', help='Value of metadata column by which select samples' ),
+    click.option('--column-value','-v', help='Value of metadata column by which select samples. Can be multiple - separated by commas without whitespace' ),
+    click.option('--merge', help='Put samples with all provided column values into one sample set', is_flag=True ),
+    click.option('--where',
+                help='Select samples by expression over metadata columns and sample stats from the sample index (reads and bps of R1, bytes - size of read files), for example: '
+                     '"reads > 1e6 and source in [\'gut\', \'oral\'] and 10 <= day < 20"',
+                metavar='<expression>',
+                type=click.STRING ),
 
     click.option('--samples-to-add','-s', 
                 help='Samples from dataset to process', 
@@ -27,7 +33,13 @@ options_w_params = [
     click.option('--preproc','-p', help='Preprocessing to use' ),
 
     click.option('--meta-column', '-c', help='Select samples based on metadata column' ),
-    click.option('--column-value','-v', help='Value of metadata column by which select samples' ),
+    click.option('--column-value','-v', help='Value of metadata column by which select samples. Can be multiple - separated by commas without whitespace' ),
+    click.option('--merge', help='Put samples with all provided column values into one sample set', is_flag=True ),
+    click.option('--where',
+                help='Select samples by expression over metadata columns and sample stats from the sample index (reads and bps of R1, bytes - size of read files), for example: '
+                     '"reads > 1e6 and source in [\'gut\', \'oral\'] and 10 <= day < 20"',
+                metavar='<expression>',
+                type=click.STRING ),
 
     click.option('--samples-to-add','-s', 
                 help='Samples from dataset to process', 
@@ -53,3 +65,52 @@ def add_options(options):
         return func
     return _add_options
 
+
+
+class LazyPluginGroup(click.Group):
+    '''
+    Click group with commands provided by assnake plugins. Command names and short help are taken from
+    the cached plugin manifest, and plugin is imported only when one of its commands is invoked.
+
+    :param plugin_command_group: `result` or `init`
+    '''
+    def __init__(self, *args, plugin_command_group='result', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.plugin_command_group = plugin_command_group
+
+    def manifest_commands(self):
+        from assnake.core.plugin_manifest import get_plugin_manifest
+        return get_plugin_manifest()['commands'][self.plugin_command_group]
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands.keys()) | set(self.manifest_commands().keys()))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.manifest_commands():
+            from assnake.core.plugin_manifest import load_plugin, plugin_commands
+            module_class = load_plugin(self.manifest_commands()[cmd_name]['plugin'])
+            for cmd in plugin_commands(module_class, self.plugin_command_group):
+                if cmd.name not in self.commands:
+                    self.add_command(cmd)
+        return self.commands.get(cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        '''
+        Same as click.MultiCommand.format_commands, but takes short help of not loaded commands from the manifest.
+        '''
+        from click.utils import make_default_short_help
+
+        names = self.list_commands(ctx)
+        if len(names) == 0:
+            return
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = []
+        for name in names:
+            if name in self.commands:
+                if self.commands[name].hidden:
+                    continue
+                rows.append((name, self.commands[name].get_short_help_str(limit)))
+            else:
+                rows.append((name, make_default_short_help(self.manifest_commands()[name]['short_help'], limit)))
+        with formatter.section('Commands'):
+            formatter.write_dl(rows)
@@ -1,25 +1,52 @@
 import yaml, configparser, os, click
-import os, sys
-import requests, urllib
-from tqdm import tqdm
+import os, sys, copy
 from assnake.utils.general import read_yaml
 from pathlib import Path
 
+# Process-wide cache of parsed yaml configs. location -> ((mtime_ns, size), parsed yaml)
+_yaml_cache = {}
+
+def read_yaml_cached(file_location):
+    '''
+    Reads yaml file through process-wide cache keyed by file location and mtime.
+    File is parsed again only if it was modified. Returns a copy, so callers are free to modify it.
+
+    :raises FileNotFoundError: if there is no such file
+    '''
+    st = os.stat(file_location)
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _yaml_cache.get(file_location)
+    if cached is None or cached[0] != key:
+        cached = (key, read_yaml(file_location))
+        _yaml_cache[file_location] = cached
+    return copy.deepcopy(cached[1])
+
+def invalidate_config_cache(file_location=None):
+    '''
+    Drops cached yaml for file_location, or the whole cache if file_location is None.
+    Must be called after writing config files.
+    '''
+    if file_location is None:
+        _yaml_cache.clear()
+    else:
+        _yaml_cache.pop(file_location, None)
+
 def load_wc_config():
     dir_of_this_file = os.path.dirname(os.path.abspath(__file__))
-    return (read_yaml(os.path.join(dir_of_this_file, '../snake/wc_config.yaml')))
+    return read_yaml_cached(os.path.join(dir_of_this_file, '../snake/wc_config.yaml'))
 
+def get_internal_config_loc():
+    return os.path.join(str(Path.home()), '.config/assnake/internal_config.yaml')
 
 def read_internal_config():
     '''
     Reads the config at ~/.config/assnake/internal_config.yaml and returns as dict
     '''
-    internal_config_loc = os.path.join(str(Path.home()), '.config/assnake/internal_config.yaml')
+    internal_config_loc = get_internal_config_loc()
     
-    if os.path.isfile(internal_config_loc):
-        internal_config = read_yaml(internal_config_loc)
-        return internal_config
-    else:
+    try:
+        return read_yaml_cached(internal_config_loc)
+    except FileNotFoundError:
         internal_config_dir = os.path.join(str(Path.home()), '.config/assnake/')
 
         os.makedirs(internal_config_dir, exist_ok=True)
@@ -34,15 +61,12 @@ def read_assnake_instance_config():
     Reads particular assnake instance config. It is stored inside assnake database as config.yaml (Name subject to change). 
     :return: Returns dict if instance config exists, None otherwise.
     '''
-    # TODO optimize number of times this is called
-    # print('reading instance config')
-    
     internal_config = read_internal_config()
     instance_config_loc = internal_config['instance_config_loc']
 
-    if os.path.isfile(instance_config_loc):
-        return read_yaml(instance_config_loc)
-    else:
+    try:
+        return read_yaml_cached(instance_config_loc)
+    except (FileNotFoundError, IsADirectoryError):
         return None
 
 def update_internal_config(update_dict):
@@ -53,9 +77,10 @@ def update_internal_config(update_dict):
     '''
     internal_config = read_internal_config()
     internal_config.update(update_dict)
-    internal_config_loc = os.path.join(str(Path.home()), '.config/assnake/internal_config.yaml')
+    internal_config_loc = get_internal_config_loc()
     with open(internal_config_loc, 'w+') as file:
         _ = yaml.dump(internal_config, file, sort_keys=False)
+    invalidate_config_cache(internal_config_loc)
 
     return internal_config
 
@@ -87,6 +112,7 @@ def update_instance_config(update_dict):
 
     with open(internal_config['instance_config_loc'], 'w+') as file:
         _ = yaml.dump(instance_config, file, sort_keys=False)
+    invalidate_config_cache(internal_config['instance_config_loc'])
 
     return instance_config
 
@@ -120,5 +146,6 @@ def fill_and_write_instance_config(assnake_db, fna_db_dir, bwa_index_dir, conda_
 
     with open(instance_config_location, 'w+') as file:
         _ = yaml.dump(config_template, file, sort_keys=False)
+    invalidate_config_cache(instance_config_location)
 
     return instance_config_location
\ No newline at end of file
@@ -1,26 +1,96 @@
 import os, glob, yaml, time
+from collections.abc import Mapping
 import pandas as pd
 from assnake.api.loaders import  load_sample, load_sample_set
+from assnake.api.sample_index import SampleIndex, SAMPLE_INDEX_FILE
+from assnake.api.catalog import read_catalog, unregister_dataset
 
-from assnake.core.config import load_wc_config, read_assnake_instance_config
-from assnake.viz import plot_reads_count_change
+from assnake.core.config import load_wc_config, read_assnake_instance_config, read_yaml_cached
 import click
-from pkg_resources import iter_entry_points 
+
+# Columns of sample sets in Dataset.sample_sets
+SAMPLE_SET_COLUMNS = ['preproc', 'df', 'fs_prefix', 'df_sample', 'reads']
+# Columns from the index that are kept for selection of samples, see LazySampleSets.with_stats
+SAMPLE_STATS_COLUMNS = ['bps', 'bytes']
+
+class LazySampleSets(Mapping):
+    '''
+    Dict preproc -> sample set of the dataset. Sample set of preprocessing is loaded from SampleIndex on first access and cached.
+    Only non-empty preprocessings are present, so iteration over it loads all of them.
+    '''
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self._loaded = {}
+        self._with_stats = {}
+        self._paired = {}
+
+    def _load(self, preproc):
+        if preproc not in self._loaded:
+            sample_index = self.dataset.open_sample_index()
+            try:
+                samples = sample_index.load_sample_set(preproc)
+            finally:
+                sample_index.close()
+            self._with_stats[preproc] = samples[SAMPLE_SET_COLUMNS + SAMPLE_STATS_COLUMNS]
+            self._loaded[preproc] = samples[SAMPLE_SET_COLUMNS]
+            self._paired[preproc] = bool(samples['paired'].any())
+        return self._loaded[preproc]
+
+    def with_stats(self, preproc):
+        '''
+        Sample set of preprocessing with stats stored in the index (bps of R1, bytes of read files), empty if there are no samples.
+        Loaded with the sample set, so nothing is read again.
+        '''
+        if preproc not in self.dataset.preprocs:
+            return pd.DataFrame(columns=SAMPLE_SET_COLUMNS + SAMPLE_STATS_COLUMNS)
+        self._load(preproc)
+        return self._with_stats[preproc]
+
+    def is_paired(self, preproc):
+        '''
+        True if some samples of preprocessing have R2 files. Loaded with the sample set, so directory is not listed again.
+        '''
+        if preproc not in self.dataset.preprocs:
+            return False
+        self._load(preproc)
+        return self._paired[preproc]
+
+    def __getitem__(self, preproc):
+        if preproc not in self.dataset.preprocs or len(self._load(preproc)) == 0:
+            raise KeyError(preproc)
+        return self._loaded[preproc]
+
+    def __iter__(self):
+        return iter([preproc for preproc in self.dataset.preprocs if len(self._load(preproc)) > 0])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def loaded(self):
+        '''
+        Non-empty sample sets that are already loaded, nothing is loaded.
+        '''
+        return {preproc: samples for preproc, samples in self._loaded.items() if len(samples) > 0}
+
 
 class Dataset:
+    '''
+    Dataset is opened by reading df_info.yaml and listing reads directory.
+    sample_sets, sample_containers, self_reads_info and dataset_type are loaded on first access,
+    sample sets - one preprocessing at a time.
+    '''
 
     df = '' # name on file system
     fs_prefix = '' # prefix on file_system
     full_path = ''
-    sample_sets = {} # Dict of sample sets, one for each preprocessing
 
     sources = None
     biospecimens = None
     mg_samples = None
 
 
-    def __init__(self, df, include_preprocs=True):
-        wc_config = load_wc_config()
+    def __init__(self, df):
         instance_config = read_assnake_instance_config()
 
         df_info_loc = instance_config['assnake_db']+'/datasets/{df}/df_info.yaml'.format(df = df)
@@ -29,60 +99,67 @@ class Dataset:
         if not os.path.isfile(df_info_loc):
             raise assnake.api.loaders.InputError('NO DATASET ' + df)
 
-        with open(df_info_loc, 'r') as stream:
-            try:
-                info = yaml.load(stream, Loader=yaml.FullLoader)
-                if 'df' in info:
-                    df_info =  info
-            except yaml.YAMLError as exc:
-                print(exc)
+        info = read_yaml_cached(df_info_loc)
+        if info is not None and 'df' in info:
+            df_info = info
 
         reads_dir = os.path.join(df_info['fs_prefix'], df_info['df'], 'reads/*')
-        dataset_type_checker_pattern = os.path.join(df_info['fs_prefix'], df_info['df'], 'reads/raw/*_R2.*') # check in raw preprocess folder if dataset is paired-end
-        dataset_type_checker = glob.glob(dataset_type_checker_pattern)
         preprocs = [p.split('/')[-1] for p in glob.glob(reads_dir)]
-        preprocessing = {}
 
         self.df =  df_info['df']
         self.fs_prefix =  df_info['fs_prefix']
-        self.dataset_type = 'paired-end' if len(dataset_type_checker) > 0 else 'single-end'
         self.full_path = os.path.join(self.fs_prefix, self.df)
+        self.preprocs = preprocs
+        self.sample_index_loc = os.path.join(instance_config['assnake_db'], 'datasets', self.df, SAMPLE_INDEX_FILE)
+
+        self.sample_sets = LazySampleSets(self)
+        self._dataset_type = None
+        self._sample_containers = None
+        self._self_reads_info = None
 
-        if include_preprocs:
-            preprocessing = {}
-            for p in preprocs:
-                samples = load_sample_set(wc_config, self.fs_prefix, self.df, p)
-                if len(samples) > 0:
-                    samples = samples[['preproc', 'df', 'fs_prefix', 'df_sample', 'reads']]
-                    preprocessing.update({p:samples})
+    def open_sample_index(self):
+        return SampleIndex(self.sample_index_loc, self.fs_prefix, self.df, load_wc_config())
 
+    @property
+    def dataset_type(self):
+        if self._dataset_type is None:
+            # Dataset is paired-end if samples in raw preprocessing have R2 files, taken from the sample index
+            self._dataset_type = 'paired-end' if self.sample_sets.is_paired('raw') else 'single-end'
+        return self._dataset_type
 
-        self.sample_sets = preprocessing
-        if len(self.sample_sets.keys()) > 0:
-            self.sample_containers = pd.concat(self.sample_sets.values())
-            self.self_reads_info = self.sample_containers.pivot(index='df_sample', columns='preproc', values='reads')
+    @property
+    def sample_containers(self):
+        if self._sample_containers is None:
+            sample_sets = list(self.sample_sets.values())
+            if len(sample_sets) > 0:
+                self._sample_containers = pd.concat(sample_sets)
+            else:
+                self._sample_containers = pd.DataFrame(columns=['preproc', 'df', 'fs_prefix', 'df_sample', 'reads'])
+        return self._sample_containers
+
+    @property
+    def self_reads_info(self):
+        if self._self_reads_info is None:
+            self._self_reads_info = self.sample_containers.pivot(index='df_sample', columns='preproc', values='reads')
+        return self._self_reads_info
   
     @staticmethod
     def list_in_db():
         """
         Returns dict of dictionaries with info about datasets from fs database. Key - df name
-        Mandatory fields: df, prefix
+        Mandatory fields: df, prefix. Summary from the last scan is in `summary` field.
+        Read from one catalog file, see api.catalog.
         """
         dfs = {}
         instance_config = read_assnake_instance_config()
-        df_info_locs = glob.glob(instance_config['assnake_db']+'/datasets/*/df_info.yaml')
-        
-        for df_info in df_info_locs:
-            with open(df_info, 'r') as stream:
-                try:
-                    info = yaml.load(stream, Loader=yaml.FullLoader)
-                    if 'df' in info:
-                        dfs.update({info['df']: info})
-                except yaml.YAMLError as exc:
-                    print(exc)
+        for entry in read_catalog(instance_config['assnake_db']).values():
+            info = dict(entry['info'])
+            info['summary'] = entry['summary']
+            dfs.update({info['df']: info})
         return dfs
 
     def plot_reads_loss(self, preprocs = [], sort = 'raw', plot=True):
+        from assnake.viz import plot_reads_count_change # plotting libraries are slow to import
         if len(preprocs) == 0: 
             preprocs = list(self.self_reads_info.columns)
         f = plot_reads_count_change(self.self_reads_info[preprocs].copy(), preprocs = preprocs, sort = sort, plot=plot)
@@ -93,27 +170,35 @@ class Dataset:
         Remove assnake dataset from database
         """
         try:
-            os.remove(
-                '{config}/datasets/{df}/df_info.yaml'.format(config=read_assnake_instance_config()['assnake_db'], df=dataset))
+            assnake_db = read_assnake_instance_config()['assnake_db']
+            os.remove('{config}/datasets/{df}/df_info.yaml'.format(config=assnake_db, df=dataset))
+            unregister_dataset(assnake_db, dataset)
             return (True,)
         except Exception as e:
             return (False, traceback.format_exc())
 
-    def __str__(self):
+    def _preprocessing_info(self):
+        '''
+        Number of samples in loaded preprocessings, names of the rest. Nothing is loaded.
+        '''
         preprocessing_info = ''
-        preprocs = list(self.sample_sets.keys())
-        for preproc in preprocs:
-            preprocessing_info = preprocessing_info + 'Samples in ' + preproc + ' - ' + str(len(self.sample_sets[preproc])) + '\n'
+        loaded = self.sample_sets.loaded()
+        for preproc in sorted(loaded.keys()):
+            preprocessing_info = preprocessing_info + 'Samples in ' + preproc + ' - ' + str(len(loaded[preproc])) + '\n'
+        not_loaded = sorted(p for p in self.preprocs if p not in self.sample_sets._loaded)
+        if len(not_loaded) > 0:
+            preprocessing_info = preprocessing_info + 'Preprocessings: ' + ', '.join(not_loaded) + '\n'
+        return preprocessing_info
+
+    def __str__(self):
+        preprocessing_info = self._preprocessing_info()
         return 'Dataset name: ' + self.df + '\n' + \
             'Dataset type: ' + self.dataset_type + '\n' + \
             'Filesystem prefix: ' + self.fs_prefix +'\n' + \
             'Full path: ' + os.path.join(self.fs_prefix, self.df) + '\n' + preprocessing_info
 
     def __repr__(self):
-        preprocessing_info = ''
-        preprocs = list(self.sample_sets.keys())
-        for preproc in preprocs:
-            preprocessing_info = preprocessing_info + 'Samples in ' + preproc + ' - ' + str(len(self.sample_sets[preproc])) + '\n'
+        preprocessing_info = self._preprocessing_info()
         return 'Dataset name: ' + self.df + '\n' + \
             'Filesystem prefix: ' + self.fs_prefix +'\n' + \
             'Full path: ' + os.path.join(self.fs_prefix, self.df) + '\n' + preprocessing_info
@@ -129,6 +214,65 @@ class Dataset:
         }
 
 
+def dataset_generation(df):
+    '''
+    Cheap filesystem generation stamp of the dataset: mtimes of df_info.yaml, reads directory and every preprocessing directory.
+    Changes when dataset info is edited, preprocessing is added or removed, or read files are added to or removed from preprocessing.
+    '''
+    instance_config = read_assnake_instance_config()
+    df_info_loc = os.path.join(instance_config['assnake_db'], 'datasets', df, 'df_info.yaml')
+    try:
+        st = os.stat(df_info_loc)
+    except FileNotFoundError:
+        return None
+    info = read_yaml_cached(df_info_loc)
+    reads_dir = os.path.join(info['fs_prefix'], info['df'], 'reads')
+    stamp = [(df_info_loc, st.st_mtime_ns, st.st_size)]
+    try:
+        stamp.append((reads_dir, os.stat(reads_dir).st_mtime_ns))
+        with os.scandir(reads_dir) as entries:
+            stamp += sorted((entry.name, entry.stat().st_mtime_ns) for entry in entries if entry.is_dir())
+    except FileNotFoundError:
+        pass
+    return tuple(stamp)
+
+
+class DatasetCache:
+    '''
+    Per-process cache of loaded datasets, keyed by dataset name and filesystem generation stamp (see dataset_generation).
+    Stored in ctx.obj of CLI, so chained commands on the same dataset share one load.
+    Must be invalidated after files of the dataset were changed by a run.
+    '''
+
+    def __init__(self):
+        self._datasets = {}
+
+    def get(self, df):
+        generation = dataset_generation(df)
+        cached = self._datasets.get(df)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        dataset = Dataset(df)
+        self._datasets[df] = (generation, dataset)
+        return dataset
+
+    def invalidate(self, df=None):
+        if df is None:
+            self._datasets.clear()
+        else:
+            self._datasets.pop(df, None)
+
+
+def get_dataset(df, config=None):
+    '''
+    Loads dataset through DatasetCache in config (ctx.obj of CLI) if there is one.
+    '''
+    cache = config.get('datasets') if config is not None else None
+    if cache is None:
+        return Dataset(df)
+    return cache.get(df)
+
+
 # TODO rework this stuff. This should register custom methods from modules in Dataset, like loading metaphlan
 # for entry_point in iter_entry_points('assnake.plugins'):
 #     module_class = entry_point.load()
@@ -0,0 +1,116 @@
+import os
+import numpy as np
+import pandas as pd
+
+METADATA_FILE = 'df_samples.tsv'
+
+# Process-wide cache of parsed metadata sheets. location -> ((mtime_ns, size), MetadataSheet)
+_metadata_cache = {}
+
+
+class MetadataSheet:
+    '''
+    Sample metadata of the dataset (df_samples.tsv), indexed by sample name.
+    Per-column indexes (value -> list of samples) are built on first use from categorical codes
+    and kept for the lifetime of the sheet. Values are compared as strings, the way they come from command line.
+    '''
+
+    def __init__(self, meta):
+        self.meta = meta
+        self._indexes = {}
+
+    def __contains__(self, column):
+        return column in self.meta.columns
+
+    def index(self, column):
+        '''
+        Returns dict {value: [samples]} for metadata column, in the order of first appearance. Empty values are skipped.
+        '''
+        if column not in self._indexes:
+            codes, values = pd.factorize(self.meta[column].astype(str).where(self.meta[column].notnull()))
+            samples = self.meta.index.to_numpy(dtype=object)
+            groups = pd.Series(range(len(codes))).groupby(codes, sort=True).indices
+            self._indexes[column] = {values[code]: list(samples[rows]) for code, rows in groups.items() if code >= 0}
+        return self._indexes[column]
+
+    def values(self, column):
+        return list(self.index(column).keys())
+
+    def samples(self, column, value):
+        '''
+        Samples that have `value` in metadata `column`.
+        '''
+        return self.index(column).get(str(value), [])
+
+    def split(self, sample_set, column):
+        '''
+        Splits sample set into {value: sample set} by metadata column in one groupby pass.
+        Samples without metadata or with empty value are left out.
+        '''
+        value_of = {sample: value for value, samples in self.index(column).items() for sample in samples}
+        groups = dict(list(sample_set.groupby(sample_set['df_sample'].map(value_of).values, sort=False)))
+        return {value: groups[value] for value in self.values(column) if value in groups}
+
+    def join(self, sample_set):
+        '''
+        Sample set with metadata columns joined by df_sample. Columns of sample set take precedence over metadata columns with the same name.
+        '''
+        meta = self.meta[[column for column in self.meta.columns if column not in sample_set.columns]]
+        return sample_set.join(meta, on='df_sample')
+
+
+def parse_column_values(column_value):
+    '''
+    Comma separated values of --column-value as list of strings, None if not provided.
+    '''
+    if column_value is None:
+        return None
+    return [value.strip() for value in str(column_value).split(',') if value.strip() != '']
+
+
+def selection_mask(frame, meta_column = None, column_values = None, where = None):
+    '''
+    Boolean mask of rows of frame (sample set joined with metadata) that have one of column_values in meta_column
+    and satisfy where expression. Expression is evaluated over whole columns by DataFrame.eval,
+    supports comparisons (including ranges `10 <= day < 20`), `in`/`not in` lists, `and`, `or`, `not`.
+    Columns with names that are not python identifiers are quoted with backticks.
+
+    :raises ValueError: if expression is not valid or doesn't evaluate to boolean mask.
+    '''
+    mask = np.ones(len(frame), dtype=bool)
+    if meta_column is not None and column_values:
+        column = frame[meta_column]
+        mask &= column.astype(str).where(column.notnull()).isin(column_values).to_numpy()
+    if where is not None and where.strip() != '' and len(frame) > 0:
+        try:
+            selected = frame.eval(where)
+        except Exception as e:
+            raise ValueError('Invalid expression {}: {}'.format(where, e))
+        if not isinstance(selected, pd.Series) or selected.dtype != bool:
+            raise ValueError('Expression {} must be a condition, for example: reads > 1000'.format(where))
+        mask &= selected.to_numpy()
+    return mask
+
+
+def load_metadata(full_path):
+    '''
+    Loads metadata sheet of the dataset through process-wide cache keyed by file location and mtime.
+    The sheet is parsed again only if it was modified.
+
+    :param full_path: folder of the dataset
+    :return: MetadataSheet or None if dataset has no metadata.
+    '''
+    meta_loc = os.path.join(full_path, METADATA_FILE)
+    try:
+        st = os.stat(meta_loc)
+    except FileNotFoundError:
+        _metadata_cache.pop(meta_loc, None)
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _metadata_cache.get(meta_loc)
+    if cached is None or cached[0] != key:
+        meta = pd.read_csv(meta_loc, sep='\t', index_col=0)
+        meta.index = meta.index.astype(str)
+        cached = (key, MetadataSheet(meta))
+        _metadata_cache[meta_loc] = cached
+    return cached[1]
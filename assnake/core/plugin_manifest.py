@@ -0,0 +1,257 @@
+import os, sys, json, zlib, importlib
+from pathlib import Path
+
+# Bump when the structure of the manifest changes
+MANIFEST_VERSION = 3
+
+PLUGINS_ENTRY_POINT_GROUP = 'assnake.plugins'
+
+try:
+    from importlib import metadata as importlib_metadata
+except ImportError: # python < 3.8
+    try:
+        import importlib_metadata
+    except ImportError:
+        importlib_metadata = None
+
+
+def get_cache_dir():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(str(Path.home()), '.cache')), 'assnake')
+
+def get_manifest_loc():
+    '''
+    Manifest is stored in user cache dir, one per python environment.
+    '''
+    env_id = hex(zlib.crc32(bytes(sys.prefix, encoding='utf-8')))[2:]
+    return os.path.join(get_cache_dir(), 'plugin_manifest_{env_id}.json'.format(env_id=env_id))
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def environment_stamp():
+    '''
+    Cheap fingerprint of installed packages - mtimes of sys.path directories.
+    Installing, upgrading or removing a distribution creates or deletes its metadata directory, which changes mtime of site-packages.
+    If stamp changed, distribution versions are compared before rebuilding the manifest.
+    '''
+    return {p: _mtime_ns(p) for p in sys.path if p != '' and os.path.isdir(p)}
+
+def plugin_commands(module_class, command_group):
+    '''
+    Click commands that plugin adds to `result` or `init` command group.
+    '''
+    if command_group == 'result':
+        commands = [res.invocation_command for res in module_class.results] + list(module_class.invocation_commands)
+    else:
+        commands = list(module_class.initialization_commands)
+    return [cmd for cmd in commands if cmd is not None]
+
+def list_plugin_entry_points():
+    '''
+    Lists plugin entry points without importing plugins. Uses importlib.metadata when available, pkg_resources otherwise.
+
+    :return: list of dicts with name, entry_point (`module:attr`), distribution and version.
+    '''
+    entry_points = []
+    seen = set()
+    if importlib_metadata is not None:
+        for dist in importlib_metadata.distributions():
+            for entry_point in dist.entry_points:
+                if entry_point.group == PLUGINS_ENTRY_POINT_GROUP and entry_point.name not in seen:
+                    seen.add(entry_point.name)
+                    entry_points.append({'name': entry_point.name, 'entry_point': entry_point.value,
+                                         'distribution': dist.metadata['Name'], 'version': dist.version})
+    else:
+        from pkg_resources import iter_entry_points # slow to import
+        for entry_point in iter_entry_points(PLUGINS_ENTRY_POINT_GROUP):
+            if entry_point.name not in seen:
+                seen.add(entry_point.name)
+                entry_points.append({'name': entry_point.name,
+                                     'entry_point': '{module}:{attr}'.format(module=entry_point.module_name, attr='.'.join(entry_point.attrs)),
+                                     'distribution': entry_point.dist.project_name, 'version': entry_point.dist.version})
+    return sorted(entry_points, key=lambda ep: ep['name'])
+
+def assnake_version():
+    if importlib_metadata is not None:
+        try:
+            return importlib_metadata.version('assnake')
+        except Exception:
+            pass
+    return None
+
+def load_entry_point(value):
+    '''
+    Imports object by `module:attr` string, without scanning the working set.
+    '''
+    module_name, _, attrs = value.partition(':')
+    obj = importlib.import_module(module_name)
+    for attr in attrs.split('.'):
+        if attr != '':
+            obj = getattr(obj, attr)
+    return obj
+
+def plugin_files(module_class):
+    '''
+    Files and folders of plugin that end up in the manifest: snakefiles, workflows, wc_config.yaml of every result
+    and result folders (new workflow or wc_config files are created there).
+    '''
+    result_dirs = sorted(set(os.path.dirname(os.path.normpath(w)) for res in module_class.results for w in res.workflows))
+    files = [os.path.normpath(os.path.join(module_class.install_dir, s)) for s in module_class.snakefiles]
+    files += [os.path.normpath(w) for res in module_class.results for w in res.workflows]
+    files += [os.path.join(d, 'wc_config.yaml') for d in result_dirs]
+    return files + result_dirs
+
+def describe_plugin(entry_point, module_class):
+    '''
+    Everything assnake needs to know about plugin without importing it: results, wc_config and workflows.
+    '''
+    wc_config = {}
+    for wc_conf in module_class.wc_configs:
+        if wc_conf is not None:
+            wc_config.update(wc_conf)
+    for res in module_class.results:
+        if res.wc_config is not None:
+            wc_config.update(res.wc_config)
+
+    return {
+        **entry_point,
+        'module_name': module_class.name,
+        'install_dir': module_class.install_dir,
+        'install_dir_mtime_ns': _mtime_ns(module_class.install_dir),
+        'files_mtime_ns': {f: _mtime_ns(f) for f in plugin_files(module_class)},
+        'snakefiles': [os.path.normpath(os.path.join(module_class.install_dir, s)) for s in module_class.snakefiles],
+        'workflows': [os.path.normpath(w) for res in module_class.results for w in res.workflows],
+        'wc_config': wc_config,
+    }
+
+def describe_result(plugin_name, res):
+    return {
+        'plugin': plugin_name,
+        'result_type': res.result_type,
+        'input_type': res.input_type,
+        'description': res.description,
+        'result_wc': res.result_wc,
+        'workflows': [os.path.normpath(w) for w in res.workflows],
+        'wc_config_keys': list(res.wc_config.keys()) if res.wc_config is not None else [],
+    }
+
+def build_manifest(entry_points=None):
+    '''
+    Loads all plugins and describes them. Returns (manifest, dict of loaded plugins).
+    '''
+    if entry_points is None:
+        entry_points = list_plugin_entry_points()
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'assnake_version': assnake_version(),
+        'environment': environment_stamp(),
+        'plugins': {},
+        'results': {},
+        'commands': {'result': {}, 'init': {}}
+    }
+    loaded = {}
+    for entry_point in entry_points:
+        name = entry_point['name']
+        module_class = load_entry_point(entry_point['entry_point'])
+        loaded[name] = module_class
+        manifest['plugins'][name] = describe_plugin(entry_point, module_class)
+        for res in module_class.results:
+            manifest['results'][res.name] = describe_result(name, res)
+        for command_group in manifest['commands'].keys():
+            for cmd in plugin_commands(module_class, command_group):
+                manifest['commands'][command_group][cmd.name] = {
+                    'plugin': name,
+                    'short_help': cmd.get_short_help_str(limit=300)
+                }
+    return manifest, loaded
+
+def _installed_plugins_changed(manifest, entry_points):
+    installed = [(ep['name'], ep['entry_point'], ep['distribution'], ep['version']) for ep in entry_points]
+    in_manifest = [(p['name'], p['entry_point'], p['distribution'], p['version']) for p in manifest['plugins'].values()]
+    return sorted(installed) != sorted(in_manifest) or manifest['assnake_version'] != assnake_version()
+
+def _install_dirs_changed(manifest):
+    # New results in the plugin directory or edited snakefiles and wc_configs (development installs)
+    for p in manifest['plugins'].values():
+        if p['install_dir_mtime_ns'] != _mtime_ns(p['install_dir']):
+            return True
+        if any(mtime_ns != _mtime_ns(f) for f, mtime_ns in p['files_mtime_ns'].items()):
+            return True
+    return False
+
+def write_manifest(manifest, manifest_loc):
+    try:
+        os.makedirs(os.path.dirname(manifest_loc), exist_ok=True)
+        tmp_loc = manifest_loc + '.tmp.{pid}'.format(pid=os.getpid())
+        with open(tmp_loc, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, default=str)
+        os.replace(tmp_loc, manifest_loc)
+    except OSError:
+        pass # Cache is not writable, we will just rebuild it next time
+
+_manifest = None
+_loaded_plugins = {}
+
+def get_plugin_manifest():
+    '''
+    Returns cached plugin manifest with installed modules, results, wc_config and workflow paths.
+    It is rebuilt (by importing all plugins) only if versions of installed plugin distributions changed,
+    or files of plugins listed in the manifest (snakefiles, workflows, wc_configs) were modified.
+    '''
+    global _manifest
+    if _manifest is not None:
+        return _manifest
+
+    manifest_loc = get_manifest_loc()
+    try:
+        with open(manifest_loc, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('version') != MANIFEST_VERSION:
+            manifest = None
+    except (OSError, ValueError):
+        manifest = None
+
+    entry_points = None
+    if manifest is not None and manifest['environment'] != environment_stamp():
+        # Something was installed, check if it was one of the plugins
+        entry_points = list_plugin_entry_points()
+        if _installed_plugins_changed(manifest, entry_points):
+            manifest = None
+        else:
+            manifest['environment'] = environment_stamp()
+            write_manifest(manifest, manifest_loc)
+    if manifest is not None and _install_dirs_changed(manifest):
+        manifest = None
+
+    if manifest is None:
+        manifest, loaded = build_manifest(entry_points)
+        _loaded_plugins.update(loaded)
+        write_manifest(manifest, manifest_loc)
+
+    _manifest = manifest
+    return _manifest
+
+def invalidate_plugin_manifest():
+    '''
+    Drops manifest, so it will be rebuilt on the next call to get_plugin_manifest.
+    '''
+    global _manifest
+    _manifest = None
+    try:
+        os.remove(get_manifest_loc())
+    except OSError:
+        pass
+
+def load_plugin(name):
+    '''
+    Imports one plugin by its name in the manifest.
+    '''
+    if name not in _loaded_plugins:
+        _loaded_plugins[name] = load_entry_point(get_plugin_manifest()['plugins'][name]['entry_point'])
+    return _loaded_plugins[name]
+
+def load_all_plugins():
+    return {name: load_plugin(name) for name in get_plugin_manifest()['plugins'].keys()}
@@ -8,9 +8,8 @@ from assnake.utils.general import read_yaml
 from assnake.core.sample_set import generic_command_individual_samples, generate_result_list, generic_command_dict_of_sample_sets, prepare_sample_set_tsv_and_get_results
 from assnake.core.command_builder import sample_set_construction_options, add_options
 
-from pkg_resources import iter_entry_points
 
-from assnake.core.snake_module import SnakeModule
+from assnake.core.result_registry import get_result_registry
 
 
 class Result:
@@ -98,9 +97,10 @@ class Result:
                 sample_sets = generic_command_dict_of_sample_sets(config,  **kwargs)
                 sample_set_dir_wc = self.wc_config[self.name+'_strand_file_set_dir_wc']
                 result_wc = self.wc_config[self.name + '_wc']
-                res_list = prepare_sample_set_tsv_and_get_results(
-                    sample_set_dir_wc, result_wc, df=kwargs['df'], sample_sets=sample_sets, strand=strand, overwrite=False)
+                res_list, destroy_if_not_run = prepare_sample_set_tsv_and_get_results(
+                    sample_set_dir_wc, result_wc, df=kwargs['df'], sample_sets=sample_sets, strand=strand, overwrite=False, config=config)
                 config['requests'] += res_list
+                config['destroy_if_not_run'].append(destroy_if_not_run)
 
             return result_invocation
 
@@ -117,9 +117,10 @@ class Result:
 
                 sample_set_dir_wc = self.wc_config[self.name+'_sample_set_tsv_wc']
                 result_wc = self.wc_config[self.name + '_wc']
-                res_list = prepare_sample_set_tsv_and_get_results(sample_set_dir_wc, result_wc, sample_sets = sample_sets,  **kwargs)
+                res_list, destroy_if_not_run = prepare_sample_set_tsv_and_get_results(sample_set_dir_wc, result_wc, sample_sets = sample_sets, config = config, **kwargs)
 
                 config['requests'] += res_list
+                config['destroy_if_not_run'].append(destroy_if_not_run)
 
             return result_invocation
 
@@ -194,24 +195,11 @@ class Result:
 
     @staticmethod
     def get_all_results_as_list():
-        results = []
-        discovered_plugins = SnakeModule.get_all_modules_as_dict()
-        for module_name, module_class in discovered_plugins.items():
-            print('module_name', module_name)
-            for res in module_class.results:
-                print('\t' + res.name)
-                results.append(res)
-
-        return results
+        return get_result_registry().all()
     
     @staticmethod
     def get_result_by_name(result_name):
-        discovered_plugins = SnakeModule.get_all_modules_as_dict()
-        for module_name, module_class in discovered_plugins.items():
-            for res in module_class.results:
-                if res.name == result_name:
-                    return res
-        return None
+        return get_result_registry().get(result_name)
 
     def __repr__(self):
         return self.name
@@ -0,0 +1,90 @@
+from assnake.core.plugin_manifest import get_plugin_manifest, load_plugin
+from assnake.api.path_resolver import PathResolver
+
+
+class ResultRegistry:
+    '''
+    Index of all installed results, built once per process from the plugin manifest.
+    Lookups by name, input_type and result_type are dict lookups and don't import any plugins.
+    Result objects are loaded lazily - only the plugin that provides requested result is imported.
+    '''
+
+    def __init__(self, manifest=None):
+        self.manifest = get_plugin_manifest() if manifest is None else manifest
+        self.results_info = self.manifest['results']
+
+        self.by_input_type = {}
+        self.by_result_type = {}
+        self.by_plugin = {}
+        for name, info in self.results_info.items():
+            self.by_input_type.setdefault(info['input_type'], []).append(name)
+            self.by_result_type.setdefault(info['result_type'], []).append(name)
+            self.by_plugin.setdefault(info['plugin'], []).append(name)
+
+        self.path_resolver = PathResolver(
+            {name + '_wc': (info['result_wc'], name) for name, info in self.results_info.items() if info['result_wc']})
+
+        self._loaded = {}
+
+    def __contains__(self, result_name):
+        return result_name in self.results_info
+
+    def names(self):
+        return list(self.results_info.keys())
+
+    def info(self, result_name):
+        '''
+        Returns description of the result from the manifest without importing the plugin, None if there is no such result.
+        '''
+        return self.results_info.get(result_name)
+
+    def get(self, result_name):
+        '''
+        Returns Result object or None if there is no such result.
+        '''
+        if result_name not in self._loaded:
+            info = self.results_info.get(result_name)
+            if info is None:
+                return None
+            for res in load_plugin(info['plugin']).results:
+                self._loaded[res.name] = res
+        return self._loaded.get(result_name)
+
+    def names_by_input_type(self, input_type):
+        return list(self.by_input_type.get(input_type, []))
+
+    def names_by_result_type(self, result_type):
+        return list(self.by_result_type.get(result_type, []))
+
+    def get_by_input_type(self, input_type):
+        return [self.get(name) for name in self.by_input_type.get(input_type, [])]
+
+    def get_by_result_type(self, result_type):
+        return [self.get(name) for name in self.by_result_type.get(result_type, [])]
+
+    def all(self):
+        return [self.get(name) for name in self.results_info.keys()]
+
+    def result_for_path(self, path):
+        '''
+        Finds result which `result_wc` produces provided target path.
+
+        :return: (result name, dict of wildcards) or None if path doesn't belong to any result.
+        '''
+        resolved = self.path_resolver.resolve(path)
+        if resolved is None:
+            return None
+        return resolved.result, resolved.wildcards
+
+
+_registry = None
+
+def get_result_registry():
+    '''
+    Returns registry for the current plugin manifest. It is built once per process.
+    '''
+    global _registry
+    manifest = get_plugin_manifest()
+    if _registry is None or _registry.manifest is not manifest:
+        _registry = ResultRegistry(manifest)
+    return _registry
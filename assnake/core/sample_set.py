@@ -1,43 +1,78 @@
 import assnake.api.loaders
 import assnake
 from tabulate import tabulate
-import click, os, datetime
+import click, os, datetime, string, hashlib
 import pandas as pd
 
+from assnake.core.dataset import get_dataset
+from assnake.api.sample_tables import write_sample_table, read_sample_table, columnar_loc
+from assnake.core.metadata import load_metadata, parse_column_values, selection_mask, METADATA_FILE
 
-def generic_command_dict_of_sample_sets(config, df, preproc, meta_column, column_value, samples_to_add, exclude_samples, **kwargs):
+
+def generic_command_dict_of_sample_sets(config, df, preproc, meta_column, column_value, samples_to_add, exclude_samples, where = None, merge = False, **kwargs):
     '''
     This returns several sample sets.
+    If meta_column is provided with several or no column values, dataset, metadata and sample set are loaded once
+    and split into one sample set per value of the column in one pass. With merge all values go in one sample set.
     '''
-    df_loaded = assnake.Dataset(df)
-    
+    df_loaded = get_dataset(df, config)
+    meta = get_metadata(df_loaded, meta_column)
+    column_values = parse_column_values(column_value)
+
+    if meta_column is None or (column_values is not None and (merge or len(column_values) == 1)):
+        sample_set, sample_set_name = generic_command_individual_samples(config,  df, preproc, meta_column, column_value, samples_to_add, exclude_samples, 
+                                                                         df_loaded=df_loaded, where=where, **kwargs)
+        return {sample_set_name: sample_set}
+
+    # treat empty column_value as creating multiple sample_sets for each column_value
+    sample_set, _ = generic_command_individual_samples(config,  df, preproc, meta_column, column_value, '', exclude_samples, 
+                                                       df_loaded=df_loaded, where=where, **kwargs)
+    def_name = default_sample_set_name(kwargs.pop('timepoint', None))
+
     sample_sets_dict = {}
+    split = meta.split(sample_set, meta_column)
+    if column_values is not None:
+        split = {value: split[value] for value in column_values if value in split}
+    for column_value, sample_set_for_value in split.items():
+        sample_sets_dict.update({sample_set_name_for(def_name, meta_column, column_value): sample_set_for_value.reset_index(drop=True)})
+    return sample_sets_dict
 
-    meta_loc = os.path.join(df_loaded.full_path, 'df_samples.tsv')
-    if os.path.isfile(meta_loc):
-        meta = pd.read_csv(meta_loc, sep = '\t', index_col=0)
-        if meta_column is not None:
-            if column_value is not None:
-                sample_set, sample_set_name = generic_command_individual_samples(config,  df, preproc, meta_column, column_value, samples_to_add, exclude_samples, **kwargs)
-                sample_sets_dict.update({sample_set_name: sample_set})
-            else: # treat empty column_value as creating multiple sample_sets for each column_value
-                column_values = list(meta[meta_column].unique())
-                for column_value in column_values:
-                    sample_set, sample_set_name = generic_command_individual_samples(config,  df, preproc, meta_column, column_value, samples_to_add, exclude_samples, **kwargs)
-                    sample_sets_dict.update({sample_set_name: sample_set})
-        else:
-            sample_set, sample_set_name = generic_command_individual_samples(config,  df, preproc, meta_column, column_value, samples_to_add, exclude_samples, **kwargs)
-            sample_sets_dict.update({sample_set_name: sample_set})
-    else:
-        if meta_column is not None:
-            click.echo('A metadata column is specified, but there is no metadata file: %s'%meta_loc, fg='red')
+def get_metadata(df_loaded, meta_column):
+    '''
+    Metadata sheet of the dataset, see metadata.load_metadata. Exits if meta_column is requested, but can't be found.
+    '''
+    meta = load_metadata(df_loaded.full_path)
+    if meta_column is not None:
+        if meta is None:
+            click.secho('A metadata column is specified, but there is no metadata file: %s'%os.path.join(df_loaded.full_path, METADATA_FILE), fg='red')
+            exit()
+        if meta_column not in meta:
+            click.secho('There is no column %s in metadata of %s'%(meta_column, df_loaded.df), fg='red')
             exit()
-        sample_set, sample_set_name = generic_command_individual_samples(config,  df, preproc, meta_column, column_value, samples_to_add, exclude_samples, **kwargs)
-        sample_sets_dict.update({sample_set_name: sample_set})
+    return meta
 
-    return sample_sets_dict
+def default_sample_set_name(def_name = None):
+    '''
+    Name template of sample set, `%s` is replaced with metadata selection. Current date and time are used if def_name is not provided.
+    '''
+    if def_name is None:
+        curr_date = datetime.datetime.now()
+        return '{date}{month}{year}_{hour}{minute}%s'.format(
+                                date=curr_date.strftime("%d"), 
+                                month=curr_date.strftime("%b"), 
+                                year=curr_date.strftime("%y"),
+                                hour=curr_date.strftime("%H"),
+                                minute=curr_date.strftime("%M"))
+    return '{def_name}%s'.format(def_name=def_name)
 
-def generic_command_individual_samples(config, df, preproc, meta_column, column_value, samples_to_add, exclude_samples, **kwargs):
+def sample_set_name_for(def_name, meta_column, column_value):
+    if meta_column is None:        
+        return def_name%('')
+    elif meta_column is not None and column_value is None:
+        return def_name%('__' + meta_column)
+    return def_name%('__' + meta_column + '_' + '+'.join(parse_column_values(column_value)))
+
+def generic_command_individual_samples(config, df, preproc, meta_column, column_value, samples_to_add, exclude_samples, df_loaded = None, where = None, **kwargs):
     """
     Construct sample sets, has multiple options.
     Returns dict or sample_sets based on the provided options.
@@ -48,6 +83,9 @@ def generic_command_individual_samples(config, df, preproc, meta_column, column_
         If meta_column is provided, bot no column_value is provided \
         - treat it like select all unique values of that column. 
         If multiple - one value - one sample_set. If --merge enabled - all values go in one sample_set
+    where - expression over metadata columns and sample stats from the index (reads, bps, bytes), see metadata.selection_mask. \
+        Samples are selected by one vectorized mask over sample set joined with metadata.
+    df_loaded - already loaded Dataset. If not provided, dataset is taken from DatasetCache in config, see dataset.get_dataset.
 
     assnake result request megahit -d FMT_FHM -c source run 
 
@@ -55,104 +93,193 @@ def generic_command_individual_samples(config, df, preproc, meta_column, column_
     exclude_samples = [] if exclude_samples == '' else [c.strip() for c in exclude_samples.split(',')]
     samples_to_add = [] if samples_to_add == '' else [c.strip() for c in samples_to_add.split(',')]
 
-    df_loaded = assnake.Dataset(df)
+    if df_loaded is None:
+        df_loaded = get_dataset(df, config)
     config['requested_dfs'] += [df_loaded.df]
      
-    # Now for the meta column stuff
-    meta_loc = os.path.join(df_loaded.full_path, 'df_samples.tsv')
-    if os.path.isfile(meta_loc):
-        meta = pd.read_csv(meta_loc, sep = '\t', index_col=0)
-        if meta_column is not None:
-            if column_value is not None:
-                subset_by_col_value = meta.loc[meta[meta_column] == column_value]
-                if len(subset_by_col_value) > 0:
-                    samples_to_add = list(subset_by_col_value.index.values)
-                    samples_to_add = list(set(df_loaded.sample_containers['df_sample'].values).intersection(set(samples_to_add)))
-                    if len(samples_to_add) == 0:
-                        click.secho('There are 0 samples for %s == %s'%(meta_column, column_value), fg='red')
-                        exit()
+    meta = get_metadata(df_loaded, meta_column)
+    column_values = parse_column_values(column_value)
 
     if preproc is None:
         # LONGEST
-        preproc = max(list(df_loaded.sample_sets.keys()), key=len)
+        # Preprocessings are loaded one by one until first non-empty
+        preproc = next((p for p in sorted(df_loaded.preprocs, key=len, reverse=True) if p in df_loaded.sample_sets), None)
+        if preproc is None:
+            click.secho('There are no samples in dataset %s'%df_loaded.df, fg='red')
+            exit()
         click.echo('Preprocessing is not specified, using longest for now - %s'%preproc)
 
-    sample_set = assnake.api.loaders.load_sample_set(config['wc_config'], df_loaded.fs_prefix, df_loaded.df, preproc, samples_to_add=samples_to_add)
+    # Sample set is taken from the loaded dataset (backed by the sample index), chained commands don't scan the dataset again
+    sample_set = df_loaded.sample_sets.with_stats(preproc)
+    if len(samples_to_add) > 0:
+        sample_set = sample_set.loc[sample_set['df_sample'].isin(samples_to_add)]
     if len(exclude_samples) > 0 :  
-        sample_set = sample_set.loc[~sample_set['df_sample'].isin(exclude_samples), ]
+        sample_set = sample_set.loc[~sample_set['df_sample'].isin(exclude_samples)]
+
+    # Now for the meta column stuff
+    select = where is not None or (meta_column is not None and column_values is not None)
+    if select:
+        frame = meta.join(sample_set) if meta is not None else sample_set
+        try:
+            mask = selection_mask(frame, meta_column, column_values, where)
+        except (ValueError, KeyError) as e:
+            click.secho(str(e), fg='red')
+            exit()
+        sample_set = sample_set.loc[mask]
+    sample_set = sample_set[['df', 'df_sample', 'preproc', 'fs_prefix', 'reads']].reset_index(drop=True)
+    if select and len(sample_set) == 0:
+        click.secho('There are 0 samples for %s'%(' and '.join(
+            (['%s in %s'%(meta_column, column_values)] if column_values is not None else []) + ([where] if where is not None else []))), fg='red')
+        exit()
 
     # click.echo(tabulate(sample_set[['df_sample', 'reads', 'preproc']].sort_values('reads'), headers='keys', tablefmt='fancy_grid'))
 
     # construct sample set name for fs
-    def_name = kwargs.pop('timepoint', None)
-    if def_name is None:
-        curr_date = datetime.datetime.now()
-        def_name = '{date}{month}{year}_{hour}{minute}%s'.format(
-                                date=curr_date.strftime("%d"), 
-                                month=curr_date.strftime("%b"), 
-                                year=curr_date.strftime("%y"),
-                                hour=curr_date.strftime("%H"),
-                                minute=curr_date.strftime("%M"))
-    else:
-        def_name = '{def_name}%s'.format(def_name=def_name)
-    if meta_column is None and column_value is None:        
-        sample_set_name = def_name%('')
-    elif meta_column is not None and column_value is None:
-        sample_set_name = def_name%('__' + meta_column)
-    else:
-        sample_set_name = def_name%('__' + meta_column + '_' + column_value)
+    def_name = default_sample_set_name(kwargs.pop('timepoint', None))
+    sample_set_name = sample_set_name_for(def_name, meta_column, column_value)
 
     return sample_set, sample_set_name
     
 
+# Wildcards that are taken from the columns of sample set, all others are taken from kwargs
+SAMPLE_WILDCARDS = ['fs_prefix', 'df', 'preproc', 'df_sample']
+
 def generate_result_list(sample_set, wc_str, **kwargs):
-    res_list = []
-    # print(kwargs)
-    kwargs.pop('df')
-    kwargs.pop('preproc')
-    for s in sample_set.to_dict(orient='records'):
-        preprocessing = s['preproc']
-
-        res_list.append(wc_str.format(
-            fs_prefix = s['fs_prefix'].rstrip('\/'),    
-            df = s['df'],
-            preproc = preprocessing,
-            df_sample = s['df_sample'],
-            **kwargs
-        ))
-    return res_list
+    '''
+    Formats `wc_str` for every sample in the sample set and returns list of unique targets in the order of samples.
+    Template is split once, sample wildcards are concatenated column-wise as numpy object arrays,
+    all other wildcards are formatted once from kwargs.
+    '''
+    kwargs.pop('df', None)
+    kwargs.pop('preproc', None)
+    if len(sample_set) == 0:
+        return []
+
+    formatter = string.Formatter()
+    targets = None
+    constant = ''
+    for literal, field, format_spec, conversion in formatter.parse(wc_str):
+        constant += literal
+        if field is None:
+            continue
+        field_fmt = '{0' + ('!' + conversion if conversion else '') + (':' + format_spec if format_spec else '') + '}'
+        if field in SAMPLE_WILDCARDS:
+            column = sample_set[field]
+            if field == 'fs_prefix':
+                column = column.str.rstrip('\\/')
+            column = column.astype(str) if field_fmt == '{0}' else column.map(field_fmt.format)
+            column = column.to_numpy(dtype=object)
+            targets = constant + column if targets is None else targets + constant + column
+            constant = ''
+        else:
+            constant += field_fmt.format(formatter.get_field(field, (), kwargs)[0])
+
+    if targets is None:
+        return [constant]
+    return list(dict.fromkeys((targets + constant).tolist()))
+
+# Columns that define sample set, its content address is computed from them
+SAMPLE_SET_KEY = ['df', 'preproc', 'df_sample']
+SAMPLE_SET_HASH_PREFIX = 'ss_'
+
+def sample_set_content_name(sample_set):
+    '''
+    Content address of sample set: stable hash of sorted unique (df, preproc, df_sample).
+    The same samples always get the same name, whatever the order of rows or the way they were selected.
+    '''
+    keys = sorted(set(zip(*[sample_set[column].astype(str) for column in SAMPLE_SET_KEY])))
+    digest = hashlib.sha1('\n'.join('\t'.join(key) for key in keys).encode()).hexdigest()
+    return SAMPLE_SET_HASH_PREFIX + digest[:16]
+
+def _point_alias(alias_loc, target):
+    tmp_loc = '{loc}.tmp.{pid}'.format(loc=alias_loc, pid=os.getpid())
+    os.symlink(target, tmp_loc)
+    os.replace(tmp_loc, alias_loc)
+
+def link_sample_set_alias(sample_set_root_wc, alias, content_name, **wildcards):
+    '''
+    Creates human readable alias of content addressed sample set: relative symlink `alias` -> `content_name`
+    next to it. Alias that points to another sample set is moved.
 
-def prepare_sample_set_tsv_and_get_results(sample_set_dir_wc, result_wc, df, sample_sets, overwrite,**kwargs):
+    :return: (alias location, previous target of the alias or None if alias was created), (None, None) if nothing changed.
+    '''
+    if alias == content_name:
+        return None, None
+    alias_loc = sample_set_root_wc.format(sample_set = alias, **wildcards).rstrip('/')
+    content_loc = sample_set_root_wc.format(sample_set = content_name, **wildcards).rstrip('/')
+    target = os.path.relpath(content_loc, os.path.dirname(alias_loc))
+    previous_target = None
+    if os.path.islink(alias_loc):
+        previous_target = os.readlink(alias_loc)
+        if previous_target == target:
+            return None, None
+    elif os.path.exists(alias_loc):
+        click.secho('Sample set %s already exists as directory, alias for %s is not created'%(alias_loc, content_name), fg='yellow')
+        return None, None
+    _point_alias(alias_loc, target)
+    return alias_loc, previous_target
+
+def destroy_not_run(destroy_if_not_run):
+    '''
+    Undoes prepare_sample_set_tsv_and_get_results if results were not run: removes created files and empty directories
+    and points moved aliases back to the sample sets they pointed to.
+    '''
+    for alias_loc, previous_target in destroy_if_not_run.get('aliases', {}).items():
+        _point_alias(alias_loc, previous_target)
+    for file_loc in destroy_if_not_run['files']:
+        if os.path.lexists(file_loc):
+            os.remove(file_loc)
+    for directory in destroy_if_not_run['directories']:
+        if os.path.isdir(directory) and len(os.listdir(directory)) == 0:
+            os.rmdir(directory)
+
+def prepare_sample_set_tsv_and_get_results(sample_set_dir_wc, result_wc, df, sample_sets, overwrite, config = None, **kwargs):
+    '''
+    Writes sample_set.tsv of every sample set into content addressed directory (see sample_set_content_name)
+    and links the name of the sample set to it. Identical sample set requested again is reused with all its results,
+    so snakemake doesn't run set level jobs twice.
+
+    :return: (list of targets, dict of created directories and files and moved aliases {alias: previous target}), see destroy_not_run
+    '''
     res_list = []
-    destroy_if_not_run = {'directories':[], 'files':[]}
+    destroy_if_not_run = {'directories':[], 'files':[], 'aliases':{}}
 
-    df_loaded = assnake.Dataset(df)
+    df_loaded = get_dataset(df, config)
+    sample_set_root_wc = sample_set_dir_wc[:sample_set_dir_wc.index('{sample_set}') + len('{sample_set}')]
 
     for sample_set_name in sample_sets.keys():
-        sample_set_dir = sample_set_dir_wc.format(fs_prefix = df_loaded.fs_prefix, df = df, sample_set = sample_set_name)
+        sample_set = sample_sets[sample_set_name]
+        content_name = sample_set_content_name(sample_set)
+        sample_set_dir = sample_set_dir_wc.format(fs_prefix = df_loaded.fs_prefix, df = df, sample_set = content_name)
         sample_set_loc = os.path.join(sample_set_dir, 'sample_set.tsv')
 
-
-        sample_set = sample_sets[sample_set_name]
         if not os.path.exists(sample_set_dir):
             os.makedirs(sample_set_dir, exist_ok=True)
             destroy_if_not_run['directories'].append(sample_set_dir)
 
 
         if not os.path.isfile(sample_set_loc):
-            sample_set.to_csv(sample_set_loc, sep='\t', index=False)
-            destroy_if_not_run['files'].append(sample_set_loc)
+            write_sample_table(sample_set, sample_set_loc)
+            destroy_if_not_run['files'] += [sample_set_loc, columnar_loc(sample_set_loc)]
+        elif sample_set_content_name(read_sample_table(sample_set_loc)) == content_name:
+            click.secho('Sample set %s is the same as existing %s, reusing it'%(sample_set_name, content_name))
         else:
-            click.secho('Sample set with this name already exists!')
+            click.secho('Sample set %s was modified!'%sample_set_loc)
             if overwrite:
-                sample_set.to_csv(sample_set_loc, sep='\t', index=False)
+                write_sample_table(sample_set, sample_set_loc)
                 click.secho('Overwritten')
 
+        alias_loc, previous_target = link_sample_set_alias(sample_set_root_wc, sample_set_name, content_name, fs_prefix = df_loaded.fs_prefix, df = df)
+        if previous_target is not None:
+            # Moved alias is pointed back, not removed, if results are not run
+            destroy_if_not_run['aliases'][alias_loc] = previous_target
+        elif alias_loc is not None:
+            destroy_if_not_run['files'].append(alias_loc)
         
         res_list += [result_wc.format(
             fs_prefix = df_loaded.fs_prefix,
             df = df_loaded.df,
-            sample_set = sample_set_name,
+            sample_set = content_name,
             **kwargs
         )]
 
@@ -1,5 +1,4 @@
-from pkg_resources import iter_entry_points 
-from assnake.core.config import read_assnake_instance_config
+from assnake.core.config import read_assnake_instance_config, read_yaml_cached
 import os, glob, importlib
 from assnake.utils.general import read_yaml
 
@@ -48,18 +47,14 @@ class SnakeModule:
         if self.assnake_config is not None:
             def_loc = os.path.join(self.assnake_config['assnake_db'], 'module_configs', self.name + '.yaml')
             if os.path.isfile(def_loc):
-                return read_yaml(def_loc)
+                return read_yaml_cached(def_loc)
         return None
 
 
     @staticmethod
     def get_all_modules_as_dict():
-        # Discover plugins
-        discovered_plugins = {
-            entry_point.name: entry_point.load()
-            for entry_point in iter_entry_points('assnake.plugins')
-        }
-
-        return discovered_plugins
+        # Discover plugins through the cached manifest, no working set scanning
+        from assnake.core.plugin_manifest import load_all_plugins
+        return load_all_plugins()
 
     
\ No newline at end of file
@@ -1,43 +1,34 @@
 import glob, os, time
-from assnake.core.config import load_wc_config
-from pkg_resources import iter_entry_points 
+from assnake.core.config import load_wc_config, read_yaml_cached
+from assnake.core.plugin_manifest import get_plugin_manifest
 wc_config = load_wc_config()
 
 start = time.time()
 
-# Discover plugins
-discovered_plugins = {
-    entry_point.name: entry_point.load()
-    for entry_point in iter_entry_points('assnake.plugins')
-}
+# Discover plugins. Manifest has everything we need, so plugins are not imported here.
+discovered_plugins = get_plugin_manifest()['plugins']
 
 
 # We need to update wc_config first
-for module_name, module_class in discovered_plugins.items():
+for module_name, module_info in discovered_plugins.items():
     
-    module_config = {'install_dir': module_class.install_dir}
+    module_config = {'install_dir': module_info['install_dir']}
 
-    if module_class.module_config is not None:
-        module_config.update(module_class.module_config)
+    deployed_config_loc = os.path.join(config['assnake_db'], 'module_configs', module_info['module_name'] + '.yaml')
+    if os.path.isfile(deployed_config_loc):
+        module_config.update(read_yaml_cached(deployed_config_loc))
 
     config.update({module_name:module_config})
 
-
-    for wc_conf in module_class.wc_configs:
-        if wc_conf is not None:
-            wc_config.update(wc_conf)
-    for res in module_class.results:
-        if res.wc_config is not None:
-            wc_config.update(res.wc_config)
+    wc_config.update(module_info['wc_config'])
 
 
 # and now include all the stuff
-for module_name, module_class in discovered_plugins.items():
+for module_name, module_info in discovered_plugins.items():
 
-    for snakefile in module_class.snakefiles:
-        include: os.path.normpath(os.path.join(module_class.install_dir, snakefile))
-        print(os.path.normpath(os.path.join(module_class.install_dir, snakefile)))
+    for snakefile in module_info['snakefiles']:
+        include: snakefile
+        print(snakefile)
 
-    for res in module_class.results:
-        for sn in res.workflows:
-            include: os.path.normpath(sn)
+    for sn in module_info['workflows']:
+        include: sn
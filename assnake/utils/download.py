@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SEGMENTS = 4
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Segments smaller than this are not split further
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+# Resume manifest is saved after this many bytes are written
+MANIFEST_SAVE_INTERVAL = 16 * 1024 * 1024
+
+PART_SUFFIX = '.part'
+MANIFEST_SUFFIX = '.download.json'
+
+DownloadResult = namedtuple('DownloadResult', ['dst', 'size', 'downloaded', 'seconds', 'throughput'])
+
+
+class DownloadError(Exception):
+    pass
+
+
+def probe_url(url, timeout=60):
+    '''
+    HEAD request. Returns (size or None, True if server accepts byte ranges, validator - ETag or Last-Modified).
+    '''
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method='HEAD'), timeout=timeout) as response:
+            headers = response.headers
+    except Exception:
+        return None, False, None
+    size = headers.get('Content-Length')
+    size = int(size) if size is not None and size.isdigit() else None
+    accepts_ranges = headers.get('Accept-Ranges', '').lower() == 'bytes'
+    return size, accepts_ranges, headers.get('ETag') or headers.get('Last-Modified')
+
+
+def split_segments(size, segments):
+    '''
+    Splits [0, size) into at most `segments` ranges of at least MIN_SEGMENT_SIZE bytes. Returns list of [start, end, done].
+    '''
+    segments = max(1, min(segments, size // MIN_SEGMENT_SIZE))
+    step = -(-size // segments)
+    return [[start, min(start + step, size), 0] for start in range(0, size, step)]
+
+
+def file_checksum(loc, algorithm='md5', chunk_size=DEFAULT_CHUNK_SIZE):
+    digest = hashlib.new(algorithm)
+    with open(loc, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pwrite(fd, data, offset, lock):
+    if hasattr(os, 'pwrite'):
+        os.pwrite(fd, data, offset)
+    else:
+        with lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+
+
+def _preallocate(fd, size):
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+class Download:
+    '''
+    Downloads url to dst with several ranged requests in parallel. Segments are written with positional writes
+    into one preallocated `dst.part` file. Progress of every segment is kept in `dst.download.json`,
+    so interrupted download continues from where it stopped if the file on the server didn't change.
+    '''
+
+    def __init__(self, url, dst, segments=DEFAULT_SEGMENTS, chunk_size=DEFAULT_CHUNK_SIZE, checksum=None, progress=True, timeout=60):
+        '''
+        :param checksum: expected checksum as `algorithm:hexdigest`, for example `md5:9e107d9d372bb6826bd81d3542a419d6`.
+        :param progress: show progress bar.
+        '''
+        self.url = url
+        self.dst = dst
+        self.segments = segments
+        self.chunk_size = chunk_size
+        self.checksum = checksum
+        self.progress = progress
+        self.timeout = timeout
+
+        self.part_loc = dst + PART_SUFFIX
+        self.manifest_loc = dst + MANIFEST_SUFFIX
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        self._unsaved = 0
+
+    def _load_manifest(self, size, validator):
+        try:
+            with open(self.manifest_loc) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('url') != self.url or manifest.get('size') != size or manifest.get('validator') != validator:
+            return None
+        if not os.path.isfile(self.part_loc) or os.path.getsize(self.part_loc) != size:
+            return None
+        return manifest
+
+    def _save_manifest(self):
+        tmp_loc = self.manifest_loc + '.tmp'
+        with open(tmp_loc, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file)
+        os.replace(tmp_loc, self.manifest_loc)
+
+    def _written(self, segment, n_bytes):
+        with self.lock:
+            segment[2] += n_bytes
+            self.downloaded += n_bytes
+            self._unsaved += n_bytes
+            if self._unsaved >= MANIFEST_SAVE_INTERVAL:
+                self._unsaved = 0
+                self._save_manifest()
+            if self.pbar is not None:
+                self.pbar.update(n_bytes)
+
+    def _fetch_segment(self, fd, segment):
+        start, end, done = segment
+        if start + done >= end:
+            return
+        request = urllib.request.Request(self.url, headers={'Range': 'bytes=%d-%d' % (start + done, end - 1)})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status != 206:
+                raise DownloadError('Server ignored range request for %s' % self.url)
+            offset = start + done
+            while offset < end:
+                chunk = response.read(min(self.chunk_size, end - offset))
+                if not chunk:
+                    raise DownloadError('Connection closed at byte %d of %s' % (offset, self.url))
+                _pwrite(fd, chunk, offset, self.lock)
+                offset += len(chunk)
+                self._written(segment, len(chunk))
+
+    def _fetch_whole(self):
+        # Server doesn't tell size or doesn't support ranges - one stream, no resume
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response, open(self.part_loc, 'wb') as part:
+            for chunk in iter(lambda: response.read(self.chunk_size), b''):
+                part.write(chunk)
+                self.downloaded += len(chunk)
+                if self.pbar is not None:
+                    self.pbar.update(len(chunk))
+        return self.downloaded
+
+    def _checksum_matches(self, loc):
+        '''
+        Returns (matches, actual checksum) of file at loc. Any file matches if checksum was not provided.
+        '''
+        if self.checksum is None:
+            return True, None
+        algorithm, _, expected = self.checksum.partition(':')
+        actual = file_checksum(loc, algorithm, self.chunk_size)
+        return actual == expected.lower(), actual
+
+    def _verify(self):
+        matches, actual = self._checksum_matches(self.part_loc)
+        if not matches:
+            expected = self.checksum.partition(':')[2]
+            os.remove(self.part_loc)
+            if os.path.isfile(self.manifest_loc):
+                os.remove(self.manifest_loc)
+            raise DownloadError('Checksum mismatch for %s: expected %s, got %s' % (self.url, expected, actual))
+
+    def run(self):
+        start_time = time.time()
+        size, accepts_ranges, validator = probe_url(self.url, self.timeout)
+
+        if size is not None and os.path.isfile(self.dst) and os.path.getsize(self.dst) == size and not os.path.isfile(self.manifest_loc):
+            # Already downloaded. If checksum is known, same size is not enough - otherwise download again
+            if self._checksum_matches(self.dst)[0]:
+                return DownloadResult(self.dst, size, 0, 0.0, 0.0)
+
+        self.pbar = None
+        if self.progress:
+            from tqdm import tqdm
+            self.pbar = tqdm(total=size, unit='B', unit_scale=True, desc=self.url.split('/')[-1])
+
+        try:
+            if size is None or not accepts_ranges or size == 0:
+                size = self._fetch_whole()
+            else:
+                self.manifest = self._load_manifest(size, validator)
+                if self.manifest is None:
+                    self.manifest = {'url': self.url, 'size': size, 'validator': validator,
+                                     'segments': split_segments(size, self.segments)}
+                    fd = os.open(self.part_loc, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+                    _preallocate(fd, size)
+                else:
+                    fd = os.open(self.part_loc, os.O_RDWR)
+                if self.pbar is not None:
+                    self.pbar.update(sum(s[2] for s in self.manifest['segments']))
+
+                try:
+                    with ThreadPoolExecutor(max_workers=len(self.manifest['segments'])) as pool:
+                        futures = [pool.submit(self._fetch_segment, fd, s) for s in self.manifest['segments']]
+                        errors = [f.exception() for f in futures if f.exception() is not None]
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                    self._save_manifest()
+                if len(errors) > 0:
+                    raise DownloadError('Download of %s was interrupted, run it again to resume: %s' % (self.url, errors[0]))
+        finally:
+            if self.pbar is not None:
+                self.pbar.close()
+
+        self._verify()
+        os.replace(self.part_loc, self.dst)
+        if os.path.isfile(self.manifest_loc):
+            os.remove(self.manifest_loc)
+
+        seconds = time.time() - start_time
+        return DownloadResult(self.dst, size, self.downloaded, seconds, self.downloaded / seconds if seconds > 0 else 0.0)
+
+
+def download(url, dst, segments=DEFAULT_SEGMENTS, chunk_size=DEFAULT_CHUNK_SIZE, checksum=None, progress=True, timeout=60):
+    '''
+    Downloads url to dst in `segments` parallel ranged requests, resuming previous attempt if possible.
+
+    :return: DownloadResult with size of the file, bytes downloaded by this call, time and throughput in bytes per second.
+    '''
+    return Download(url, dst, segments, chunk_size, checksum, progress, timeout).run()
@@ -1,8 +1,6 @@
 import yaml, configparser, os, click
 import os, sys
-import requests, urllib
-from tqdm import tqdm
-import json
+import json, re, string
 import zlib
 from pathlib import Path
 
@@ -172,32 +170,41 @@ def human2bytes(s):
 ## end of http://code.activestate.com/recipes/578019/ }}}
 
 
-## https://gist.github.com/wy193777/0e2a4932e81afc6aa4c8f7a2984f34e2
-def download_from_url(url, dst):
+def download_from_url(url, dst, segments=4, checksum=None):
     """
+    Downloads file in several parallel segments, resuming previous attempt. See assnake.utils.download.
+
     @param: url to download file
     @param: dst place to put the file
+    @return: size of the file
     """
+    from assnake.utils.download import download
 
-    req = urllib.request.Request(url,  method='HEAD')
-    f = urllib.request.urlopen(req)
+    result = download(url, dst, segments=segments, checksum=checksum)
+    if result.seconds > 0:
+        print('Downloaded %s in %.1fs (%s/s)' % (bytes2human(result.downloaded), result.seconds, bytes2human(result.throughput)))
+    return result.size
 
-    file_size = int(f.headers['Content-Length'])
-    if os.path.exists(dst):
-        first_byte = os.path.getsize(dst)
-    else:
-        first_byte = 0
-    if first_byte >= file_size:
-        return file_size
-    header = {"Range": "bytes=%s-%s" % (first_byte, file_size)}
-    pbar = tqdm(
-        total=file_size, initial=first_byte,
-        unit='B', unit_scale=True, desc=url.split('/')[-1])
-    req = requests.get(url, headers=header, stream=True)
-    with(open(dst, 'ab')) as f:
-        for chunk in req.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
-                pbar.update(1024)
-    pbar.close()
-    return file_size
\ No newline at end of file
+# Regex for wildcard values when turning wildcard strings back into regexes. Everything else is one path component.
+WILDCARD_REGEXES = {
+    'fs_prefix': '.+',
+    'strand': 'R[12]',
+}
+
+def wc_template_regex(wc_str, wildcard_regexes=WILDCARD_REGEXES):
+    '''
+    Turns wildcard string like `{fs_prefix}/{df}/reads/{preproc}/{df_sample}_{strand}.fastq.gz` into regex source
+    with named groups. Repeated wildcards become backreferences.
+    '''
+    regex = ''
+    seen = set()
+    for literal, field, _, _ in string.Formatter().parse(wc_str):
+        regex += re.escape(literal)
+        if field is None:
+            continue
+        if field in seen:
+            regex += '(?P={field})'.format(field=field)
+        else:
+            seen.add(field)
+            regex += '(?P<{field}>{value})'.format(field=field, value=wildcard_regexes.get(field, '[^/]+'))
+    return regex
@@ -50,3 +50,32 @@ def test_assn_data(tmp_path_factory):
 
 
 
+
+
+@pytest.fixture
+def assnake_instance(tmp_path, monkeypatch):
+    '''
+    Fresh assnake installation in temporary HOME with assnake_db and one empty dataset `test_df`
+    stored in `{tmp_path}/storage/test_df`.
+    '''
+    import yaml
+    home = tmp_path / 'home'
+    assnake_db = tmp_path / 'assnake_db'
+    storage = tmp_path / 'storage'
+    os.makedirs(home / '.config/assnake')
+    os.makedirs(assnake_db / 'datasets')
+    os.makedirs(storage / 'test_df' / 'reads' / 'raw')
+    monkeypatch.setenv('HOME', str(home))
+
+    instance_config_loc = assnake_db / 'config.yaml'
+    with open(instance_config_loc, 'w') as f:
+        yaml.dump({'assnake_db': str(assnake_db)}, f)
+    with open(home / '.config/assnake/internal_config.yaml', 'w') as f:
+        yaml.dump({'instance_config_loc': str(instance_config_loc)}, f)
+
+    os.symlink(storage / 'test_df', assnake_db / 'datasets' / 'test_df', target_is_directory=True)
+    with open(assnake_db / 'datasets' / 'test_df' / 'df_info.yaml', 'w') as f:
+        yaml.dump({'df': 'test_df', 'fs_prefix': str(storage), 'description': {}}, f)
+
+    return {'assnake_db': assnake_db, 'fs_prefix': storage, 'df': 'test_df', 'full_path': storage / 'test_df'}
+
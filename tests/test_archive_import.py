@@ -0,0 +1,95 @@
+import os
+import tarfile
+import zipfile
+import pytest
+
+from assnake.api.archive_import import extract_reads, plan_archive_import, is_archive
+
+MEMBERS = {
+    'tutorial/raw_data/S1_R1_001.fastq.gz': b'S1 R1',
+    'tutorial/raw_data/S1_R2_001.fastq.gz': b'S1 R2',
+    'tutorial/raw_data/S-2_R1_001.fastq.gz': b'S2 R1',
+    'tutorial/raw_data/S-2_R2_001.fastq.gz': b'S2 R2',
+    'tutorial/other/S3_R1_001.fastq.gz': b'S3 R1',
+    'tutorial/README.txt': b'readme',
+}
+
+
+def make_zip(loc):
+    with zipfile.ZipFile(loc, 'w') as archive:
+        for name, content in MEMBERS.items():
+            archive.writestr(name, content)
+
+
+def make_tar(loc):
+    import io
+    with tarfile.open(loc, 'w:gz') as archive:
+        for name, content in MEMBERS.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+
+
+@pytest.mark.dataset_api
+@pytest.mark.parametrize('make_archive,archive_name', [(make_zip, 'data.zip'), (make_tar, 'data.tar.gz')])
+def test_extract_reads(tmp_path, make_archive, archive_name):
+    archive_loc = str(tmp_path / archive_name)
+    make_archive(archive_loc)
+    assert is_archive(archive_loc)
+    target = tmp_path / 'df' / 'reads' / 'raw'
+
+    extracted = extract_reads(archive_loc, str(target), pattern='*raw_data/*.fastq.gz',
+                              modify_name=lambda name: name.replace('-', '_'), workers=4)
+    assert sorted(os.path.basename(loc) for loc in extracted) == ['S1_R1.fastq.gz', 'S1_R2.fastq.gz', 'S_2_R1.fastq.gz', 'S_2_R2.fastq.gz']
+    assert sorted(os.listdir(str(target))) == ['S1_R1.fastq.gz', 'S1_R2.fastq.gz', 'S_2_R1.fastq.gz', 'S_2_R2.fastq.gz']
+    assert (target / 'S_2_R2.fastq.gz').read_bytes() == b'S2 R2'
+    # Nothing else is extracted
+    assert sorted(os.listdir(str(tmp_path))) == [archive_name, 'df']
+
+    # Existing files are skipped
+    assert extract_reads(archive_loc, str(target), modify_name=lambda name: name.replace('-', '_')) == [str(target / 'S3_R1.fastq.gz')]
+
+
+@pytest.mark.dataset_api
+def test_plan_archive_import_samples(tmp_path):
+    archive_loc = str(tmp_path / 'data.zip')
+    make_zip(archive_loc)
+    members = plan_archive_import(archive_loc, samples=['S3'])
+    assert [(m.name, m.dst_name, m.size) for m in members] == [('tutorial/other/S3_R1_001.fastq.gz', 'S3_R1.fastq.gz', 5)]
+
+
+LANE_MEMBERS = {
+    'run/S1_L002_R1_001.fastq.gz': b'S1 L2 R1',
+    'run/S1_L001_R1_001.fastq.gz': b'S1 L1 R1',
+    'run/S1_L001_R2_001.fastq.gz': b'S1 L1 R2',
+    'run/S1_L002_R2_001.fastq.gz': b'S1 L2 R2',
+    'run/S2_R1_001.fastq.gz': b'S2 R1',
+    'other/S2_R1_001.fastq.gz': b'S2 R1 again',
+}
+
+
+@pytest.mark.dataset_api
+@pytest.mark.parametrize('archive_name', ['lanes.zip', 'lanes.tar.gz'])
+def test_lanes_are_merged(tmp_path, archive_name):
+    import io
+    archive_loc = str(tmp_path / archive_name)
+    if archive_name.endswith('.zip'):
+        with zipfile.ZipFile(archive_loc, 'w') as archive:
+            for name, content in LANE_MEMBERS.items():
+                archive.writestr(name, content)
+    else:
+        with tarfile.open(archive_loc, 'w:gz') as archive:
+            for name, content in LANE_MEMBERS.items(): # L002 comes first
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+    target = tmp_path / 'raw'
+
+    report = []
+    extracted = extract_reads(archive_loc, str(target), report=report)
+    assert sorted(os.path.basename(loc) for loc in extracted) == ['S1_R1.fastq.gz', 'S1_R2.fastq.gz']
+    assert (target / 'S1_R1.fastq.gz').read_bytes() == b'S1 L1 R1S1 L2 R1'
+    assert (target / 'S1_R2.fastq.gz').read_bytes() == b'S1 L1 R2S1 L2 R2'
+    assert sorted(os.listdir(str(target))) == ['S1_R1.fastq.gz', 'S1_R2.fastq.gz']
+    # Same sample in two folders is not guessed
+    assert sorted((r['file'], r['problem']) for r in report) == [('other/S2_R1_001.fastq.gz', 'ambiguous'), ('run/S2_R1_001.fastq.gz', 'ambiguous')]
@@ -0,0 +1,87 @@
+import os
+import json
+import pytest
+import yaml
+
+import assnake
+import assnake.api.catalog
+from assnake.api.catalog import read_catalog, update_catalog, catalog_loc
+from assnake.api.loaders import update_fs_samples_csv
+from tests.util_for_test import write_reads
+
+
+def register_by_hand(assnake_instance, df):
+    os.makedirs(assnake_instance['fs_prefix'] / df / 'reads' / 'raw')
+    os.symlink(assnake_instance['fs_prefix'] / df, assnake_instance['assnake_db'] / 'datasets' / df, target_is_directory=True)
+    with open(assnake_instance['assnake_db'] / 'datasets' / df / 'df_info.yaml', 'w') as f:
+        yaml.dump({'df': df, 'fs_prefix': str(assnake_instance['fs_prefix']), 'description': {}}, f)
+
+
+@pytest.mark.dataset_api
+def test_catalog_is_built_once(assnake_instance, monkeypatch):
+    register_by_hand(assnake_instance, 'other_df')
+    assert sorted(assnake.Dataset.list_in_db().keys()) == ['other_df', 'test_df']
+    assert os.path.isfile(catalog_loc(str(assnake_instance['assnake_db'])))
+
+    # df_info.yaml files are not read again
+    monkeypatch.setattr(assnake.api.catalog, 'read_yaml', lambda loc: pytest.fail('read ' + loc))
+    dfs = assnake.Dataset.list_in_db()
+    assert dfs['other_df']['fs_prefix'] == str(assnake_instance['fs_prefix']) and dfs['other_df']['summary'] == {}
+
+    os.remove(assnake_instance['assnake_db'] / 'datasets' / 'other_df')
+    assert sorted(assnake.Dataset.list_in_db().keys()) == ['test_df']
+
+
+@pytest.mark.dataset_api
+def test_deleted_dataset_does_not_lock_catalog(assnake_instance, monkeypatch):
+    register_by_hand(assnake_instance, 'other_df')
+    assert assnake.Dataset.delete_ds('other_df') == (True,)
+    assert os.path.isdir(assnake_instance['assnake_db'] / 'datasets' / 'other_df')
+    assert sorted(assnake.Dataset.list_in_db().keys()) == ['test_df']
+
+    monkeypatch.setattr(assnake.api.catalog, '_catalog_lock', lambda assnake_db: pytest.fail('catalog is locked'))
+    assert sorted(assnake.Dataset.list_in_db().keys()) == ['test_df']
+
+
+@pytest.mark.dataset_api
+def test_update_catalog_rereads_df_info(assnake_instance):
+    assnake_db = str(assnake_instance['assnake_db'])
+    assert read_catalog(assnake_db)['test_df']['info']['description'] == {}
+
+    with open(assnake_instance['assnake_db'] / 'datasets' / 'test_df' / 'df_info.yaml', 'w') as f:
+        yaml.dump({'df': 'test_df', 'fs_prefix': str(assnake_instance['fs_prefix']), 'description': {'organism': 'mouse'}}, f)
+    update_catalog(assnake_db, 'test_df')
+    assert read_catalog(assnake_db)['test_df']['info']['description'] == {'organism': 'mouse'}
+
+
+@pytest.mark.dataset_api
+def test_rescan_updates_summary(assnake_instance):
+    write_reads(assnake_instance['full_path'], 'raw', 'A', content=b'12345')
+    write_reads(assnake_instance['full_path'], 'raw', 'B', content=b'12345')
+    write_reads(assnake_instance['full_path'], 'raw__tmtic_def', 'A', content=b'1')
+    update_fs_samples_csv('test_df')
+
+    summary = assnake.Dataset.list_in_db()['test_df']['summary']
+    assert summary['samples'] == {'raw': 2, 'raw__tmtic_def': 1}
+    assert summary['bytes'] == 22 and 'last_scan' in summary
+    with open(catalog_loc(str(assnake_instance['assnake_db']))) as f:
+        assert json.load(f)['datasets']['test_df']['summary'] == summary
+
+
+@pytest.mark.dataset_api
+def test_create_and_list_commands(assnake_instance):
+    from click.testing import CliRunner
+    from assnake.cli.assnake_cli import cli
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['dataset', 'create', '-d', 'new_df', '-f', str(assnake_instance['fs_prefix'])])
+    assert result.exit_code == 0, result.output
+    assert 'new_df' in read_catalog(str(assnake_instance['assnake_db']))
+
+    result = runner.invoke(cli, ['dataset', 'create', '-d', 'new_df', '-f', str(assnake_instance['fs_prefix'])])
+    assert 'Dataset with such name already exists' in result.output
+
+    write_reads(assnake_instance['fs_prefix'] / 'new_df', 'raw', 'A')
+    runner.invoke(cli, ['dataset', 'rescan', 'new_df'])
+    result = runner.invoke(cli, ['dataset', 'list'])
+    assert 'Samples: raw: 1' in result.output and 'Full path: ' + str(assnake_instance['fs_prefix'] / 'test_df') in result.output
@@ -0,0 +1,80 @@
+import os
+import hashlib
+import pytest
+
+import assnake.api.checksums
+from assnake.api.checksums import hash_file, update_dataset_checksums, open_dataset_manifest, available_algorithms, CHECKSUM_MANIFEST_FILE
+from tests.util_for_test import write_reads
+
+
+@pytest.mark.smoke
+@pytest.mark.parametrize('algorithm', available_algorithms())
+def test_hash_file(tmp_path, algorithm):
+    content = os.urandom(3 * 1024 * 1024 + 11)
+    (tmp_path / 'f').write_bytes(content)
+    checksum = hash_file(str(tmp_path / 'f'), algorithm, buffer_size=1024 * 1024)
+    if algorithm in hashlib.algorithms_available:
+        assert checksum == hashlib.new(algorithm, content).hexdigest()
+    assert checksum == hash_file(str(tmp_path / 'f'), algorithm)
+
+
+@pytest.mark.dataset_api
+def test_manifest_hashes_only_changed_files(assnake_instance, monkeypatch):
+    full_path = assnake_instance['full_path']
+    write_reads(full_path, 'raw', 'A', content=b'A')
+    write_reads(full_path, 'raw', 'B', content=b'B')
+    write_reads(full_path, 'raw__tmtic_def', 'A', content=b'a')
+
+    hashed, removed = update_dataset_checksums('test_df', 'md5', workers=2)
+    assert len(hashed) == 6 and removed == []
+    assert os.path.isfile(full_path / CHECKSUM_MANIFEST_FILE)
+
+    hashed_files = []
+    original_hash_files = assnake.api.checksums.hash_files
+    monkeypatch.setattr(assnake.api.checksums, 'hash_files',
+                        lambda locs, *args: hashed_files.extend(locs) or original_hash_files(locs, *args))
+    assert update_dataset_checksums('test_df', 'md5') == ([], [])
+    assert hashed_files == []
+
+    write_reads(full_path, 'raw', 'B', strands=('R2',), content=b'changed')
+    os.remove(full_path / 'reads' / 'raw__tmtic_def' / 'A_R2.fastq.gz')
+    hashed, removed = update_dataset_checksums('test_df', 'md5')
+    assert hashed == ['reads/raw/B_R2.fastq.gz'] and removed == ['reads/raw__tmtic_def/A_R2.fastq.gz']
+
+    _, manifest = open_dataset_manifest('test_df')
+    assert manifest.entries['reads/raw/B_R2.fastq.gz']['checksum'] == hashlib.md5(b'changed').hexdigest()
+
+
+@pytest.mark.dataset_api
+def test_verify_finds_corrupted_files(assnake_instance):
+    full_path = assnake_instance['full_path']
+    write_reads(full_path, 'raw', 'A', content=b'AAAA')
+    write_reads(full_path, 'raw', 'B', content=b'BBBB')
+    update_dataset_checksums('test_df', 'blake2b')
+
+    # Silent corruption - same size and mtime
+    loc = str(full_path / 'reads' / 'raw' / 'A_R1.fastq.gz')
+    st = os.stat(loc)
+    with open(loc, 'r+b') as f:
+        f.write(b'X')
+    os.utime(loc, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.remove(full_path / 'reads' / 'raw' / 'B_R2.fastq.gz')
+
+    _, manifest = open_dataset_manifest('test_df')
+    verified = manifest.verify(workers=2).set_index('path')['status']
+    assert verified.to_dict() == {'reads/raw/A_R1.fastq.gz': 'mismatch', 'reads/raw/A_R2.fastq.gz': 'ok',
+                                  'reads/raw/B_R1.fastq.gz': 'ok', 'reads/raw/B_R2.fastq.gz': 'missing'}
+
+
+@pytest.mark.dataset_api
+def test_verify_command(assnake_instance):
+    from click.testing import CliRunner
+    from assnake.cli.assnake_cli import cli
+
+    write_reads(assnake_instance['full_path'], 'raw', 'A', content=b'AAAA')
+    runner = CliRunner()
+    result = runner.invoke(cli, ['dataset', 'rescan', '--checksum', 'md5', 'test_df'])
+    assert 'Computed md5 checksums of 2 files' in result.output
+
+    result = runner.invoke(cli, ['dataset', 'verify', 'test_df'])
+    assert result.exit_code == 0 and 'OK: 2, mismatch: 0, missing: 0, without checksum: 0' in result.output
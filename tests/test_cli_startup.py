@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import subprocess
+import pytest
+
+FAKE_PLUGIN = '''
+import os, click
+from assnake.core.snake_module import SnakeModule
+
+with open(os.environ['FAKE_PLUGIN_IMPORT_LOG'], 'a') as log:
+    log.write('imported\\n')
+
+@click.command('fake-result', short_help='Fake result for tests')
+def fake_result():
+    click.echo('FAKE RESULT RAN')
+
+snake_module = SnakeModule(name='fake', install_dir=os.path.dirname(os.path.abspath(__file__)), invocation_commands=[fake_result])
+'''
+
+
+@pytest.fixture
+def fake_plugin_env(assnake_instance, tmp_path):
+    '''
+    Environment with one assnake plugin installed as a distribution on PYTHONPATH.
+    '''
+    site = tmp_path / 'site'
+    os.makedirs(site / 'fake_assnake_plugin')
+    os.makedirs(site / 'fake_assnake_plugin-0.1.dist-info')
+    (site / 'fake_assnake_plugin' / '__init__.py').write_text(FAKE_PLUGIN)
+    (site / 'fake_assnake_plugin-0.1.dist-info' / 'METADATA').write_text(
+        'Metadata-Version: 2.1\nName: fake-assnake-plugin\nVersion: 0.1\n')
+    (site / 'fake_assnake_plugin-0.1.dist-info' / 'entry_points.txt').write_text(
+        '[assnake.plugins]\nfake = fake_assnake_plugin:snake_module\n')
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([str(site), os.path.dirname(os.path.dirname(os.path.abspath(__file__)))])
+    env['XDG_CACHE_HOME'] = str(tmp_path / 'cache')
+    env['FAKE_PLUGIN_IMPORT_LOG'] = str(tmp_path / 'imports.log')
+    return env
+
+
+def run_assnake(env, *args):
+    start = time.time()
+    proc = subprocess.run([sys.executable, '-c', 'from assnake.cli.assnake_cli import main; main()', *args],
+                          env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return proc.stdout, time.time() - start
+
+
+def plugin_imports(env):
+    if not os.path.isfile(env['FAKE_PLUGIN_IMPORT_LOG']):
+        return 0
+    with open(env['FAKE_PLUGIN_IMPORT_LOG']) as log:
+        return len(log.readlines())
+
+
+@pytest.mark.benchmark
+def test_plugins_are_imported_lazily(fake_plugin_env):
+    # First run builds the manifest
+    output, _ = run_assnake(fake_plugin_env, 'result', '--help')
+    assert 'fake-result' in output
+    assert plugin_imports(fake_plugin_env) == 1
+
+    # Next runs list commands from the manifest without importing the plugin
+    output, help_time = run_assnake(fake_plugin_env, 'result', '--help')
+    assert 'fake-result' in output and 'Fake result for tests' in output
+    _, list_time = run_assnake(fake_plugin_env, 'dataset', 'list')
+    assert plugin_imports(fake_plugin_env) == 1
+    print('\nassnake result --help: %.2fs, assnake dataset list: %.2fs' % (help_time, list_time))
+
+    # Plugin is imported only when its command is invoked
+    output, _ = run_assnake(fake_plugin_env, 'result', 'fake-result')
+    assert 'FAKE RESULT RAN' in output
+    assert plugin_imports(fake_plugin_env) == 2
+
+
+@pytest.mark.benchmark
+def test_manifest_is_keyed_by_plugin_versions(fake_plugin_env, tmp_path):
+    run_assnake(fake_plugin_env, 'result', '--help')
+    assert plugin_imports(fake_plugin_env) == 1
+
+    # Unrelated package installed - site directory changed, plugin versions did not
+    os.makedirs(tmp_path / 'site' / 'unrelated-1.0.dist-info')
+    output, _ = run_assnake(fake_plugin_env, 'result', '--help')
+    assert 'fake-result' in output
+    assert plugin_imports(fake_plugin_env) == 1
+
+    # Plugin upgraded
+    os.rename(tmp_path / 'site' / 'fake_assnake_plugin-0.1.dist-info', tmp_path / 'site' / 'fake_assnake_plugin-0.2.dist-info')
+    (tmp_path / 'site' / 'fake_assnake_plugin-0.2.dist-info' / 'METADATA').write_text(
+        'Metadata-Version: 2.1\nName: fake-assnake-plugin\nVersion: 0.2\n')
+    run_assnake(fake_plugin_env, 'result', '--help')
+    assert plugin_imports(fake_plugin_env) == 2
+
+
+@pytest.mark.smoke
+def test_manifest_notices_edited_plugin_files(tmp_path):
+    from types import SimpleNamespace
+    from assnake.core import plugin_manifest
+
+    result_dir = tmp_path / 'plugin' / 'some_result'
+    os.makedirs(result_dir)
+    (result_dir / 'workflow.smk').write_text('rule all:\n')
+    (result_dir / 'wc_config.yaml').write_text('some_result_wc: a\n')
+    res = SimpleNamespace(workflows=[str(result_dir / 'workflow.smk')], wc_config=None)
+    module_class = SimpleNamespace(name='fake', install_dir=str(tmp_path / 'plugin'), snakefiles=[], wc_configs=[], results=[res])
+    entry_point = {'name': 'fake', 'entry_point': 'fake:snake_module', 'distribution': 'fake', 'version': '0.1'}
+
+    manifest = {'plugins': {'fake': plugin_manifest.describe_plugin(entry_point, module_class)}}
+    assert not plugin_manifest._install_dirs_changed(manifest)
+
+    # Edited in place - mtime of the plugin directory doesn't change
+    (result_dir / 'wc_config.yaml').write_text('some_result_wc: b\n')
+    os.utime(result_dir / 'wc_config.yaml', ns=(0, 0))
+    assert plugin_manifest._install_dirs_changed(manifest)
@@ -0,0 +1,37 @@
+import os
+import pytest
+import yaml
+
+from assnake.core import config
+
+
+@pytest.mark.smoke
+def test_instance_config_is_parsed_once(assnake_instance, monkeypatch):
+    config.invalidate_config_cache()
+    parsed = []
+    original_read_yaml = config.read_yaml
+    monkeypatch.setattr(config, 'read_yaml', lambda loc: parsed.append(loc) or original_read_yaml(loc))
+
+    for _ in range(10):
+        instance_config = config.read_assnake_instance_config()
+    assert instance_config['assnake_db'] == str(assnake_instance['assnake_db'])
+    assert len(parsed) == 2 # internal and instance config
+
+    # Callers get copies and can't spoil the cache
+    instance_config['assnake_db'] = 'spoiled'
+    assert config.read_assnake_instance_config()['assnake_db'] == str(assnake_instance['assnake_db'])
+
+
+@pytest.mark.smoke
+def test_update_invalidates_cache(assnake_instance):
+    config.invalidate_config_cache()
+    assert config.read_assnake_instance_config().get('io_workers') is None
+    config.update_instance_config({'io_workers': 16})
+    assert config.read_assnake_instance_config()['io_workers'] == 16
+
+    # Edits from outside are picked up by mtime
+    instance_config_loc = config.read_internal_config()['instance_config_loc']
+    with open(instance_config_loc, 'w') as f:
+        yaml.dump({'assnake_db': 'somewhere/else', 'io_workers': 2}, f)
+    os.utime(instance_config_loc, ns=(0, 0))
+    assert config.read_assnake_instance_config()['io_workers'] == 2
@@ -0,0 +1,107 @@
+import gzip
+import os
+import random
+import pytest
+
+from assnake.api.counters import count_fastq_gz, count_reads
+from assnake.api.loaders import load_count
+from assnake.core.config import load_wc_config
+from tests.util_for_test import write_reads
+
+
+def make_fastq(n_reads, seed=0):
+    rnd = random.Random(seed)
+    records, bps = [], 0
+    for i in range(n_reads):
+        seq = ''.join(rnd.choice('ACGT') for _ in range(rnd.randint(1, 150)))
+        bps += len(seq)
+        records.append('@read_%d\n%s\n+\n%s\n' % (i, seq, 'I' * len(seq)))
+    return ''.join(records).encode(), bps
+
+
+def write_fastq_gz(loc, fastq, members=1):
+    os.makedirs(os.path.dirname(loc), exist_ok=True)
+    step = len(fastq) // members + 1
+    with open(loc, 'wb') as fastq_gz:
+        for i in range(members):
+            fastq_gz.write(gzip.compress(fastq[i * step:(i + 1) * step]))
+
+
+@pytest.mark.smoke
+@pytest.mark.parametrize('members,chunk_size', [(1, 4 * 1024 * 1024), (3, 4 * 1024 * 1024), (5, 7)])
+def test_count_fastq_gz(tmp_path, members, chunk_size):
+    fastq, bps = make_fastq(500)
+    loc = str(tmp_path / 'S_R1.fastq.gz')
+    write_fastq_gz(loc, fastq, members)
+    assert count_fastq_gz(loc, chunk_size=chunk_size) == (500, bps)
+
+    # Without trailing newline
+    write_fastq_gz(loc, fastq.rstrip(b'\n'), members)
+    assert count_fastq_gz(loc, chunk_size=chunk_size) == (500, bps)
+
+    write_fastq_gz(loc, b'')
+    assert count_fastq_gz(loc) == (0, 0)
+
+
+@pytest.mark.smoke
+def test_truncated_file_is_not_counted(tmp_path):
+    wc_config = load_wc_config()
+    fastq, _ = make_fastq(500)
+    loc = wc_config['fastq_gz_file_wc'].format(fs_prefix=str(tmp_path), df='df', preproc='raw', df_sample='A', strand='R1')
+    write_fastq_gz(loc, fastq, members=2)
+    with open(loc, 'rb') as fastq_gz:
+        data = fastq_gz.read()
+    with open(loc, 'wb') as fastq_gz:
+        fastq_gz.write(data[:-100])
+    with pytest.raises(EOFError):
+        count_fastq_gz(loc, chunk_size=7)
+
+    with pytest.raises(EOFError):
+        count_reads(str(tmp_path), 'df', ['raw'], wc_config=wc_config, workers=1)
+    assert not os.path.exists(wc_config['count_wc'].format(fs_prefix=str(tmp_path), df='df', preproc='raw', df_sample='A', strand='R1'))
+
+
+@pytest.mark.dataset_api
+def test_count_reads_writes_count_files(tmp_path):
+    wc_config = load_wc_config()
+    fastq, bps = make_fastq(100)
+    for strand in ['R1', 'R2']:
+        write_fastq_gz(wc_config['fastq_gz_file_wc'].format(
+            fs_prefix=str(tmp_path), df='df', preproc='raw', df_sample='A', strand=strand), fastq, members=2)
+
+    counted = count_reads(str(tmp_path), 'df', ['raw'], wc_config=wc_config, workers=2)
+    assert sorted(c[1:] for c in counted) == [(100, bps), (100, bps)]
+    count = load_count(str(tmp_path), 'df', 'raw', 'A', report_bps=True, count_wc=wc_config['count_wc'])
+    assert count == {'reads': 100, 'bps': bps}
+
+    # Up to date counts are not recomputed
+    assert count_reads(str(tmp_path), 'df', ['raw'], wc_config=wc_config) == []
+    assert len(count_reads(str(tmp_path), 'df', ['raw'], wc_config=wc_config, overwrite=True)) == 2
+
+
+@pytest.mark.dataset_api
+def test_load_counts_both_strands(assnake_instance):
+    from assnake.api.loaders import load_counts, load_sample_set
+    from tests.test_sample_index import open_index
+
+    full_path = assnake_instance['full_path']
+    fs_prefix = str(assnake_instance['fs_prefix'])
+    wc_config = load_wc_config()
+    write_reads(full_path, 'raw', 'A', reads=10)
+    write_reads(full_path, 'raw', 'B', reads=5)
+    write_reads(full_path, 'raw', 'B', strands=('R2',), reads=4)
+    write_reads(full_path, 'raw', 'C', strands=('R1',), reads=3)
+    write_reads(full_path, 'raw', 'D')
+
+    counts = load_counts(fs_prefix, 'test_df', 'raw', ['A', 'B', 'C', 'D'], wc_config['count_wc'])
+    assert list(counts['reads_R1']) == [10, 5, 3, -1]
+    assert list(counts['reads_R2']) == [10, 4, -1, -1]
+    assert list(counts['bps_R2']) == [1000, 400, -1, -1]
+    assert list(counts['mismatch']) == [False, True, False, False]
+    assert counts['reads_R1'].dtype == 'int64' and counts['mismatch'].dtype == bool
+
+    sample_set = load_sample_set(wc_config, fs_prefix, 'test_df', 'raw', report_bps=True).set_index('df_sample')
+    assert sample_set.loc['B', 'reads'] == 5 and sample_set.loc['B', 'bps'] == 500
+
+    index_counts = open_index(assnake_instance).load_counts('raw')
+    assert index_counts.sort_index().equals(counts)
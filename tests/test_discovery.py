@@ -0,0 +1,164 @@
+import os
+import pytest
+
+import assnake.api.discovery
+from assnake.api.discovery import IMPORT_CLASSIFIER, SINGLE_END_CLASSIFIER, DATASET_CLASSIFIER, scan_reads_dir, register_ending_variant, get_import_classifier
+from assnake.api.fs_helpers import get_samples_from_dir, classify_run_dir, plan_import
+from assnake.api.loaders import load_sample_set, load_sample
+from assnake.core.config import load_wc_config
+from tests.util_for_test import write_reads, count_fs_calls
+
+
+@pytest.mark.smoke
+@pytest.mark.parametrize('file_name,expected', [
+    ('s1_R1.fastq.gz', ('s1', 'R1', 'normal')),
+    ('s1_R2_001.fastq.gz', ('s1', 'R2', 'ILLUMINA_001')),
+    ('s_R1_1.fastq.gz', ('s_R1', 'R1', 'SRA')),
+    ('s_R1x_R2.fastq.gz', ('s_R1x', 'R2', 'normal')),
+    ('s1_L002_R1_001.fastq.gz', ('s1', 'R1', 'ILLUMINA_WITH_LANE')),
+    ('s_R1_L001_R2_001.fastq.gz', ('s_R1', 'R2', 'ILLUMINA_WITH_LANE')),
+    ('s1_R1.fastq', None),
+    ('s1.fastq.gz', None),
+])
+def test_import_classifier(file_name, expected):
+    classified = IMPORT_CLASSIFIER.classify(file_name)
+    if expected is None:
+        assert classified is None
+    else:
+        assert (classified[0], classified[1], classified[2]['name']) == expected
+
+
+@pytest.mark.smoke
+def test_single_end_fallback(tmp_path):
+    for name in ['a.fastq.gz', 'b.fastq.gz', 'notes.txt']:
+        (tmp_path / name).write_text('1')
+    samples = get_samples_from_dir(str(tmp_path))
+    assert list(samples['name_in_run']) == ['a', 'b']
+    assert set(samples['ending_variant_id']) == {'single_end'}
+    assert SINGLE_END_CLASSIFIER.classify('a.fastq.gz')[0] == 'a'
+
+
+def touch_run(run_dir, names):
+    os.makedirs(str(run_dir), exist_ok=True)
+    for name in names:
+        (run_dir / name).write_text(name)
+
+
+@pytest.mark.smoke
+def test_classify_run_dir(tmp_path):
+    touch_run(tmp_path, [
+        'A_L001_R1_001.fastq.gz', 'A_L001_R2_001.fastq.gz', 'A_L002_R1_001.fastq.gz', 'A_L002_R2_001.fastq.gz',
+        'B_R1_001.fastq.gz', 'B_R2_001.fastq.gz',
+        'C_R1.fastq.gz', 'C_R1_001.fastq.gz', 'C_R2_001.fastq.gz',
+        'D_R2.fastq.gz',
+        'E_R1.fastq.gz',
+        'F_L001_R1_001.fastq.gz', 'F_L002_R2_001.fastq.gz',
+        'notes.fastq.gz', 'notes.txt'
+    ])
+    samples, report = classify_run_dir(str(tmp_path), lambda name: name.lower())
+
+    assert list(samples['name_in_run']) == ['A', 'B', 'E']
+    assert list(samples['modified_name']) == ['a', 'b', 'e']
+    assert str(samples['ending_variant_id'].dtype) == 'category' and samples['n_lanes'].dtype == 'int64'
+    a = samples.iloc[0]
+    assert a['lanes'] == ('001', '002') and a['paired']
+    assert [os.path.basename(f) for f in a['files_R2']] == ['A_L001_R2_001.fastq.gz', 'A_L002_R2_001.fastq.gz']
+    assert not samples.iloc[2]['paired'] and samples.iloc[2]['files_R2'] == ()
+
+    problems = {(os.path.basename(f), problem) for f, problem in zip(report['file'], report['problem'])}
+    assert problems == {
+        ('C_R1.fastq.gz', 'ambiguous'), ('C_R1_001.fastq.gz', 'ambiguous'), ('C_R2_001.fastq.gz', 'ambiguous'),
+        ('D_R2.fastq.gz', 'unpaired'), ('E_R1.fastq.gz', 'unpaired'),
+        ('F_L001_R1_001.fastq.gz', 'lanes_differ'), ('F_L002_R2_001.fastq.gz', 'lanes_differ'),
+        ('notes.fastq.gz', 'unrecognized')
+    }
+
+    samples['df_sample'] = samples['modified_name']
+    plan = plan_import('/import', samples)
+    assert [(action.df_sample, action.src, action.dst) for action in plan][:2] == [
+        ('a', a['files_R1'], '/import/a_R1.fastq.gz'), ('a', a['files_R2'], '/import/a_R2.fastq.gz')
+    ]
+    assert [(action.df_sample, os.path.basename(action.src), action.dst) for action in plan[2:]] == [
+        ('b', 'B_R1_001.fastq.gz', '/import/b_R1.fastq.gz'), ('b', 'B_R2_001.fastq.gz', '/import/b_R2.fastq.gz'),
+        ('e', 'E_R1.fastq.gz', '/import/e_R1.fastq.gz')
+    ]
+
+
+@pytest.mark.smoke
+def test_register_ending_variant(tmp_path, monkeypatch):
+    monkeypatch.setattr(assnake.api.discovery, '_registered_variants', list(assnake.api.discovery.IMPORT_ENDING_VARIANTS))
+    monkeypatch.setattr(assnake.api.discovery, '_import_classifier', IMPORT_CLASSIFIER)
+    touch_run(tmp_path, ['S1_1.clean.fastq.gz', 'S1_2.clean.fastq.gz'])
+    assert set(get_samples_from_dir(str(tmp_path))['ending_variant_id']) == {'single_end'}
+
+    register_ending_variant({'name': 'BGI', 'strands': {'R1': '_1.clean', 'R2': '_2.clean'}})
+    assert get_import_classifier().classify('S1_2.clean.fastq.gz').ending_variant['name'] == 'BGI'
+    samples = get_samples_from_dir(str(tmp_path))
+    assert list(samples['name_in_run']) == ['S1'] and list(samples['ending_variant_id']) == ['BGI']
+
+
+@pytest.mark.benchmark
+def test_classify_run_dir_lists_once(tmp_path, monkeypatch):
+    '''
+    Run directory with 20000 files of multi-lane samples is classified from one listing, files are not opened or stated.
+    '''
+    run_dir = tmp_path / 'run'
+    touch_run(run_dir, ['S{}_L00{}_{}_001.fastq.gz'.format(i, lane, strand)
+                        for i in range(5000) for lane in [1, 2] for strand in ['R1', 'R2']])
+    counts = count_fs_calls(monkeypatch, run_dir)
+    samples, report = classify_run_dir(str(run_dir))
+    assert len(samples) == 5000 and len(report) == 0
+    assert set(samples['n_lanes']) == {2}
+    assert dict(counts) == {'scandir': 1}
+
+
+@pytest.mark.benchmark
+def test_syscalls_do_not_grow_with_samples(tmp_path, monkeypatch):
+    '''
+    Loading sample set lists preprocessing directory once and never stats read files one by one.
+    Before single-pass discovery 200 samples took 1 scandir + 200 lstat + 400 stat.
+    '''
+    for i in range(200):
+        write_reads(tmp_path / 'df', 'raw', 'S%d' % i)
+    for i in range(200):
+        for strand in ['R1', 'R2']:
+            (tmp_path / 'run').mkdir(exist_ok=True)
+            (tmp_path / 'run' / 'S{}_{}_001.fastq.gz'.format(i, strand)).write_text('1')
+    wc_config = load_wc_config()
+
+    counts = count_fs_calls(monkeypatch, tmp_path)
+    sample_set = load_sample_set(wc_config, str(tmp_path), 'df', 'raw')
+    assert len(sample_set) == 200
+    assert counts['scandir'] == 1 and counts['stat'] + counts['lstat'] == 0
+
+    counts.clear()
+    sample = load_sample(str(tmp_path), 'df', 'raw', 'S1', fastq_gz_file_wc=wc_config['fastq_gz_file_wc'], count_wc=wc_config['count_wc'])
+    assert sample['preproc'] == 'raw'
+    assert counts['scandir'] == 1 and counts['stat'] + counts['lstat'] == 0
+
+    counts.clear()
+    assert len(get_samples_from_dir(str(tmp_path / 'run'))) == 200
+    assert dict(counts) == {'scandir': 1}
+
+
+@pytest.mark.dataset_api
+def test_load_sample_longest(tmp_path):
+    write_reads(tmp_path / 'df', 'raw', 'A')
+    write_reads(tmp_path / 'df', 'raw__tmtic_def', 'A', strands=('R1',))
+    wc_config = load_wc_config()
+    sample = load_sample(str(tmp_path), 'df', 'longest', 'A', report_size=True,
+                         fastq_gz_file_wc=wc_config['fastq_gz_file_wc'], count_wc=wc_config['count_wc'])
+    assert sample['preproc'] == 'raw__tmtic_def'
+    assert sample['bytes'] == 1
+    assert [f.df_sample for f in scan_reads_dir(str(tmp_path / 'df' / 'reads' / 'raw'), DATASET_CLASSIFIER)] == ['A', 'A']
+
+
+@pytest.mark.dataset_api
+def test_parallel_loading_keeps_order(tmp_path):
+    for i in range(50):
+        write_reads(tmp_path / 'df', 'raw', 'S%d' % i, reads=i)
+    wc_config = load_wc_config()
+    serial = load_sample_set(wc_config, str(tmp_path), 'df', 'raw', io_workers=1)
+    parallel = load_sample_set(wc_config, str(tmp_path), 'df', 'raw', io_workers=8)
+    assert serial.equals(parallel)
+    assert sorted(parallel['reads']) == list(range(50))
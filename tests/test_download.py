@@ -0,0 +1,117 @@
+import os
+import re
+import hashlib
+import threading
+import pytest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import assnake.utils.download
+from assnake.utils.download import download, DownloadError, MANIFEST_SUFFIX, PART_SUFFIX
+
+CONTENT = os.urandom(300 * 1024 + 17)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    '''
+    Serves CONTENT with Range support. Server.fail_after breaks responses after this many bytes.
+    '''
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(CONTENT)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        start, end = (int(match.group(1)), int(match.group(2)) + 1) if match else (0, len(CONTENT))
+        self.server.requests.append((start, end))
+        body = CONTENT[start:end]
+
+        self.send_response(206 if match else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.fail_after is not None:
+            body = body[:self.server.fail_after]
+        self.wfile.write(body)
+        self.server.served += len(body)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(assnake.utils.download, 'MIN_SEGMENT_SIZE', 1024)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    httpd.requests, httpd.served, httpd.fail_after = [], 0, None
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server):
+    return 'http://127.0.0.1:%d/data.zip' % server.server_address[1]
+
+
+@pytest.mark.smoke
+def test_parallel_download(server, tmp_path):
+    dst = str(tmp_path / 'data.zip')
+    result = download(url(server), dst, segments=4, chunk_size=64 * 1024,
+                      checksum='md5:' + hashlib.md5(CONTENT).hexdigest(), progress=False)
+
+    assert open(dst, 'rb').read() == CONTENT
+    assert len(server.requests) == 4
+    assert result.size == len(CONTENT) and result.downloaded == len(CONTENT) and result.throughput > 0
+    assert not os.path.exists(dst + PART_SUFFIX) and not os.path.exists(dst + MANIFEST_SUFFIX)
+
+    # Already downloaded
+    assert download(url(server), dst, progress=False).downloaded == 0
+    assert len(server.requests) == 4
+
+
+@pytest.mark.smoke
+def test_download_resumes(server, tmp_path):
+    dst = str(tmp_path / 'data.zip')
+    server.fail_after = 10 * 1024
+    with pytest.raises(DownloadError):
+        download(url(server), dst, segments=4, chunk_size=1024, progress=False)
+    assert os.path.isfile(dst + MANIFEST_SUFFIX) and not os.path.exists(dst)
+
+    server.fail_after = None
+    server.served = 0
+    result = download(url(server), dst, segments=4, chunk_size=1024, progress=False)
+    assert open(dst, 'rb').read() == CONTENT
+    # Only missing parts of the segments were requested again
+    assert result.downloaded == server.served == len(CONTENT) - 4 * 10 * 1024
+
+
+@pytest.mark.smoke
+def test_checksum_mismatch(server, tmp_path):
+    dst = str(tmp_path / 'data.zip')
+    with pytest.raises(DownloadError, match='Checksum mismatch'):
+        download(url(server), dst, checksum='md5:' + '0' * 32, progress=False)
+    assert not os.path.exists(dst) and not os.path.exists(dst + MANIFEST_SUFFIX)
+
+
+@pytest.mark.smoke
+def test_existing_file_is_verified(server, tmp_path):
+    dst = str(tmp_path / 'data.zip')
+    checksum = 'md5:' + hashlib.md5(CONTENT).hexdigest()
+    with open(dst, 'wb') as f:
+        f.write(b'\0' * len(CONTENT)) # same size, wrong content
+
+    assert download(url(server), dst, segments=4, checksum=checksum, progress=False).downloaded == len(CONTENT)
+    assert open(dst, 'rb').read() == CONTENT
+    assert len(server.requests) == 4
+
+    assert download(url(server), dst, segments=4, checksum=checksum, progress=False).downloaded == 0
+    assert len(server.requests) == 4
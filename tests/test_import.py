@@ -0,0 +1,148 @@
+import os
+import gzip
+import pytest
+
+from assnake.api.fs_helpers import get_samples_from_dir, create_links, copy_file, copy_file_data, merge_gz_files
+from assnake.api.counters import count_fastq_gz
+from tests.util_for_test import count_fs_calls
+
+
+def make_run(run_dir, n_samples, single_end=()):
+    os.makedirs(str(run_dir), exist_ok=True)
+    for i in range(n_samples):
+        strands = ['R1'] if i in single_end else ['R1', 'R2']
+        for strand in strands:
+            (run_dir / 'S-{}_{}_001.fastq.gz'.format(i, strand)).write_bytes(('%d %s' % (i, strand)).encode())
+    samples = get_samples_from_dir(str(run_dir), lambda name: name.replace('-', '_'))
+    samples['df_sample'] = samples['modified_name']
+    return samples
+
+
+@pytest.mark.dataset_api
+@pytest.mark.parametrize('link_mode', ['symlink', 'copy', 'hardlink', 'move'])
+def test_all_samples_are_imported(tmp_path, link_mode):
+    samples = make_run(tmp_path / 'run', 3, single_end=(1,))
+    import_dir = tmp_path / 'df' / 'reads' / 'raw'
+
+    results = create_links(str(import_dir), samples, create_dir_if_not_exist=True, link_mode=link_mode)
+    assert sorted(os.listdir(str(import_dir))) == ['S_0_R1.fastq.gz', 'S_0_R2.fastq.gz', 'S_1_R1.fastq.gz', 'S_2_R1.fastq.gz', 'S_2_R2.fastq.gz']
+    assert (import_dir / 'S_2_R2.fastq.gz').read_bytes() == b'2 R2'
+    assert all(result in [link_mode, 'reflink', 'hardlink', 'copy'] for _, result in results)
+    assert os.path.islink(str(import_dir / 'S_0_R1.fastq.gz')) == (link_mode == 'symlink')
+    assert os.path.exists(str(tmp_path / 'run' / 'S-0_R1_001.fastq.gz')) == (link_mode != 'move')
+
+
+@pytest.mark.dataset_api
+def test_hard_flag_copies_every_sample(tmp_path):
+    samples = make_run(tmp_path / 'run', 5)
+    import_dir = tmp_path / 'raw'
+    create_links(str(import_dir), samples, hard=True, create_dir_if_not_exist=True)
+    assert len(os.listdir(str(import_dir))) == 10
+    assert not any(os.path.islink(str(import_dir / name)) for name in os.listdir(str(import_dir)))
+
+    # Second import doesn't touch existing files
+    results = create_links(str(import_dir), samples, hard=True)
+    assert set(result for _, result in results) == {'exists'}
+
+
+@pytest.mark.dataset_api
+def test_dry_run(tmp_path, capsys):
+    samples = make_run(tmp_path / 'run', 2)
+    results = create_links(str(tmp_path / 'raw'), samples, just_print=True, link_mode='copy')
+    assert len(results) == 4
+    assert not os.path.exists(str(tmp_path / 'raw'))
+    assert 'S-1_R2_001.fastq.gz' in capsys.readouterr().out
+
+
+def make_lane_run(run_dir, n_samples, n_lanes):
+    os.makedirs(str(run_dir), exist_ok=True)
+    for i in range(n_samples):
+        for lane in range(1, n_lanes + 1):
+            for strand in ['R1', 'R2']:
+                reads = ''.join('@S{i}.L{lane}.{r}\nACGT\n+\nFFFF\n'.format(i=i, lane=lane, r=r) for r in range(lane))
+                (run_dir / 'S{}_L00{}_{}_001.fastq.gz'.format(i, lane, strand)).write_bytes(gzip.compress(reads.encode()))
+    samples = get_samples_from_dir(str(run_dir))
+    samples['df_sample'] = samples['modified_name']
+    return samples
+
+
+@pytest.mark.dataset_api
+@pytest.mark.parametrize('link_mode', ['symlink', 'copy', 'move'])
+def test_lanes_are_merged(tmp_path, link_mode):
+    samples = make_lane_run(tmp_path / 'run', 3, 3)
+    import_dir = tmp_path / 'raw'
+    lanes = b''.join((tmp_path / 'run' / 'S1_L00{}_R2_001.fastq.gz'.format(lane)).read_bytes() for lane in [1, 2, 3])
+    results = create_links(str(import_dir), samples, create_dir_if_not_exist=True, link_mode=link_mode, workers=4)
+
+    assert set(result for _, result in results) == {'merge'}
+    assert sorted(os.listdir(str(import_dir))) == ['S{}_{}.fastq.gz'.format(i, strand) for i in range(3) for strand in ['R1', 'R2']]
+    merged = import_dir / 'S1_R2.fastq.gz'
+    assert merged.read_bytes() == lanes
+    lines = gzip.decompress(merged.read_bytes()).decode().split('\n')
+    assert lines[0::4][:-1] == ['@S1.L1.0', '@S1.L2.0', '@S1.L2.1', '@S1.L3.0', '@S1.L3.1', '@S1.L3.2']
+    assert count_fastq_gz(str(merged)) == (6, 24)
+    assert os.path.exists(str(tmp_path / 'run' / 'S1_L001_R1_001.fastq.gz')) == (link_mode != 'move')
+
+
+@pytest.mark.smoke
+def test_merge_gz_files(tmp_path):
+    parts = [os.urandom(1024 * 1024 + i) for i in range(3)]
+    for i, part in enumerate(parts):
+        (tmp_path / str(i)).write_bytes(part)
+    merge_gz_files([str(tmp_path / str(i)) for i in range(3)], str(tmp_path / 'merged'))
+    assert (tmp_path / 'merged').read_bytes() == b''.join(parts)
+    assert not os.path.exists(str(tmp_path / 'merged.part'))
+
+
+@pytest.mark.smoke
+def test_copy_file_data(tmp_path):
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    src.write_bytes(os.urandom(3 * 1024 * 1024 + 5))
+    copy_file_data(str(src), str(dst))
+    assert dst.read_bytes() == src.read_bytes()
+    assert copy_file(str(src), str(tmp_path / 'dst2')) in ['reflink', 'hardlink', 'copy']
+    assert (tmp_path / 'dst2').read_bytes() == src.read_bytes()
+    assert not os.path.exists(str(dst) + '.part')
+
+
+@pytest.mark.smoke
+def test_interrupted_copy_leaves_no_file(tmp_path, monkeypatch):
+    from assnake.api import fs_helpers
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    src.write_bytes(b'reads' * 1000)
+    action = fs_helpers.ImportAction('S', str(src), str(dst))
+
+    # Other filesystem and no reflinks - data is copied
+    def no_link(*args):
+        raise OSError(18, 'Invalid cross-device link')
+    monkeypatch.setattr(fs_helpers, 'reflink', no_link)
+    monkeypatch.setattr(os, 'link', no_link)
+    original_append = fs_helpers.append_file_data
+    def fail(src_file, dst_file, offset):
+        dst_file.write(b'half')
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(fs_helpers, 'append_file_data', fail)
+    with pytest.raises(OSError):
+        fs_helpers.import_file(action, link_mode='copy')
+    assert not os.path.exists(str(dst))
+
+    # Next import is not fooled by the partial copy
+    monkeypatch.setattr(fs_helpers, 'append_file_data', original_append)
+    assert fs_helpers.import_file(action, link_mode='copy') == 'copy'
+    assert dst.read_bytes() == src.read_bytes()
+
+
+@pytest.mark.benchmark
+def test_bulk_import_work_per_file(tmp_path, monkeypatch):
+    '''
+    Import of 4000 planned files does constant work per file and doesn't list the run directory again.
+    '''
+    samples = make_run(tmp_path / 'run', 2000)
+    counts = count_fs_calls(monkeypatch, tmp_path / 'run')
+    results = create_links(str(tmp_path / 'raw'), samples, create_dir_if_not_exist=True, link_mode='copy', workers=8)
+    assert len(results) == 4000 and all(result in ['reflink', 'hardlink', 'copy'] for _, result in results)
+    assert len(os.listdir(str(tmp_path / 'raw'))) == 4000
+    # Files are known from the plan, the run directory is not listed again. At most one open and stat per file (reflink, copystat).
+    assert counts['scandir'] + counts['listdir'] == 0
+    assert counts['open'] <= 4000
+    assert counts['stat'] + counts['lstat'] <= 4000
@@ -0,0 +1,43 @@
+import os
+import pytest
+import pandas as pd
+
+from assnake.api.path_resolver import PathResolver, registered_templates, classify_tree
+from assnake.core.config import load_wc_config
+from tests.test_result_registry import MANIFEST
+from tests.util_for_test import write_reads
+
+
+@pytest.mark.smoke
+def test_resolve_path():
+    resolver = PathResolver(registered_templates(MANIFEST, load_wc_config()))
+
+    resolved = resolver.resolve('/data/x/my_df/reads/raw__tmtic_def/S_1_R1.fastq.gz')
+    assert resolved.result == 'tmtic'
+    assert resolved.wildcards == {'fs_prefix': '/data/x', 'df': 'my_df', 'preproc': 'raw', 'preset': 'def', 'df_sample': 'S_1'}
+
+    resolved = resolver.resolve('/data/my_df/reads/raw/S_1_R2.fastq.gz')
+    assert resolved.wc_key == 'fastq_gz_R2_wc' and resolved.result is None
+    assert resolved.wildcards['df_sample'] == 'S_1'
+
+    assert resolver.resolve('/data/my_df/profile/count/raw/S_1/S_1_R1.count').result == 'count'
+    assert resolver.resolve('/data/my_df/notes.txt') is None
+
+
+@pytest.mark.dataset_api
+def test_classify_tree(tmp_path):
+    full_path = tmp_path / 'my_df'
+    write_reads(full_path, 'raw', 'A', reads=10)
+    write_reads(full_path, 'raw__tmtic_def', 'A')
+    (full_path / 'notes.txt').write_text('')
+
+    classified = classify_tree(str(tmp_path), include_unmatched=True, manifest=MANIFEST, wc_config=load_wc_config())
+    classified = classified.set_index(classified['path'].map(lambda p: os.path.relpath(p, str(tmp_path))))
+
+    assert classified.loc['my_df/reads/raw/A_R1.fastq.gz', 'wc_key'] == 'fastq_gz_R1_wc'
+    assert classified.loc['my_df/reads/raw__tmtic_def/A_R1.fastq.gz', 'result'] == 'tmtic'
+    assert classified.loc['my_df/profile/count/raw/A/A_R2.count', 'result'] == 'count'
+    assert classified.loc['my_df/profile/count/raw/A/A_R2.count', 'strand'] == 'R2'
+    assert (classified['fs_prefix'].dropna() == str(tmp_path)).all()
+    assert pd.isnull(classified.loc['my_df/notes.txt', 'wc_key'])
+    assert classified.loc['my_df/reads/raw/A_R1.fastq.gz', 'bytes'] == 1
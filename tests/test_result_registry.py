@@ -0,0 +1,54 @@
+import re
+import pytest
+
+from assnake.core.result_registry import ResultRegistry
+from assnake.utils.general import wc_template_regex
+
+
+def result_info(plugin, result_type, input_type, result_wc):
+    return {'plugin': plugin, 'result_type': result_type, 'input_type': input_type, 'description': '',
+            'result_wc': result_wc, 'workflows': [], 'wc_config_keys': []}
+
+MANIFEST = {
+    'plugins': {},
+    'results': {
+        'count': result_info('core', 'profile', 'illumina_strand_file',
+                             '{fs_prefix}/{df}/profile/count/{preproc}/{df_sample}/{df_sample}_{strand}.count'),
+        'fastqc': result_info('qc', 'profile', 'illumina_strand_file',
+                              '{fs_prefix}/{df}/profile/fastqc/{preproc}/{df_sample}/{strand}/{df_sample}_{strand}_fastqc.zip'),
+        'tmtic': result_info('qc', 'preprocessing', 'illumina_sample',
+                             '{fs_prefix}/{df}/reads/{preproc}__tmtic_{preset}/{df_sample}_R1.fastq.gz'),
+    }
+}
+
+
+@pytest.mark.smoke
+def test_registry_indexes():
+    registry = ResultRegistry(MANIFEST)
+    assert 'tmtic' in registry and 'nothing' not in registry
+    assert registry.names_by_input_type('illumina_strand_file') == ['count', 'fastqc']
+    assert registry.names_by_result_type('preprocessing') == ['tmtic']
+    assert registry.info('nothing') is None and registry.get('nothing') is None
+
+
+@pytest.mark.smoke
+def test_result_for_path():
+    registry = ResultRegistry(MANIFEST)
+
+    name, wildcards = registry.result_for_path('/data/x/my_df/profile/count/raw/S_1/S_1_R2.count')
+    assert name == 'count'
+    assert wildcards == {'fs_prefix': '/data/x', 'df': 'my_df', 'preproc': 'raw', 'df_sample': 'S_1', 'strand': 'R2'}
+
+    name, wildcards = registry.result_for_path('/data/my_df/reads/raw__tmtic_def/S_1_R1.fastq.gz')
+    assert name == 'tmtic' and wildcards['preproc'] == 'raw' and wildcards['preset'] == 'def'
+
+    # Sample in the directory name and in the file name must be the same
+    assert registry.result_for_path('/data/my_df/profile/count/raw/S_1/S_2_R1.count') is None
+    assert registry.result_for_path('/data/my_df/reads/raw/S_1_R1.fastq.gz') is None
+
+
+@pytest.mark.smoke
+def test_wc_template_regex():
+    pattern = re.compile(wc_template_regex('{df}/{df_sample}_{strand}.fq'))
+    assert pattern.fullmatch('df/S_R1_R2.fq').groupdict() == {'df': 'df', 'df_sample': 'S_R1', 'strand': 'R2'}
+    assert pattern.fullmatch('df/S_R1xfq') is None
@@ -0,0 +1,232 @@
+import os
+import pytest
+
+import assnake
+from assnake.api.sample_index import SampleIndex, SAMPLE_INDEX_FILE
+from tests.util_for_test import write_reads
+
+
+def open_index(assnake_instance):
+    return SampleIndex(
+        os.path.join(assnake_instance['assnake_db'], 'datasets', assnake_instance['df'], SAMPLE_INDEX_FILE),
+        str(assnake_instance['fs_prefix']), assnake_instance['df'])
+
+
+@pytest.mark.dataset_api
+def test_index_matches_filesystem(assnake_instance):
+    full_path = assnake_instance['full_path']
+    write_reads(full_path, 'raw', 'A', reads=10)
+    write_reads(full_path, 'raw', 'B_R1x', strands=('R1',))
+    write_reads(full_path, 'raw__tmtic_def', 'A', reads=7)
+
+    index = open_index(assnake_instance)
+    sample_sets = index.load_sample_sets(['raw', 'raw__tmtic_def'])
+
+    raw = sample_sets['raw'].set_index('df_sample')
+    assert set(raw.index) == {'A', 'B_R1x'}
+    assert raw.loc['A', 'reads'] == 10
+    assert raw.loc['A', 'bytes'] == 2
+    assert raw.loc['B_R1x', 'reads'] == -1
+    assert list(sample_sets['raw__tmtic_def']['reads']) == [7]
+    assert os.path.isfile(full_path / SAMPLE_INDEX_FILE)
+
+
+@pytest.mark.dataset_api
+def test_index_rescans_only_changed_dirs(assnake_instance, monkeypatch):
+    full_path = assnake_instance['full_path']
+    write_reads(full_path, 'raw', 'A', reads=10)
+    index = open_index(assnake_instance)
+    index.load_sample_sets(['raw'])
+
+    # Pretend directory was scanned long ago, so mtime is trusted
+    with index.conn:
+        index.conn.execute('UPDATE dirs SET mtime_ns = ?', (os.stat(full_path / 'reads' / 'raw').st_mtime_ns,))
+
+    scanned = []
+    original_scan = SampleIndex.scan_preproc_dir
+    monkeypatch.setattr(SampleIndex, 'scan_preproc_dir', lambda self, p: scanned.append(p) or original_scan(self, p))
+
+    assert list(index.load_sample_set('raw')['df_sample']) == ['A']
+    assert scanned == []
+
+    write_reads(full_path, 'raw', 'B', reads=3)
+    assert set(index.load_sample_set('raw')['df_sample']) == {'A', 'B'}
+    assert scanned == ['raw']
+
+
+@pytest.mark.dataset_api
+def test_dataset_uses_index(assnake_instance):
+    full_path = assnake_instance['full_path']
+    write_reads(full_path, 'raw', 'A', reads=10)
+    write_reads(full_path, 'raw__tmtic_def', 'A', reads=7)
+
+    df = assnake.Dataset('test_df')
+    assert set(df.sample_sets.keys()) == {'raw', 'raw__tmtic_def'}
+    assert df.self_reads_info.loc['A', 'raw__tmtic_def'] == 7
+
+
+@pytest.mark.dataset_api
+def test_dataset_loads_preprocs_lazily(assnake_instance, monkeypatch):
+    full_path = assnake_instance['full_path']
+    write_reads(full_path, 'raw', 'A', reads=10)
+    write_reads(full_path, 'raw__tmtic_def', 'A', reads=7)
+    os.makedirs(full_path / 'reads' / 'empty')
+
+    loaded = []
+    original = SampleIndex.load_sample_set
+    monkeypatch.setattr(SampleIndex, 'load_sample_set', lambda self, preproc: loaded.append(preproc) or original(self, preproc))
+
+    df = assnake.Dataset('test_df')
+    assert 'Preprocessings: empty, raw, raw__tmtic_def' in str(df)
+    assert loaded == ['raw'] # Dataset type is taken from raw samples
+
+    assert list(df.sample_sets['raw']['reads']) == [10]
+    assert 'empty' not in df.sample_sets and 'missing' not in df.sample_sets
+    assert loaded == ['raw', 'empty']
+    assert 'Samples in raw - 1' in str(df)
+
+    assert sorted(df.sample_sets.keys()) == ['raw', 'raw__tmtic_def']
+    assert len(df.sample_containers) == 2 and df.dataset_type == 'paired-end'
+    assert sorted(loaded) == ['empty', 'raw', 'raw__tmtic_def']
+
+
+@pytest.mark.dataset_api
+def test_dataset_type_from_index(assnake_instance, monkeypatch):
+    import glob
+    full_path = assnake_instance['full_path']
+    write_reads(full_path, 'raw', 'A', strands=('R1',))
+    write_reads(full_path, 'trimmed', 'A')
+
+    df = assnake.Dataset('test_df')
+    with monkeypatch.context() as patch:
+        patch.setattr(glob, 'glob', lambda *args, **kwargs: pytest.fail('reads directory is listed again'))
+        assert df.dataset_type == 'single-end'
+
+    write_reads(full_path, 'raw', 'B')
+    assert assnake.Dataset('test_df').dataset_type == 'paired-end'
+
+
+@pytest.mark.dataset_api
+def test_rescan_writes_changelog(assnake_instance):
+    import pandas as pd
+    from assnake.api.loaders import update_fs_samples_csv
+
+    full_path = assnake_instance['full_path']
+    df_dir_in_db = os.path.join(assnake_instance['assnake_db'], 'datasets', 'test_df')
+    write_reads(full_path, 'raw', 'A', reads=10)
+    write_reads(full_path, 'raw', 'B', reads=3)
+
+    changes = update_fs_samples_csv('test_df')
+    assert sorted((c['change'], c['df_sample']) for c in changes) == [('added', 'A'), ('added', 'B')]
+    assert update_fs_samples_csv('test_df') == []
+
+    os.remove(full_path / 'reads' / 'raw' / 'B_R1.fastq.gz')
+    os.remove(full_path / 'reads' / 'raw' / 'B_R2.fastq.gz')
+    write_reads(full_path, 'raw', 'A', reads=11)
+    changes = update_fs_samples_csv('test_df')
+    assert sorted((c['change'], c['df_sample']) for c in changes) == [('changed', 'A'), ('removed', 'B')]
+
+    changelog = pd.read_csv(os.path.join(df_dir_in_db, 'rescan_changelog.tsv'), sep='\t')
+    assert list(changelog['change']) == ['added', 'added', 'removed', 'changed']
+    samples = pd.read_csv(os.path.join(df_dir_in_db, 'assnake_samples.tsv'), sep='\t')
+    assert list(samples['df_sample']) == ['A']
+    assert list(samples['reads']) == [11]
+
+    from assnake.api.loaders import load_fs_samples
+    loaded = load_fs_samples('test_df')
+    assert list(loaded['reads']) == [11] and str(loaded['preproc'].dtype) == 'category'
+
+
+def make_trusted(full_path, preproc):
+    '''
+    Pretend read and count directories were written long ago, so their mtimes are trusted by the index.
+    '''
+    count_dir = full_path / 'profile' / 'count' / preproc
+    directories = [full_path / 'reads' / preproc, count_dir] + [count_dir / d for d in os.listdir(count_dir)]
+    for directory in directories:
+        os.utime(directory, (0, 0))
+
+
+@pytest.mark.dataset_api
+def test_unchanged_index_does_not_stat_count_files(assnake_instance, monkeypatch):
+    '''
+    If neither read nor count directories changed, count files are not checked one by one on load,
+    only count directories of samples are. Rescan always checks count files.
+    '''
+    full_path = assnake_instance['full_path']
+    for i in range(20):
+        write_reads(full_path, 'raw', 'S%d' % i, reads=i)
+    make_trusted(full_path, 'raw')
+    index = open_index(assnake_instance)
+    index.load_sample_sets(['raw'])
+
+    stat_calls = []
+    original_stat = os.stat
+    monkeypatch.setattr(os, 'stat', lambda path, *args, **kwargs: stat_calls.append(str(path)) or original_stat(path, *args, **kwargs))
+
+    assert sorted(index.load_sample_set('raw')['reads']) == list(range(20))
+    stat_calls = [call for call in stat_calls if call.startswith(str(full_path))]
+    assert not any(call.endswith('.count') for call in stat_calls)
+    assert len(stat_calls) == 2 + 20 # read and count directories and count directories of samples
+
+    stat_calls.clear()
+    assert index.rescan(['raw']) == []
+    stat_calls = [call for call in stat_calls if call.startswith(str(full_path))]
+    assert len([call for call in stat_calls if call.endswith('.count')]) == 2 * 20
+
+    # Sample counted for the first time changes count directory
+    write_reads(full_path, 'raw', 'S20', reads=20)
+    write_reads(full_path, 'raw', 'S0', reads=5)
+    changes = index.rescan(['raw'])
+    assert sorted((c['change'], c['df_sample']) for c in changes) == [('added', 'S20'), ('changed', 'S0')]
+
+
+@pytest.mark.dataset_api
+def test_recounted_sample_is_reloaded(assnake_instance):
+    '''
+    Count file replaced inside existing count directory of sample doesn't change count directory of preprocessing.
+    '''
+    from assnake.api.counters import write_count
+
+    full_path = assnake_instance['full_path']
+    write_reads(full_path, 'raw', 'A', reads=10)
+    write_reads(full_path, 'raw', 'B', reads=3)
+    make_trusted(full_path, 'raw')
+    index = open_index(assnake_instance)
+    reads = lambda: dict(index.load_sample_set('raw')[['df_sample', 'reads']].values)
+    assert reads() == {'A': 10, 'B': 3}
+
+    count_dir = full_path / 'profile' / 'count' / 'raw' / 'A'
+    for strand in ['R1', 'R2']:
+        write_count(str(count_dir / 'A_{}.count'.format(strand)), 99, 9900)
+    os.utime(full_path / 'profile' / 'count' / 'raw', (0, 0))
+    assert reads() == {'A': 99, 'B': 3}
+
+
+@pytest.mark.dataset_api
+def test_count_file_with_zero_mtime(assnake_instance):
+    full_path = assnake_instance['full_path']
+    write_reads(full_path, 'raw', 'A', reads=10)
+    write_reads(full_path, 'raw', 'B', strands=('R1',))
+    for strand in ['R1', 'R2']:
+        os.utime(full_path / 'profile' / 'count' / 'raw' / 'A' / 'A_{}.count'.format(strand), (0, 0))
+
+    index = open_index(assnake_instance)
+    for _ in range(2):
+        assert dict(index.load_sample_set('raw')[['df_sample', 'reads']].values) == {'A': 10, 'B': -1}
+
+
+@pytest.mark.dataset_api
+def test_rescan_finds_counts_rewritten_in_place(assnake_instance):
+    full_path = assnake_instance['full_path']
+    write_reads(full_path, 'raw', 'A', reads=10)
+    make_trusted(full_path, 'raw')
+    index = open_index(assnake_instance)
+    assert index.rescan(['raw'])[0]['change'] == 'added'
+
+    count_loc = full_path / 'profile' / 'count' / 'raw' / 'A' / 'A_R1.count'
+    with open(count_loc, 'w') as count_file:
+        count_file.write('99 9900\n')
+    changes = index.rescan(['raw'])
+    assert [(c['change'], c['df_sample'], c['reads']) for c in changes] == [('changed', 'A', 99)]
+    assert index.rescan(['raw']) == []
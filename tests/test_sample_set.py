@@ -0,0 +1,335 @@
+import os
+import time
+import pytest
+import pandas as pd
+
+from assnake.core.sample_set import generate_result_list
+
+
+def generate_result_list_rowwise(sample_set, wc_str, **kwargs):
+    # Previous implementation, kept as reference
+    res_list = []
+    kwargs.pop('df')
+    kwargs.pop('preproc')
+    for s in sample_set.to_dict(orient='records'):
+        res_list.append(wc_str.format(
+            fs_prefix = s['fs_prefix'].rstrip('\\/'),
+            df = s['df'],
+            preproc = s['preproc'],
+            df_sample = s['df_sample'],
+            **kwargs
+        ))
+    return res_list
+
+
+def make_sample_set(n, fs_prefix='/data/storage/'):
+    return pd.DataFrame({
+        'df': 'my_df',
+        'df_sample': ['sample_%d' % i for i in range(n)],
+        'preproc': 'raw__tmtic_def',
+        'fs_prefix': fs_prefix,
+        'reads': range(n),
+    })
+
+
+TEMPLATES = [
+    '{fs_prefix}/{df}/reads/{preproc}/{df_sample}_{strand}.fastq.gz',
+    '{fs_prefix}/{df}/profile/count/{preproc}/{df_sample}/{df_sample}_{strand}.count',
+    '{fs_prefix}/{df}/taxa/{preproc}/{df_sample}/mp2__{preset}/{df_sample}.{strand!r:>6}.tsv',
+    'constant_target.done',
+]
+
+
+@pytest.mark.smoke
+@pytest.mark.parametrize('wc_str', TEMPLATES)
+def test_same_targets_as_rowwise(wc_str):
+    sample_set = make_sample_set(50)
+    kwargs = {'df': 'my_df', 'preproc': None, 'strand': 'R1', 'preset': 'def', 'meta_column': None}
+    expected = generate_result_list_rowwise(sample_set, wc_str, **kwargs)
+    assert generate_result_list(sample_set, wc_str, **kwargs) == list(dict.fromkeys(expected))
+
+
+@pytest.mark.smoke
+def test_targets_are_deduplicated():
+    sample_set = pd.concat([make_sample_set(3), make_sample_set(3, fs_prefix='/data/storage')])
+    targets = generate_result_list(sample_set, TEMPLATES[0], df='my_df', preproc=None, strand='R2')
+    assert targets == ['/data/storage/my_df/reads/raw__tmtic_def/sample_%d_R2.fastq.gz' % i for i in range(3)]
+    assert generate_result_list(sample_set.iloc[0:0], TEMPLATES[0], df='my_df', preproc=None, strand='R2') == []
+
+    with pytest.raises(KeyError):
+        generate_result_list(sample_set, TEMPLATES[0], df='my_df', preproc=None)
+
+
+@pytest.mark.benchmark
+def test_generate_result_list_works_column_wise(monkeypatch):
+    '''
+    Template is parsed and non-sample wildcards are resolved once, whatever the number of samples, and rows are never iterated.
+    '''
+    import string
+    calls = {'parse': 0, 'get_field': 0}
+    for name in calls.keys():
+        original = getattr(string.Formatter, name)
+        def counted(self, *args, name=name, original=original):
+            calls[name] += 1
+            return original(self, *args)
+        monkeypatch.setattr(string.Formatter, name, counted)
+    def no_rows(*args, **kwargs):
+        raise AssertionError('sample set is iterated row by row')
+    for name in ['iterrows', 'itertuples', 'to_dict', 'apply']:
+        monkeypatch.setattr(pd.DataFrame, name, no_rows)
+
+    kwargs = {'df': 'my_df', 'preproc': None, 'strand': 'R1', 'preset': 'def'}
+    for n in [10, 10000]:
+        calls.update(parse=0, get_field=0)
+        targets = generate_result_list(make_sample_set(n), TEMPLATES[2], **kwargs)
+        assert len(targets) == n
+        assert calls == {'parse': 1, 'get_field': 2}
+
+
+def write_metadata(full_path, rows):
+    pd.DataFrame(rows, columns=['df_sample', 'source', 'day']).to_csv(str(full_path / 'df_samples.tsv'), sep='\t', index=False)
+
+
+@pytest.mark.smoke
+def test_metadata_sheet_is_cached_and_indexed(tmp_path):
+    from assnake.core.metadata import load_metadata
+    assert load_metadata(str(tmp_path)) is None
+    write_metadata(tmp_path, [('A', 'gut', 1), ('B', 'oral', 2), ('C', 'gut', None)])
+    meta = load_metadata(str(tmp_path))
+    assert load_metadata(str(tmp_path)) is meta
+    assert meta.index('source') == {'gut': ['A', 'C'], 'oral': ['B']}
+    assert meta.samples('day', '2.0') == ['B'] and meta.samples('day', 3) == []
+    assert meta.values('day') == ['1.0', '2.0']
+
+    write_metadata(tmp_path, [('A', 'gut', 1), ('B', 'gut', 2)])
+    os.utime(str(tmp_path / 'df_samples.tsv'), ns=(0, int(time.time() + 1) * 10**9))
+    meta = load_metadata(str(tmp_path))
+    assert meta.index('source') == {'gut': ['A', 'B']}
+    assert meta.samples('day', 2) == ['B']
+
+
+@pytest.mark.dataset_api
+def test_dict_of_sample_sets_loads_dataset_once(assnake_instance, monkeypatch):
+    import assnake
+    from assnake.core.config import load_wc_config
+    from assnake.core.sample_set import generic_command_dict_of_sample_sets
+    from tests.util_for_test import write_reads
+
+    n_values = 20
+    rows = []
+    for i in range(3 * n_values):
+        write_reads(assnake_instance['full_path'], 'raw', 'S%d' % i, reads=i)
+        rows.append(('S%d' % i, 'v%d' % (i % n_values), i))
+    rows.append(('not_in_dataset', 'other', 0))
+    write_metadata(assnake_instance['full_path'], rows)
+
+    loads = []
+    original = assnake.Dataset.__init__
+    monkeypatch.setattr(assnake.Dataset, '__init__', lambda self, *args, **kwargs: loads.append(args) or original(self, *args, **kwargs))
+    config = {'requested_dfs': [], 'wc_config': load_wc_config()}
+    sample_sets = generic_command_dict_of_sample_sets(config, 'test_df', 'raw', 'source', None, '', 'S0', timepoint='tp')
+
+    assert len(loads) == 1
+    assert list(sample_sets.keys()) == ['tp__source_v%d' % i for i in range(n_values)]
+    assert sorted(sample_sets['tp__source_v0']['df_sample']) == ['S20', 'S40']
+    assert sorted(sample_sets['tp__source_v1']['reads']) == [1, 21, 41]
+
+    sample_sets = generic_command_dict_of_sample_sets(config, 'test_df', 'raw', 'source', 'v3', '', '', timepoint='tp')
+    assert list(sample_sets.keys()) == ['tp__source_v3']
+    assert sorted(sample_sets['tp__source_v3']['df_sample']) == ['S23', 'S3', 'S43']
+
+
+@pytest.mark.smoke
+def test_selection_mask():
+    from assnake.core.metadata import selection_mask, parse_column_values
+    frame = pd.DataFrame({'df_sample': ['A', 'B', 'C', 'D'], 'reads': [10, 2000, 3000, 50],
+                          'source': ['gut', 'oral', 'gut', None], 'day': [1, 15, 30, 15], 'body site': ['x', 'y', 'x', 'y']})
+    assert parse_column_values('gut,oral') == ['gut', 'oral'] and parse_column_values(None) is None
+    assert list(selection_mask(frame, 'source', ['gut', 'oral'])) == [True, True, True, False]
+    assert list(selection_mask(frame, 'day', ['15'])) == [False, True, False, True]
+    assert list(selection_mask(frame, where='reads > 1e3 and 10 <= day < 20')) == [False, True, False, False]
+    assert list(selection_mask(frame, 'source', ['gut'], where="reads > 100 or `body site` in ['y']")) == [False, False, True, False]
+    assert list(selection_mask(frame, where="source not in ['gut']")) == [False, True, False, True]
+    with pytest.raises(ValueError):
+        selection_mask(frame, where='reads +')
+    with pytest.raises(ValueError):
+        selection_mask(frame, where='reads + 1')
+
+
+@pytest.mark.dataset_api
+def test_where_and_multiple_values(assnake_instance):
+    from assnake.core.config import load_wc_config
+    from assnake.core.sample_set import generic_command_dict_of_sample_sets, generic_command_individual_samples
+    from tests.util_for_test import write_reads
+
+    rows = []
+    for i in range(12):
+        write_reads(assnake_instance['full_path'], 'raw', 'S%d' % i, reads=i * 100)
+        rows.append(('S%d' % i, ['gut', 'oral', 'skin'][i % 3], i))
+    write_metadata(assnake_instance['full_path'], rows)
+    config = {'requested_dfs': [], 'wc_config': load_wc_config()}
+
+    sample_set, name = generic_command_individual_samples(config, 'test_df', 'raw', 'source', 'gut,skin', '', '', where='reads >= 500 and day < 10', timepoint='tp')
+    assert name == 'tp__source_gut+skin'
+    assert sorted(sample_set['df_sample']) == ['S5', 'S6', 'S8', 'S9']
+    assert list(sample_set.columns) == ['df', 'df_sample', 'preproc', 'fs_prefix', 'reads']
+
+    sample_sets = generic_command_dict_of_sample_sets(config, 'test_df', 'raw', 'source', 'gut,skin', '', 'S0', timepoint='tp')
+    assert {k: sorted(v['df_sample']) for k, v in sample_sets.items()} == {
+        'tp__source_gut': ['S3', 'S6', 'S9'], 'tp__source_skin': ['S11', 'S2', 'S5', 'S8']}
+
+    sample_sets = generic_command_dict_of_sample_sets(config, 'test_df', 'raw', 'source', 'gut,skin', '', '', merge=True, where='bps > 0', timepoint='tp')
+    assert list(sample_sets.keys()) == ['tp__source_gut+skin'] and len(sample_sets['tp__source_gut+skin']) == 7
+
+    with pytest.raises(SystemExit):
+        generic_command_individual_samples(config, 'test_df', 'raw', None, None, '', '', where='reads > 1e9')
+
+    # Size of read files is known from the index
+    write_reads(assnake_instance['full_path'], 'raw', 'S12', content=b'1' * 1000, reads=1)
+    sample_set, _ = generic_command_individual_samples(config, 'test_df', 'raw', None, None, '', '', where='bytes > 1000')
+    assert list(sample_set['df_sample']) == ['S12']
+
+
+@pytest.mark.dataset_api
+def test_dataset_cache(assnake_instance, monkeypatch):
+    import assnake
+    from assnake.core.config import load_wc_config
+    from assnake.core.dataset import DatasetCache
+    from assnake.core.sample_set import generic_command_dict_of_sample_sets, generic_command_individual_samples, prepare_sample_set_tsv_and_get_results
+    from tests.util_for_test import write_reads
+
+    for i in range(4):
+        write_reads(assnake_instance['full_path'], 'raw', 'S%d' % i)
+    loads = []
+    original = assnake.Dataset.__init__
+    monkeypatch.setattr(assnake.Dataset, '__init__', lambda self, *args, **kwargs: loads.append(args) or original(self, *args, **kwargs))
+    config = {'requested_dfs': [], 'wc_config': load_wc_config(), 'datasets': DatasetCache()}
+
+    # Chain of three results on one dataset
+    for _ in range(3):
+        sample_sets = generic_command_dict_of_sample_sets(config, 'test_df', 'raw', None, None, '', '', timepoint='tp')
+        prepare_sample_set_tsv_and_get_results(str(assnake_instance['fs_prefix'] / '{df}' / 'sets' / '{sample_set}'), '{fs_prefix}/{df}/{sample_set}.done',
+                                               'test_df', sample_sets, overwrite=False, config=config)
+        generic_command_individual_samples(config, 'test_df', 'raw', None, None, '', '')
+    assert len(loads) == 1
+
+    write_reads(assnake_instance['full_path'], 'raw__tmtic_def', 'S0')
+    sample_set, _ = generic_command_individual_samples(config, 'test_df', None, None, None, '', '')
+    assert len(loads) == 2 and list(sample_set['preproc'].unique()) == ['raw__tmtic_def']
+
+    config['datasets'].invalidate()
+    generic_command_individual_samples(config, 'test_df', 'raw', None, None, '', '')
+    assert len(loads) == 3
+
+
+@pytest.mark.dataset_api
+def test_chained_commands_do_not_rescan(assnake_instance, monkeypatch):
+    '''
+    Chained commands take sample sets from the shared Dataset, the reads directory is scanned
+    and count files are opened only by the first one.
+    '''
+    import builtins
+    import assnake.api.loaders
+    import assnake.api.sample_index
+    from assnake.core.config import load_wc_config
+    from assnake.core.dataset import DatasetCache
+    from assnake.core.sample_set import generic_command_individual_samples
+    from tests.util_for_test import write_reads
+
+    for i in range(10):
+        write_reads(assnake_instance['full_path'], 'raw', 'S%d' % i, reads=i)
+    write_metadata(assnake_instance['full_path'], [('S%d' % i, ['gut', 'oral'][i % 2], i) for i in range(10)])
+
+    calls = {'scans': 0, 'count_opens': 0}
+    def counted_scan(original):
+        return lambda *args, **kwargs: calls.update(scans=calls['scans'] + 1) or original(*args, **kwargs)
+    for module in [assnake.api.loaders, assnake.api.sample_index]:
+        monkeypatch.setattr(module, 'scan_reads_dir', counted_scan(module.scan_reads_dir))
+    original_open = builtins.open
+    def counted_open(file, *args, **kwargs):
+        if str(file).endswith('.count'):
+            calls['count_opens'] += 1
+        return original_open(file, *args, **kwargs)
+    monkeypatch.setattr(builtins, 'open', counted_open)
+
+    config = {'requested_dfs': [], 'wc_config': load_wc_config(), 'datasets': DatasetCache()}
+    first, _ = generic_command_individual_samples(config, 'test_df', 'raw', None, None, 'S1,S2,S3', 'S2')
+    after_first = dict(calls)
+    assert after_first['scans'] == 1 and after_first['count_opens'] == 20
+
+    second, _ = generic_command_individual_samples(config, 'test_df', 'raw', 'source', 'gut', '', '', where='bps >= 400')
+    assert calls == after_first
+    assert sorted(first['df_sample']) == ['S1', 'S3']
+    assert sorted(second['df_sample']) == ['S4', 'S6', 'S8']
+
+
+@pytest.mark.dataset_api
+def test_identical_sample_sets_are_reused(assnake_instance):
+    from assnake.core.sample_set import prepare_sample_set_tsv_and_get_results, sample_set_content_name, destroy_not_run
+
+    fs_prefix = str(assnake_instance['fs_prefix'])
+    sample_set_dir_wc = '{fs_prefix}/{df}/assembly/{sample_set}/'
+    result_wc = '{fs_prefix}/{df}/assembly/{sample_set}/{preset}/final_contigs.fa'
+    sample_set = make_sample_set(5, fs_prefix=fs_prefix).assign(df='test_df')
+    assert sample_set_content_name(sample_set) == sample_set_content_name(sample_set.iloc[::-1].assign(reads=0))
+
+    targets, created = prepare_sample_set_tsv_and_get_results(sample_set_dir_wc, result_wc, 'test_df', {'01Jan20_1200': sample_set}, False, preset='def')
+    content_name = sample_set_content_name(sample_set)
+    assembly_dir = assnake_instance['full_path'] / 'assembly'
+    assert targets == [str(assembly_dir / content_name / 'def' / 'final_contigs.fa')]
+    assert os.readlink(str(assembly_dir / '01Jan20_1200')) == content_name
+    assert len(created['directories']) == 1
+
+    # Same samples requested later under another name
+    same_targets, created = prepare_sample_set_tsv_and_get_results(sample_set_dir_wc, result_wc, 'test_df', {'02Jan20_1300': sample_set.iloc[::-1]}, False, preset='def')
+    assert same_targets == targets
+    assert created == {'directories': [], 'files': [str(assembly_dir / '02Jan20_1300')], 'aliases': {}}
+    assert sorted(os.listdir(str(assembly_dir))) == sorted(['01Jan20_1200', '02Jan20_1300', content_name])
+
+    # Alias is moved to the new sample set
+    other_targets, created = prepare_sample_set_tsv_and_get_results(sample_set_dir_wc, result_wc, 'test_df', {'01Jan20_1200': sample_set.iloc[:3]}, False, preset='def')
+    assert other_targets != targets
+    assert os.readlink(str(assembly_dir / '01Jan20_1200')) == sample_set_content_name(sample_set.iloc[:3])
+    assert len(pd.read_csv(str(assembly_dir / '01Jan20_1200' / 'sample_set.tsv'), sep='\t')) == 3
+    assert created['aliases'] == {str(assembly_dir / '01Jan20_1200'): content_name}
+
+    # Run was cancelled - new sample set is removed, alias points to the previous one again
+    destroy_not_run(created)
+    assert os.readlink(str(assembly_dir / '01Jan20_1200')) == content_name
+    assert sorted(os.listdir(str(assembly_dir))) == sorted(['01Jan20_1200', '02Jan20_1300', content_name])
+
+
+@pytest.mark.dataset_api
+def test_dry_gather_restores_aliases(assnake_instance, monkeypatch):
+    import sys, types
+    from click.testing import CliRunner
+    from assnake.core.sample_set import prepare_sample_set_tsv_and_get_results, sample_set_content_name
+    from assnake.cli.commands.execute_commands import gather
+
+    targets = []
+    fake_snakemake = types.ModuleType('snakemake')
+    fake_snakemake.snakemake = lambda snakefile, **kwargs: targets.extend(kwargs['targets']) or True
+    monkeypatch.setitem(sys.modules, 'snakemake', fake_snakemake)
+
+    fs_prefix = str(assnake_instance['fs_prefix'])
+    sample_set_dir_wc = '{fs_prefix}/{df}/assembly/{sample_set}/'
+    result_wc = '{fs_prefix}/{df}/assembly/{sample_set}/final_contigs.fa'
+    sample_set = make_sample_set(5, fs_prefix=fs_prefix).assign(df='test_df')
+    assembly_dir = assnake_instance['full_path'] / 'assembly'
+    prepare_sample_set_tsv_and_get_results(sample_set_dir_wc, result_wc, 'test_df', {'my_set': sample_set}, False)
+    content_name = sample_set_content_name(sample_set)
+
+    config = {'config': {'drmaa_log_dir': None, 'conda_dir': None}, 'requested_dfs': ['test_df'], 'requests': [],
+              'requested_results': [], 'destroy_if_not_run': []}
+    for name in ['my_set', 'new_set']:
+        res_list, destroy_if_not_run = prepare_sample_set_tsv_and_get_results(
+            sample_set_dir_wc, result_wc, 'test_df', {name: sample_set.iloc[:3]}, False)
+        config['requests'] += res_list
+        config['destroy_if_not_run'].append(destroy_if_not_run)
+    assert os.readlink(str(assembly_dir / 'my_set')) != content_name
+
+    result = CliRunner().invoke(gather, [], obj=config)
+    assert result.exit_code == 0, result.output
+    assert targets == config['requests']
+    assert os.readlink(str(assembly_dir / 'my_set')) == content_name
+    assert sorted(os.listdir(str(assembly_dir))) == sorted(['my_set', content_name])
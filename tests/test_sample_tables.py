@@ -0,0 +1,88 @@
+import os
+import pytest
+import pandas as pd
+
+from assnake.api.sample_tables import write_sample_table, read_sample_table, columnar_loc
+
+
+def make_sample_table(n):
+    return pd.DataFrame({
+        'df': 'my_df',
+        'df_sample': ['%05d' % i for i in range(n)],
+        'preproc': ['raw', 'raw__tmtic_def'] * (n // 2),
+        'fs_prefix': '/data/storage',
+        'reads': range(n),
+    })
+
+
+@pytest.mark.smoke
+def test_round_trip(tmp_path):
+    tsv_loc = str(tmp_path / 'sample_set.tsv')
+    sample_table = make_sample_table(10)
+    write_sample_table(sample_table, tsv_loc)
+    assert os.path.isfile(columnar_loc(tsv_loc))
+    assert pd.read_csv(tsv_loc, sep='\t', dtype={'df_sample': str}).equals(sample_table)
+
+    loaded = read_sample_table(tsv_loc)
+    assert str(loaded['preproc'].dtype) == 'category' and loaded['reads'].dtype == 'int64'
+    assert list(loaded['df_sample']) == list(sample_table['df_sample'])
+    assert loaded.astype({'df': str, 'preproc': str, 'fs_prefix': str}).equals(sample_table.astype({'df': str, 'preproc': str, 'fs_prefix': str}))
+
+
+@pytest.mark.smoke
+def test_edited_tsv_wins(tmp_path):
+    tsv_loc = str(tmp_path / 'sample_set.tsv')
+    write_sample_table(make_sample_table(10), tsv_loc)
+    make_sample_table(4).to_csv(tsv_loc, sep='\t', index=False)
+    os.utime(tsv_loc, ns=(0, os.stat(columnar_loc(tsv_loc)).st_mtime_ns + 10**9))
+    assert len(read_sample_table(tsv_loc)) == 4
+
+    write_sample_table(make_sample_table(6), tsv_loc, columnar=False)
+    assert not os.path.exists(columnar_loc(tsv_loc))
+    loaded = read_sample_table(tsv_loc)
+    assert len(loaded) == 6 and str(loaded['df'].dtype) == 'category'
+
+
+@pytest.mark.smoke
+def test_columnar_copy_is_not_executable(tmp_path, monkeypatch):
+    import numpy as np
+    from assnake.api import sample_tables
+    monkeypatch.setattr(sample_tables, 'pyarrow', None)
+
+    tsv_loc = str(tmp_path / 'sample_set.tsv')
+    sample_table = make_sample_table(10).assign(source=['gut', None] * 5)
+    write_sample_table(sample_table, tsv_loc)
+    assert columnar_loc(tsv_loc).endswith('.npz')
+    with np.load(columnar_loc(tsv_loc), allow_pickle=False) as npz:
+        assert all(npz[key].dtype != object for key in npz.files)
+
+    loaded = read_sample_table(tsv_loc)
+    assert str(loaded['preproc'].dtype) == 'category'
+    assert loaded['source'][0] == 'gut' and pd.isnull(loaded['source'][1])
+    assert list(loaded['df_sample']) == list(sample_table['df_sample'])
+
+    # Corrupted copy is ignored
+    with open(columnar_loc(tsv_loc), 'wb') as f:
+        f.write(b'not a zip')
+    assert len(read_sample_table(tsv_loc)) == 10
+
+    # Columns of other types are not stored in columnar copy
+    write_sample_table(sample_table.assign(when=pd.Timestamp('2020-01-01')), tsv_loc)
+    assert not os.path.exists(columnar_loc(tsv_loc))
+    assert len(read_sample_table(tsv_loc)) == 10
+
+
+@pytest.mark.benchmark
+def test_large_table_is_read_from_columnar_copy(tmp_path, monkeypatch):
+    '''
+    Sample table is read from the columnar copy without parsing the tsv, and the copy is smaller than the tsv.
+    '''
+    tsv_loc = str(tmp_path / 'sample_set.tsv')
+    write_sample_table(make_sample_table(100000), tsv_loc)
+    assert os.path.getsize(columnar_loc(tsv_loc)) < os.path.getsize(tsv_loc)
+
+    def no_tsv(*args, **kwargs):
+        raise AssertionError('tsv is parsed')
+    monkeypatch.setattr(pd, 'read_csv', no_tsv)
+    loaded = read_sample_table(tsv_loc)
+    assert len(loaded) == 100000 and str(loaded['preproc'].dtype) == 'category'
@@ -1,5 +1,8 @@
+import os
 import random
 import string
+import builtins
+import collections
 
 def random_file_name():
     length = random.randint(2, 10)
@@ -8,4 +11,37 @@ def random_file_name():
 
 def random_path():
     nesting = random.randint(2, 10)
-    return '/'.join([random_file_name() for _ in range(nesting)])
\ No newline at end of file
+    return '/'.join([random_file_name() for _ in range(nesting)])
+
+
+def write_reads(full_path, preproc, df_sample, strands=('R1', 'R2'), content=b'1', reads=None):
+    '''
+    Writes fake read files (and optionally .count files) of sample into dataset folder.
+    '''
+    os.makedirs(full_path / 'reads' / preproc, exist_ok=True)
+    for strand in strands:
+        with open(full_path / 'reads' / preproc / '{}_{}.fastq.gz'.format(df_sample, strand), 'wb') as f:
+            f.write(content)
+        if reads is not None:
+            count_dir = full_path / 'profile' / 'count' / preproc / df_sample
+            os.makedirs(count_dir, exist_ok=True)
+            with open(count_dir / '{}_{}.count'.format(df_sample, strand), 'w') as f:
+                f.write('{} {}\n'.format(reads, reads * 100))
+
+
+def count_fs_calls(monkeypatch, root):
+    '''
+    Counts filesystem calls on paths inside root.
+    '''
+    counts = collections.Counter()
+    def wrap(module, name):
+        original = getattr(module, name)
+        def counted(*args, **kwargs):
+            if len(args) > 0 and str(args[0]).startswith(str(root)):
+                counts[name] += 1
+            return original(*args, **kwargs)
+        monkeypatch.setattr(module, name, counted)
+    for name in ['scandir', 'stat', 'lstat', 'listdir']:
+        wrap(os, name)
+    wrap(builtins, 'open')
+    return counts